@@ -0,0 +1,227 @@
+#! /usr/bin/env python
+"""
+Generate synthetic legacy (blastall -m 0) pairwise BLAST reports, and
+FASTA files of the sequences they name, for benchmarking the parsers.
+
+Reports have the layout of real blastn/tblastn output -- header, per-query
+database banner, one-line hit summaries, '>' subject descriptions, Score /
+Identities / Strand (or Frame) lines and 60-column alignment blocks -- with
+hits in decreasing score order, as BLAST writes them.  With 'tblastn',
+subject coordinates are in nucleotides, the query is protein, a subject
+start of five digits runs into its sequence ('Sbjct: 12000MKV...') and a
+Sbjct: line is occasionally one letter short, as with stop codons; these
+are the quirks parse_blast.BlastHitParser.save_subject_line handles.
+
+Usage:
+
+   blast_report.py [-q queries] [-H hits] [-s hsps] [-l length] [--tblastn]
+                   report.txt [queries.fa subjects.fa]
+"""
+
+import sys
+import random
+import argparse
+
+__all__ = ['write_report', 'write_fasta', 'subject_length']
+
+NUCLEOTIDES = 'ACGT'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+LINE_WIDTH = 60
+
+def subject_length(length, tblastn=False):
+    "the length given to every subject, long enough for any of its HSPs."
+    if tblastn:
+        return 30000 + length * 3 + 1000
+    return 3000 + length + 1000
+
+def _evalue(score, rnd):
+    "a BLAST-style e-value that falls as 'score' rises."
+    exponent = int(score / 10)
+    if exponent > 180:
+        return '0.0'
+    return '%de-%d' % (rnd.randint(1, 9), exponent)
+
+def _alignment(rnd, length, alphabet):
+    "return (query, subject) alignment strings with gaps and mismatches."
+    qs = []
+    ss = []
+    for i in range(length):
+        a = rnd.choice(alphabet)
+        r = rnd.random()
+        if r < 0.03:
+            qs.append('-')
+            ss.append(a)
+        elif r < 0.06:
+            qs.append(a)
+            ss.append('-')
+        elif r < 0.15:
+            qs.append(a)
+            ss.append(rnd.choice(alphabet))
+        else:
+            qs.append(a)
+            ss.append(a)
+    return ''.join(qs), ''.join(ss)
+
+def _write_hsp(out, rnd, score, length, tblastn):
+    alphabet = tblastn and AMINO_ACIDS or NUCLEOTIDES
+    qseq, sseq = _alignment(rnd, length, alphabet)
+    ident = sum([ 1 for x, y in zip(qseq, sseq) if x == y ])
+    gaps = qseq.count('-') + sseq.count('-')
+    reverse = rnd.random() < 0.3
+
+    out.write(' Score = %.1f bits (%d), Expect = %s\n' %
+              (score, int(score * 2), _evalue(score, rnd)))
+    if tblastn:
+        out.write(' Identities = %d/%d (%d%%), Positives = %d/%d (%d%%),'
+                  ' Gaps = %d/%d (%d%%)\n' %
+                  (ident, length, ident * 100 // length, ident, length,
+                   ident * 100 // length, gaps, length, gaps * 100 // length))
+        out.write(' Frame = %s%d\n\n' % (reverse and '-' or '+',
+                                          rnd.randint(1, 3)))
+        factor = 3
+    else:
+        out.write(' Identities = %d/%d (%d%%), Gaps = %d/%d (%d%%)\n' %
+                  (ident, length, ident * 100 // length, gaps, length,
+                   gaps * 100 // length))
+        out.write(' Strand = Plus / %s\n\n' % (reverse and 'Minus' or 'Plus'))
+        factor = 1
+
+    qpos = rnd.randint(1, 100)
+    if tblastn:
+        spos = rnd.randint(10000, 30000)
+    else:
+        spos = rnd.randint(1000, 3000)
+    if reverse:
+        spos += length * factor
+    for i in range(0, length, LINE_WIDTH):
+        qchunk = qseq[i:i + LINE_WIDTH]
+        schunk = sseq[i:i + LINE_WIDTH]
+        qn = len(qchunk) - qchunk.count('-')
+        sn = (len(schunk) - schunk.count('-')) * factor
+        qend = qpos + qn - 1
+        if reverse:
+            send = spos - sn + 1
+        else:
+            send = spos + sn - 1
+
+        out.write('Query: %-4d %s %d\n' % (qpos, qchunk, qend))
+        out.write('           %s\n' % ''.join([ x == y and '|' or ' '
+                                                for x, y in zip(qchunk,
+                                                                schunk) ]))
+        if tblastn and rnd.random() < 0.05:
+            schunk = schunk[:-1]        # stop codon: Sbjct: comes up short
+        out.write('Sbjct: %-5d%s %d\n\n' % (spos, schunk, send))
+
+        qpos = qend + 1
+        if reverse:
+            spos = send - 1
+        else:
+            spos = send + 1
+    out.write('\n')
+
+def write_report(out, queries=1000, hits=10, hsps=2, length=150,
+                 tblastn=False, seed=1, subjects=None, query_prefix='q',
+                 subject_prefix='s'):
+    """
+    Write a report of 'queries' queries, each with 'hits' hits of 'hsps'
+    HSPs of 'length' alignment columns, to the file 'out'.  Hits are drawn
+    from 'subjects' subject sequences (by default, as many as queries).
+    Returns a dict of the counts written.
+    """
+    rnd = random.Random(seed)
+    if subjects is None:
+        subjects = max(queries, hits)
+    slen = subject_length(length, tblastn)
+    program = tblastn and 'TBLASTN' or 'BLASTN'
+
+    out.write('%s 2.2.18 [Mar-02-2008]\n\n\n' % program)
+    for q in range(queries):
+        out.write('Query= %s%d synthetic query %d\n' % (query_prefix, q, q))
+        out.write('         (%d letters)\n\n' % (length + 100,))
+        out.write('Database: synthetic.fa\n')
+        out.write('           %d sequences; %d total letters\n\n' %
+                  (subjects, subjects * slen))
+        out.write('Searching..................................done\n\n\n')
+        out.write('                                                         '
+                  '        Score    E\n')
+        out.write('Sequences producing significant alignments:            '
+                  '          (bits) Value\n\n')
+
+        names = [ '%s%d' % (subject_prefix, i)
+                  for i in rnd.sample(xrange(subjects), hits) ]
+        scores = []
+        score = 100.0 + 30 * hits * hsps
+        for name in names:
+            hit_scores = []
+            for k in range(hsps):
+                score -= rnd.randint(1, 30)
+                hit_scores.append(score)
+            scores.append(hit_scores)
+            out.write('%-66s %5d   %s\n' % (name + ' synthetic subject',
+                                             int(hit_scores[0]),
+                                             _evalue(hit_scores[0], rnd)))
+        out.write('\n')
+
+        for name, hit_scores in zip(names, scores):
+            out.write('>%s synthetic subject\n' % (name,))
+            out.write('          Length = %d\n\n' % (slen,))
+            for score in hit_scores:
+                _write_hsp(out, rnd, score, length, tblastn)
+
+        out.write('  Database: synthetic.fa\n')
+        out.write('    Posted date:  Jan 1, 2010  1:00 PM\n')
+        out.write('  Number of letters in database: %d\n' %
+                  (subjects * slen,))
+        out.write('  Number of sequences in database:  %d\n\n' % (subjects,))
+        out.write('Lambda     K      H\n   1.37    0.711     1.31 \n\n')
+
+    return dict(queries=queries, hits=queries * hits,
+                hsps=queries * hits * hsps, subjects=subjects)
+
+def write_fasta(out, n, length, prefix, seed=1, alphabet=NUCLEOTIDES):
+    "Write 'n' random sequences of 'length', named prefix0, prefix1..."
+    rnd = random.Random(seed)
+    for i in range(n):
+        seq = ''.join([ rnd.choice(alphabet) for j in range(length) ])
+        out.write('>%s%d synthetic sequence %d\n' % (prefix, i, i))
+        for j in range(0, length, LINE_WIDTH):
+            out.write(seq[j:j + LINE_WIDTH] + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='generate a synthetic pairwise BLAST report')
+    parser.add_argument('report')
+    parser.add_argument('query_fasta', nargs='?')
+    parser.add_argument('subject_fasta', nargs='?')
+    parser.add_argument('-q', '--queries', type=int, default=1000)
+    parser.add_argument('-H', '--hits', type=int, default=10,
+                        help='hits per query')
+    parser.add_argument('-s', '--hsps', type=int, default=2,
+                        help='HSPs per hit')
+    parser.add_argument('-l', '--length', type=int, default=150,
+                        help='alignment length, in columns')
+    parser.add_argument('--subjects', type=int, default=None,
+                        help='number of distinct subjects')
+    parser.add_argument('--tblastn', action='store_true',
+                        help='write tblastn-style output')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    out = open(args.report, 'w')
+    counts = write_report(out, args.queries, args.hits, args.hsps,
+                          args.length, args.tblastn, args.seed, args.subjects)
+    out.close()
+
+    if args.query_fasta:
+        write_fasta(open(args.query_fasta, 'w'), args.queries,
+                    args.length + 100, 'q', args.seed)
+    if args.subject_fasta:
+        write_fasta(open(args.subject_fasta, 'w'), counts['subjects'],
+                    subject_length(args.length, args.tblastn), 's',
+                    args.seed + 1)
+
+    print >>sys.stderr, 'wrote %(queries)d queries, %(hits)d hits,' \
+          ' %(hsps)d HSPs' % counts
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+"""
+Benchmark the BLAST parsers and the blast/ scripts on synthetic reports.
+
+Usage:
+
+   run-benchmarks.py [-q queries] [-H hits] [-s hsps] [-l length] [--tblastn]
+                     [-r repeats] [-o results.json] [--compare old.json]
+
+A report (and the reverse report and FASTA files the scripts need) is
+generated with blast_report.py, then each benchmark is run in a process of
+its own, so that its peak RSS can be measured.  Parser benchmarks time the
+parse alone; script benchmarks time the whole run, interpreter start-up
+included, with output discarded.  The best time of 'repeats' runs is kept.
+
+Results are written as JSON: the environment, the report parameters and,
+for each benchmark, seconds, records/s (queries), HSPs/s, MB/s and peak
+RSS in KB.  '--compare' prints the speed-up over an earlier results file.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+
+import blast_report
+
+BLAST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'blast')
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+def _hit_parser(report):
+    import parse_blast
+    _consume(parse_blast.BlastHitParser().parse_file(open(report)))
+
+def _parse_fp(report):
+    import blastparser
+    _consume(blastparser.parse_fp(open(report)))
+
+def _parse_fp_compact(report):
+    import blastparser
+    _consume(blastparser.parse_fp(open(report), compact=True,
+                                  fields=('score',)))
+
+def _parse_file_mmap(report):
+    import blastparser
+    _consume(blastparser.parse_file(report, engine='mmap'))
+
+# name -> function(report), each run in a child process.
+PARSER_BENCHMARKS = [
+    ('parse_blast.BlastHitParser.parse_file', _hit_parser),
+    ('blastparser.parse_fp', _parse_fp),
+    ('blastparser.parse_fp(compact)', _parse_fp_compact),
+    ('blastparser.parse_file(mmap)', _parse_file_mmap),
+    ]
+
+# script -> function(files) returning (arguments, stdin file, reports read)
+SCRIPT_BENCHMARKS = [
+    ('blast-to-csv.py', lambda f: ([f.report], None, [f.report])),
+    ('blast-to-csv-with-names.py',
+     lambda f: ([f.queries, f.subjects, f.report], None, [f.report])),
+    ('blast-to-ortho-csv.py',
+     lambda f: ([f.queries, f.subjects, f.report, f.reverse], None,
+                [f.report, f.reverse])),
+    ('calc-blast-cover.py',
+     lambda f: ([f.subjects, f.report, '0', f.queries], None, [f.report])),
+    ('blastparser.py', lambda f: ([f.report, f.report + '.bench.bidx'], None,
+                                  [f.report])),
+    ('parse_blast.py', lambda f: ([], f.report, [f.report])),
+    ]
+
+class _Files(object):
+    "the generated inputs, in 'workdir'."
+    def __init__(self, workdir):
+        self.report = os.path.join(workdir, 'report.txt')
+        self.reverse = os.path.join(workdir, 'reverse.txt')
+        self.queries = os.path.join(workdir, 'queries.fa')
+        self.subjects = os.path.join(workdir, 'subjects.fa')
+
+def generate(files, args):
+    "write the reports and FASTA files; return the forward report's counts."
+    fp = open(files.report, 'w')
+    counts = blast_report.write_report(fp, args.queries, args.hits, args.hsps,
+                                       args.length, args.tblastn, args.seed)
+    fp.close()
+
+    # the reverse search, subjects against queries, for blast-to-ortho-csv.
+    fp = open(files.reverse, 'w')
+    blast_report.write_report(fp, counts['subjects'], args.hits, args.hsps,
+                              args.length, args.tblastn, args.seed + 1,
+                              args.queries, query_prefix='s',
+                              subject_prefix='q')
+    fp.close()
+
+    fp = open(files.queries, 'w')
+    blast_report.write_fasta(fp, args.queries, args.length + 100, 'q',
+                             args.seed)
+    fp.close()
+    fp = open(files.subjects, 'w')
+    blast_report.write_fasta(fp, counts['subjects'],
+                             blast_report.subject_length(args.length,
+                                                         args.tblastn),
+                             's', args.seed + 1)
+    fp.close()
+    return counts
+
+def _run(cmd, stdin=None, stdout=None):
+    """
+    run 'cmd'; return (its output, wall-clock seconds, peak RSS in KB).
+    The child is reaped with wait4, to get its own resource usage.
+    """
+    devnull = open(os.devnull, 'w')
+    if stdin is not None:
+        stdin = open(stdin)
+    start = time.time()
+    p = subprocess.Popen(cmd, stdin=stdin, stdout=stdout or devnull,
+                         stderr=devnull)
+    output = p.stdout and p.stdout.read()
+    _, status, usage = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    p.returncode = status               # already reaped; keep Popen quiet
+    devnull.close()
+
+    if status:
+        raise RuntimeError("%s failed (status %d)" % (' '.join(cmd), status))
+    maxrss = usage.ru_maxrss
+    if sys.platform == 'darwin':        # bytes, not KB
+        maxrss //= 1024
+    return output, elapsed, maxrss
+
+def run_parser_benchmark(name, report):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', name, report]
+    output, _, maxrss = _run(cmd, stdout=subprocess.PIPE)
+    return float(output), maxrss
+
+def run_script_benchmark(script, argv, stdin):
+    cmd = [sys.executable, os.path.join(BLAST_DIR, script)] + argv
+    _, elapsed, maxrss = _run(cmd, stdin)
+    return elapsed, maxrss
+
+def child(name, report):
+    "run one parser benchmark, printing its time."
+    sys.path.insert(0, BLAST_DIR)
+    function = dict(PARSER_BENCHMARKS)[name]
+    start = time.time()
+    function(report)
+    print time.time() - start
+
+def result(name, kind, runs, counts, nbytes):
+    seconds = min([ t for t, _ in runs ])
+    return dict(name=name, kind=kind, seconds=seconds,
+                records=counts['queries'], hsps=counts['hsps'],
+                bytes=nbytes,
+                records_per_s=counts['queries'] / seconds,
+                hsps_per_s=counts['hsps'] / seconds,
+                mb_per_s=nbytes / seconds / 1e6,
+                peak_rss_kb=max([ rss for _, rss in runs ]))
+
+def git_commit():
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=BLAST_DIR,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out = p.communicate()[0].strip()
+    except OSError:
+        return None
+    return p.returncode == 0 and out or None
+
+def compare(results, filename):
+    old = dict([ (r['name'], r) for r in json.load(open(filename))['results'] ])
+    print '%-40s %12s %12s %8s' % ('benchmark', 'old rec/s', 'new rec/s',
+                                   'speedup')
+    for r in results:
+        o = old.get(r['name'])
+        if o is None:
+            continue
+        print '%-40s %12.1f %12.1f %7.2fx' % (r['name'], o['records_per_s'],
+                                              r['records_per_s'],
+                                              o['seconds'] / r['seconds'])
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark the BLAST parsers and scripts')
+    parser.add_argument('-q', '--queries', type=int, default=2000)
+    parser.add_argument('-H', '--hits', type=int, default=10,
+                        help='hits per query')
+    parser.add_argument('-s', '--hsps', type=int, default=2,
+                        help='HSPs per hit')
+    parser.add_argument('-l', '--length', type=int, default=150,
+                        help='alignment length, in columns')
+    parser.add_argument('--tblastn', action='store_true',
+                        help='benchmark tblastn-style output')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+                        help='runs of each benchmark; the best is kept')
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        help='run only this benchmark (may be repeated)')
+    parser.add_argument('-o', '--output', default='benchmark-results.json',
+                        help='where to write the results')
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help='compare with an earlier results file')
+    parser.add_argument('--workdir', help='where to generate the inputs'
+                        ' (default: a temporary directory, removed after)')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='blast-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    files = _Files(workdir)
+
+    try:
+        print >>sys.stderr, 'generating inputs in', workdir
+        counts = generate(files, args)
+        report_size = os.path.getsize(files.report)
+
+        results = []
+        for name, _ in PARSER_BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            print >>sys.stderr, 'running', name
+            runs = [ run_parser_benchmark(name, files.report)
+                     for i in range(args.repeats) ]
+            results.append(result(name, 'parser', runs, counts, report_size))
+
+        for script, make_args in SCRIPT_BENCHMARKS:
+            if args.only and script not in args.only:
+                continue
+            print >>sys.stderr, 'running', script
+            argv, stdin, reports = make_args(files)
+            runs = [ run_script_benchmark(script, argv, stdin)
+                     for i in range(args.repeats) ]
+            nbytes = sum(map(os.path.getsize, reports))
+            results.append(result(script, 'script', runs, counts, nbytes))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = dict(queries=args.queries, hits=args.hits, hsps=args.hsps,
+                  length=args.length, tblastn=args.tblastn, seed=args.seed,
+                  bytes=report_size, total_hsps=counts['hsps'])
+    environment = dict(python=sys.version.split()[0],
+                       platform=platform.platform(),
+                       machine=platform.machine(), commit=git_commit())
+    out = open(args.output, 'w')
+    json.dump(dict(version=1, created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   environment=environment, report=report,
+                   repeats=args.repeats, results=results),
+              out, indent=2, sort_keys=True)
+    out.write('\n')
+    out.close()
+
+    print '%-40s %9s %12s %10s %8s %10s' % ('benchmark', 'seconds', 'records/s',
+                                            'HSPs/s', 'MB/s', 'peak RSS')
+    for r in results:
+        print '%-40s %9.3f %12.1f %10.1f %8.2f %8d KB' % \
+              (r['name'], r['seconds'], r['records_per_s'], r['hsps_per_s'],
+               r['mb_per_s'], r['peak_rss_kb'])
+    print >>sys.stderr, 'results written to', args.output
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
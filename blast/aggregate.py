@@ -0,0 +1,290 @@
+"""
+Streaming group-by aggregation over the HSPs of BLAST records.  Sample
+usage: ::
+
+   agg = Aggregator(by='query', best=Max('score'), n=Count(),
+                    top=TopK('score', 3),
+                    evalues=Histogram('expect', [1e-50, 1e-10, 1e-3]))
+   for record in blastparser.parse_file(filename, compact=True,
+                                        fields=agg.fields()):
+      agg.add(record)
+   for query_name, values in agg.results().items():
+      print query_name, values['best'], values['n']
+
+HSPs are grouped by 'query', 'subject', 'pair' ((query, subject) tuples)
+or None (all of them, under the key None).  Only one state per group and
+aggregation is kept, so memory grows with the number of groups, not of
+HSPs.  Each aggregation is updated once per group per record (or per hit,
+grouping by subject or pair) with a slice of one HSP column -- an array,
+for compact records -- so max, sum and count are builtins over arrays,
+and histograms bisect the bin edges into the sorted slice.
+
+The columns are the HSP attributes in COLUMNS ('score', 'expect',
+'query_start', ...).  Records that are not compact are turned into
+columns first, which is slower.
+"""
+
+import heapq
+from bisect import bisect_left
+from array import array
+
+__all__ = ['Aggregator', 'aggregate', 'Count', 'Sum', 'Max', 'Min', 'Mean',
+           'TopK', 'Histogram', 'GROUP_KEYS', 'COLUMNS']
+
+GROUP_KEYS = ('query', 'subject', 'pair', None)
+
+# HSP attribute -> CompactBlastQuery column
+COLUMNS = dict(score='scores', expect='expects', query_start='query_starts',
+               query_end='query_ends', subject_start='subject_starts',
+               subject_end='subject_ends', identities='identities',
+               mismatches='mismatches', gap_opens='gap_opens',
+               gap_extends='gap_extends', align_length='align_lengths')
+
+class _Aggregation(object):
+    """
+    The aggregation interface: 'field', the column it reads (or None);
+    start(), a new group's state; update(state, values, labels), the state
+    after a slice of the column; and result(state).  'labels' is called
+    for the (query name, subject name) of each value, for aggregations
+    that need them.
+    """
+    field = None
+
+    def __init__(self, field):
+        if field not in COLUMNS:
+            raise ValueError("unknown HSP column %r" % (field,))
+        self.field = field
+
+    def start(self):
+        return None
+
+    def update(self, state, values, labels):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.field)
+
+class Count(_Aggregation):
+    "the number of HSPs."
+    def __init__(self):
+        pass
+
+    def start(self):
+        return 0
+
+    def update(self, state, values, labels):
+        return state + len(values)
+
+    def __repr__(self):
+        return 'Count()'
+
+class Sum(_Aggregation):
+    def start(self):
+        return 0
+
+    def update(self, state, values, labels):
+        return state + sum(values)
+
+class Max(_Aggregation):
+    def update(self, state, values, labels):
+        if not values:
+            return state
+        m = max(values)
+        if state is None or m > state:
+            return m
+        return state
+
+class Min(_Aggregation):
+    def update(self, state, values, labels):
+        if not values:
+            return state
+        m = min(values)
+        if state is None or m < state:
+            return m
+        return state
+
+class Mean(_Aggregation):
+    "the mean, or None for a group with no HSPs."
+    def start(self):
+        return (0, 0)
+
+    def update(self, state, values, labels):
+        return (state[0] + sum(values), state[1] + len(values))
+
+    def result(self, state):
+        total, n = state
+        if not n:
+            return None
+        return total / float(n)
+
+class TopK(_Aggregation):
+    """
+    The k HSPs with the largest values (smallest, if not 'largest'), as a
+    list of (value, query name, subject name), best first.
+    """
+    def __init__(self, field, k, largest=True):
+        _Aggregation.__init__(self, field)
+        self.k = k
+        self.largest = largest
+
+    def start(self):
+        return []
+
+    def update(self, state, values, labels):
+        if not values:
+            return state
+        if self.largest:
+            pick = heapq.nlargest
+        else:
+            pick = heapq.nsmallest
+        best = pick(self.k, xrange(len(values)), values.__getitem__)
+        candidates = [ (values[i],) + labels(i) for i in best ]
+        return pick(self.k, state + candidates, lambda x: x[0])
+
+    def __repr__(self):
+        return 'TopK(%r, %d, largest=%r)' % (self.field, self.k,
+                                             self.largest)
+
+class Histogram(_Aggregation):
+    """
+    Counts of values in the bins between 'edges': a list of
+    len(edges) + 1 counts, where counts[i] is the number of values v with
+    edges[i-1] <= v < edges[i] (the first and last bins are open-ended).
+    """
+    def __init__(self, field, edges):
+        _Aggregation.__init__(self, field)
+        self.edges = sorted(edges)
+
+    def start(self):
+        return array('l', [0] * (len(self.edges) + 1))
+
+    def update(self, state, values, labels):
+        if not values:
+            return state
+        values = sorted(values)
+        last = 0
+        for i, edge in enumerate(self.edges):
+            pos = bisect_left(values, edge)
+            state[i] += pos - last
+            last = pos
+        state[-1] += len(values) - last
+        return state
+
+    def result(self, state):
+        return list(state)
+
+    def __repr__(self):
+        return 'Histogram(%r, %r)' % (self.field, self.edges)
+
+###
+
+def _columns(record, fields):
+    "(subject names, hit offsets, {field: column}) of any BLAST record."
+    if hasattr(record, 'hit_offsets'):
+        return (record.subject_names, record.hit_offsets,
+                dict([ (f, getattr(record, COLUMNS[f])) for f in fields ]))
+
+    names = []
+    offsets = [0]
+    columns = dict([ (f, []) for f in fields ])
+    for hit in record.hits:
+        names.append(hit.subject_name)
+        for match in hit.matches:
+            for f in fields:
+                columns[f].append(getattr(match, f))
+        offsets.append(offsets[-1] + len(hit.matches))
+    return names, offsets, columns
+
+class Aggregator(object):
+    """
+    Named aggregations of the HSPs of a stream of records, grouped by
+    'by' (one of GROUP_KEYS).
+
+      * agg.fields() -- the HSP fields the aggregations need, for the
+        parser's 'fields' option.
+      * agg.add(record) -- fold in the HSPs of one record.
+      * agg.results() -- a dict of group key -> {name: value}.
+      * agg.groups -- the number of groups so far.
+    """
+    def __init__(self, by='query', **aggregations):
+        if by not in GROUP_KEYS:
+            raise ValueError("cannot group by %r" % (by,))
+        if not aggregations:
+            raise ValueError("no aggregations given")
+        self.by = by
+        self.names = sorted(aggregations)
+        self.aggregations = [ aggregations[name] for name in self.names ]
+        self._states = {}
+
+    def fields(self):
+        fields = []
+        for a in self.aggregations:
+            if a.field is not None and a.field not in fields:
+                fields.append(a.field)
+        return tuple(fields)
+
+    @property
+    def groups(self):
+        return len(self._states)
+
+    def _state(self, key):
+        state = self._states.get(key)
+        if state is None:
+            state = [ a.start() for a in self.aggregations ]
+            self._states[key] = state
+        return state
+
+    def _update(self, key, columns, lo, hi, labels):
+        state = self._state(key)
+        count = None
+        for j, a in enumerate(self.aggregations):
+            if a.field is None:
+                if count is None:
+                    count = xrange(lo, hi)
+                values = count
+            else:
+                values = columns[a.field][lo:hi]
+            state[j] = a.update(state[j], values, labels)
+
+    def add(self, record):
+        query_name = record.query_name
+        names, offsets, columns = _columns(record, self.fields())
+
+        if self.by in ('query', None):
+            lo, hi = offsets[0], offsets[len(names)]
+            def labels(i, lo=lo):
+                i += lo
+                # the hit that HSP i belongs to
+                k = bisect_left(offsets, i + 1) - 1
+                return (query_name, names[k])
+            if self.by == 'query':
+                self._update(query_name, columns, lo, hi, labels)
+            else:
+                self._update(None, columns, lo, hi, labels)
+            return
+
+        for k, subject_name in enumerate(names):
+            lo, hi = offsets[k], offsets[k + 1]
+            labels = lambda i, name=subject_name: (query_name, name)
+            if self.by == 'subject':
+                self._update(subject_name, columns, lo, hi, labels)
+            else:
+                self._update((query_name, subject_name), columns, lo, hi,
+                             labels)
+
+    def results(self):
+        results = {}
+        for key, state in self._states.iteritems():
+            results[key] = dict([ (name, a.result(s)) for name, a, s in
+                                  zip(self.names, self.aggregations, state) ])
+        return results
+
+def aggregate(records, by='query', **aggregations):
+    "Aggregate the HSPs of 'records'; return Aggregator.results()."
+    agg = Aggregator(by, **aggregations)
+    for record in records:
+        agg.add(record)
+    return agg.results()
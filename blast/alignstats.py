@@ -0,0 +1,157 @@
+"""
+Alignment statistics of BLAST HSPs -- identities, mismatches, gap opens,
+gap extensions and aligned length -- computed from the alignment strings
+with NumPy, for many HSPs at once.  Sample usage: ::
+
+   stats = alignment_stats(query_seqs, subject_seqs)
+   print stats['identities'][0], stats['align_lengths'][0]
+
+   for record in add_stats(records):     # compact or not
+      print record.identities             # one value per HSP
+
+The alignments of a batch are joined into one byte string per side and
+compared a column at a time; per-HSP counts are differences of cumulative
+sums at the HSP boundaries.  As in BLAST's tabular output, a gap run in
+either sequence is one gap open, every gap column after the first of a run
+is a gap extension, and mismatches are the aligned columns without a gap
+that are not identities.  Letters are compared without regard to case.
+
+BlastParser computes these for the fields in STAT_FIELDS, through
+add_stats(); HSPs without alignment strings (tabular output) get None.
+Requires NumPy.
+"""
+
+from array import array
+
+__all__ = ['STAT_FIELDS', 'STAT_COLUMNS', 'alignment_stats', 'add_stats',
+           'BATCH_HSPS']
+
+# HSP attribute -> CompactBlastQuery column, in alignment_stats() order.
+STAT_COLUMNS = (('identities', 'identities'), ('mismatches', 'mismatches'),
+                ('gap_opens', 'gap_opens'), ('gap_extends', 'gap_extends'),
+                ('align_length', 'align_lengths'))
+STAT_FIELDS = tuple([ field for field, _ in STAT_COLUMNS ])
+
+BATCH_HSPS = 10000
+
+def alignment_stats(query_seqs, subject_seqs, gapchar='-'):
+    """
+    Return a dict of column name (see STAT_COLUMNS) -> NumPy array with
+    one value per alignment in the parallel lists 'query_seqs' and
+    'subject_seqs'.  Each pair must be of the same length.
+    """
+    import numpy
+
+    if not query_seqs:
+        empty = numpy.zeros(0, numpy.int64)
+        return dict([ (column, empty) for _, column in STAT_COLUMNS ])
+
+    lengths = numpy.array([ len(seq) for seq in query_seqs ], numpy.int64)
+    if [ len(seq) for seq in subject_seqs ] != lengths.tolist():
+        raise ValueError("query and subject alignments differ in length")
+    bounds = numpy.zeros(len(lengths) + 1, numpy.int64)
+    numpy.cumsum(lengths, out=bounds[1:])
+    starts = bounds[:-1]
+    starts = starts[lengths > 0]        # HSPs with columns to reset at
+
+    # fold case: clear the 0x20 bit of letters on both sides alike
+    q = numpy.frombuffer(''.join(query_seqs), numpy.uint8) & 0xdf
+    s = numpy.frombuffer(''.join(subject_seqs), numpy.uint8) & 0xdf
+    gap = ord(gapchar) & 0xdf
+    q_gap = q == gap
+    s_gap = s == gap
+    gaps = q_gap | s_gap
+    identical = (q == s) & ~gaps
+
+    # a gap open is a gap column not preceded, in the same HSP, by a gap
+    # on the same side
+    opens = numpy.zeros(len(q), numpy.bool_)
+    opens[1:] = (q_gap[1:] & ~q_gap[:-1]) | (s_gap[1:] & ~s_gap[:-1])
+    opens[starts] = gaps[starts]
+
+    def per_hsp(columns):
+        total = numpy.zeros(len(columns) + 1, numpy.int64)
+        numpy.cumsum(columns, out=total[1:])
+        return total[bounds[1:]] - total[bounds[:-1]]
+
+    identities = per_hsp(identical)
+    n_gaps = per_hsp(gaps)
+    gap_opens = per_hsp(opens)
+    return dict(identities=identities,
+                mismatches=lengths - identities - n_gaps,
+                gap_opens=gap_opens,
+                gap_extends=n_gaps - gap_opens,
+                align_lengths=lengths)
+
+def _longs(values):
+    return array('l', values.astype('l').tostring())
+
+def _alignments(record):
+    "([query seqs], [subject seqs]) of 'record', or None if it has none."
+    if hasattr(record, 'hit_offsets'):
+        q_seqs, s_seqs = record.query_sequences, record.subject_sequences
+        if q_seqs is None:
+            return None
+    else:
+        matches = [ m for hit in record.hits for m in hit.matches ]
+        q_seqs = [ m.query_sequence for m in matches ]
+        s_seqs = [ m.subject_sequence for m in matches ]
+    if None in q_seqs or None in s_seqs:
+        return None
+    return q_seqs, s_seqs
+
+def _apply(batch, keep_sequences):
+    "compute the statistics of a batch of records and store them."
+    q_seqs, s_seqs = [], []
+    for record, seqs in batch:
+        if seqs is not None:
+            q_seqs.extend(seqs[0])
+            s_seqs.extend(seqs[1])
+    stats = alignment_stats(q_seqs, s_seqs)
+
+    pos = 0
+    for record, seqs in batch:
+        if seqs is None:
+            continue
+        n = len(seqs[0])
+        if hasattr(record, 'hit_offsets'):
+            for _, column in STAT_COLUMNS:
+                setattr(record, column, _longs(stats[column][pos:pos + n]))
+            if not keep_sequences:
+                record.query_sequences = record.subject_sequences = None
+        else:
+            rows = zip(*[ stats[column][pos:pos + n].tolist()
+                          for _, column in STAT_COLUMNS ])
+            matches = [ m for hit in record.hits for m in hit.matches ]
+            for match, row in zip(matches, rows):
+                match.identities, match.mismatches, match.gap_opens, \
+                    match.gap_extends, match.align_length = row
+                if not keep_sequences:
+                    match.query_sequence = match.subject_sequence = None
+        pos += n
+
+def add_stats(records, keep_sequences=True, batch_size=BATCH_HSPS):
+    """
+    Yield 'records' with their alignment statistics filled in: as arrays
+    for compact records, as attributes of each submatch otherwise.  The
+    statistics are computed for about 'batch_size' HSPs at a time.  Unless
+    'keep_sequences', the alignment strings are dropped once used.
+    """
+    batch = []
+    n = 0
+    for record in records:
+        seqs = _alignments(record)
+        batch.append((record, seqs))
+        if seqs is not None:
+            n += len(seqs[0])
+        if n >= batch_size:
+            _apply(batch, keep_sequences)
+            for record, _ in batch:
+                yield record
+            batch = []
+            n = 0
+
+    if batch:
+        _apply(batch, keep_sequences)
+        for record, _ in batch:
+            yield record
@@ -0,0 +1,133 @@
+"""
+Minimal reading and writing of BGZF (blocked gzip, as made by 'bgzip')
+files, enough to index and seek into compressed BLAST output.
+
+A BGZF file is a series of gzip members of at most 64 KB each; a position
+in the uncompressed data is given by a 'virtual offset', the compressed
+offset of a block shifted left 16 bits plus the offset within the block.
+"""
+
+import struct
+import zlib
+
+__all__ = ['is_bgzf', 'make_voffset', 'split_voffset', 'read_raw_block',
+           'decompress_block', 'iter_blocks', 'read_at', 'BgzfWriter']
+
+_HEADER = struct.Struct('<4BI2BH')      # ID1 ID2 CM FLG MTIME XFL OS XLEN
+_MAX_BLOCK_DATA = 0xff00
+
+# the empty block that terminates every BGZF file.
+EOF_BLOCK = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+             '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+def make_voffset(coffset, within):
+    return (coffset << 16) | within
+
+def split_voffset(voffset):
+    return voffset >> 16, voffset & 0xffff
+
+def is_bgzf(filename):
+    "Return True if 'filename' starts with a BGZF block header."
+    fp = open(filename, 'rb')
+    try:
+        header = fp.read(18)
+    finally:
+        fp.close()
+    return len(header) == 18 and header[:4] == '\x1f\x8b\x08\x04' \
+           and header[12:14] == 'BC'
+
+def read_raw_block(fp):
+    "Read one compressed block from 'fp'; return '' at end of file."
+    header = fp.read(_HEADER.size)
+    if not header:
+        return ''
+    if len(header) < _HEADER.size:
+        raise IOError('truncated BGZF block header')
+    id1, id2, cm, flg, _, _, _, xlen = _HEADER.unpack(header)
+    if (id1, id2, cm) != (31, 139, 8) or not flg & 4:
+        raise IOError('not a BGZF block')
+
+    extra = fp.read(xlen)
+    bsize = None
+    pos = 0
+    while pos + 4 <= len(extra):
+        si1, si2, slen = struct.unpack('<2BH', extra[pos:pos + 4])
+        if (si1, si2) == (66, 67):
+            bsize = struct.unpack('<H', extra[pos + 4:pos + 6])[0]
+        pos += 4 + slen
+    if bsize is None:
+        raise IOError('gzip block has no BGZF size field')
+
+    rest = fp.read(bsize - xlen - _HEADER.size + 1)
+    if len(rest) < bsize - xlen - _HEADER.size + 1:
+        raise IOError('truncated BGZF block')
+    return header + extra + rest
+
+def decompress_block(raw):
+    "Return the uncompressed data of the block 'raw'."
+    xlen = _HEADER.unpack(raw[:_HEADER.size])[-1]
+    return zlib.decompress(raw[_HEADER.size + xlen:-8], -15)
+
+def iter_blocks(fp, coffset=0):
+    """
+    Yield (compressed offset, uncompressed data) for each block of the BGZF
+    file 'fp', starting at compressed offset 'coffset'.
+    """
+    fp.seek(coffset)
+    while 1:
+        raw = read_raw_block(fp)
+        if not raw:
+            break
+        yield coffset, decompress_block(raw)
+        coffset += len(raw)
+
+def read_at(fp, voffset, length):
+    "Read 'length' uncompressed bytes starting at virtual offset 'voffset'."
+    coffset, within = split_voffset(voffset)
+    chunks = []
+    for _, data in iter_blocks(fp, coffset):
+        if within:
+            data = data[within:]
+            within = 0
+        chunks.append(data[:length])
+        length -= len(chunks[-1])
+        if length <= 0:
+            break
+    return ''.join(chunks)
+
+class BgzfWriter(object):
+    "A write-only file object that compresses its output as BGZF."
+    def __init__(self, fp, level=6):
+        self.fp = fp
+        self.level = level
+        self.buf = []
+        self.buf_size = 0
+
+    def write(self, data):
+        self.buf.append(data)
+        self.buf_size += len(data)
+        if self.buf_size >= _MAX_BLOCK_DATA:
+            data = ''.join(self.buf)
+            while len(data) >= _MAX_BLOCK_DATA:
+                self._write_block(data[:_MAX_BLOCK_DATA])
+                data = data[_MAX_BLOCK_DATA:]
+            self.buf = [data]
+            self.buf_size = len(data)
+
+    def _write_block(self, data):
+        c = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = c.compress(data) + c.flush()
+        bsize = _HEADER.size + 6 + len(cdata) + 8 - 1
+        self.fp.write(_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6))
+        self.fp.write(struct.pack('<2BHH', 66, 67, 2, bsize))
+        self.fp.write(cdata)
+        self.fp.write(struct.pack('<iI', zlib.crc32(data),
+                                  len(data) & 0xffffffff))
+
+    def close(self):
+        data = ''.join(self.buf)
+        if data:
+            self._write_block(data)
+        self.buf = []
+        self.fp.write(EOF_BLOCK)
+        self.fp.close()
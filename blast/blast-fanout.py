@@ -0,0 +1,126 @@
+"""
+Usage:
+
+   blast-fanout.py blast_file [--csv FILE] [--cover REFERENCE]
+                   [--best-hits FILE] [--summary]
+
+Parses 'blast_file' once and produces any of these from the same pass:
+
+ - --csv: the (query, subject, score, expect) rows of blast-to-csv.py;
+ - --cover: the bases of REFERENCE covered by HSPs scoring at least
+   --min-score, as by calc-blast-cover.py (with --cover-queries and
+   --matchlen, only from the queries at least that long);
+ - --best-hits: the best-scoring subjects of each query, as CSV;
+ - --summary: counts of queries, hits and HSPs, and score statistics.
+
+--workers picks where the consumers run: all in the parsing thread
+('inline'), each in a thread of its own, or each in a process of its own.
+"""
+
+import sys
+import csv
+import argparse
+
+import fastaindex
+import metrics
+import pipeline
+import writers
+
+parser = argparse.ArgumentParser(
+    description='produce several outputs from one pass over a BLAST file')
+parser.add_argument('blast_file')
+parser.add_argument('--csv', metavar='FILE',
+                    help="write the HSPs to FILE ('-' for stdout)")
+parser.add_argument('--format', choices=writers.FORMATS, default='csv',
+                    help='--csv output format (default: csv)')
+parser.add_argument('--cover', metavar='REFERENCE',
+                    help='find the bases of REFERENCE covered by the HSPs')
+parser.add_argument('--cover-queries', metavar='FASTA',
+                    help='only count HSPs of the queries in FASTA')
+parser.add_argument('--matchlen', type=int, default=0,
+                    help='with --cover-queries, the shortest query to count')
+parser.add_argument('--min-score', type=float, default=200,
+                    help='lowest HSP score to count for --cover'
+                    ' (default: %(default)s)')
+parser.add_argument('--best-hits', metavar='FILE',
+                    help='write the best hits of each query to FILE as CSV')
+parser.add_argument('--tmpdir', default=None,
+                    help='where to keep temporary files')
+parser.add_argument('--summary', action='store_true',
+                    help='report statistics of the queries and HSPs')
+parser.add_argument('--workers', choices=pipeline.MODES, default='inline',
+                    help='where to run each output (default: inline)')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of processes to parse the BLAST file with')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) a cache of the parsed BLAST file')
+metrics.add_arguments(parser)
+args = parser.parse_args()
+
+if not (args.csv or args.cover or args.best_hits or args.summary):
+    parser.error('nothing to do: give --csv, --cover, --best-hits or'
+                 ' --summary')
+if args.cover_queries and not args.cover:
+    parser.error('--cover-queries needs --cover')
+
+meter = metrics.from_args(args, 'blast-fanout')
+
+# keep stdout for the rows if they go there
+report = sys.stdout
+if args.csv == '-':
+    report = sys.stderr
+
+p = pipeline.Pipeline()
+if args.csv:
+    p.add('csv', pipeline.CSVConsumer(args.csv, args.format), args.workers)
+if args.cover:
+    queries = None
+    if args.cover_queries:
+        with meter.stage('load'):
+            queries = set()
+            idx = fastaindex.open_index(args.cover_queries)
+            for entry in idx:
+                if entry.length >= args.matchlen:
+                    queries.add(entry.name)
+            idx.close()
+    p.add('cover', pipeline.CoverageConsumer(args.cover, queries,
+                                             args.min_score), args.workers)
+if args.best_hits:
+    p.add('best_hits', pipeline.BestHitsConsumer(args.tmpdir, args.blast_file),
+          args.workers)
+if args.summary:
+    p.add('summary', pipeline.SummaryConsumer(), args.workers)
+
+results = p.run_file(args.blast_file, jobs=args.jobs, cache=args.cache,
+                     metrics=meter)
+
+if args.best_hits:
+    best = results['best_hits']
+    with meter.stage('output'):
+        fp = open(args.best_hits, 'wb')
+        output = csv.writer(fp)
+        names = best.names
+        for a, b in best.pairs():
+            output.writerow([names[a], names[b]])
+        fp.close()
+    best.remove()
+
+if args.cover:
+    cover = results['cover']
+    total, covered = cover['total'], cover['covered']
+    print >>report, 'total bases in reference:', total
+    print >>report, 'total ref bases covered :', covered
+    print >>report, 'fraction                :', covered / float(total or 1)
+
+if args.summary:
+    s = results['summary']
+    print >>report, 'queries                 :', s['queries']
+    print >>report, 'queries with hits       :', s['queries_with_hits']
+    print >>report, 'hits                    :', s['hits']
+    print >>report, 'HSPs                    :', s['hsps']
+    if s['hsps']:
+        print >>report, 'score min/mean/max      : %g / %g / %g' % \
+              (s['min_score'], s['mean_score'], s['max_score'])
+        print >>report, 'lowest expect           : %g' % s['min_expect']
+
+metrics.finish(meter, args)
@@ -0,0 +1,73 @@
+"""
+Usage:
+
+   blast-shards-to-csv.py 'out/chunk*.blast' [more shards ...] [-j jobs]
+                          [--order shard|query]
+
+Parses BLAST report shards -- file names or glob patterns, in quotes so
+that the shell leaves them alone -- with a pool of worker processes, and
+writes their HSPs as (query, subject, score, expect) rows to stdout, as
+blast-to-csv.py does for one report.  Rows come in shard order, or with
+--order query, merged into query name order.
+
+Truncated or unreadable shards are listed on stderr once the rest are
+written, and the exit status is then 1.
+"""
+
+import sys
+import argparse
+
+import metrics
+import shards
+import writers
+
+parser = argparse.ArgumentParser(
+    description='parse many BLAST report shards into one CSV stream')
+parser.add_argument('shards', nargs='+',
+                    help='BLAST report shards: file names or glob patterns')
+parser.add_argument('-j', '--jobs', type=int, default=None,
+                    help='number of processes to parse the shards with'
+                    ' (default: one per CPU)')
+parser.add_argument('--order', choices=shards.ORDERS, default='shard',
+                    help='order of the records (default: shard)')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) caches of the parsed shards')
+parser.add_argument('--tmpdir', default=None,
+                    help='where to spill parsed shards for --order query')
+parser.add_argument('--format', choices=writers.FORMATS, default='csv',
+                    help='output format (default: csv)')
+metrics.add_arguments(parser)
+args = parser.parse_args()
+
+meter = metrics.from_args(args, 'blast-shards-to-csv')
+
+try:
+    filenames = shards.expand_shards(args.shards)
+except ValueError, e:
+    parser.error(str(e))
+print >>sys.stderr, 'parsing %d BLAST shards' % len(filenames)
+
+output = writers.open_writer(args.format, sys.stdout,
+                             [('query', 'str'), ('subject', 'str'),
+                              ('score', 'float'), ('expect', 'float')])
+
+problems = []
+for record in shards.parse_shards(filenames, jobs=args.jobs,
+                                  order=args.order, cache=args.cache,
+                                  tmpdir=args.tmpdir, problems=problems,
+                                  metrics=meter, compact=True,
+                                  fields=('score', 'expect')):
+    with meter.stage('output'):
+        output.write_rows(writers.hsp_rows(record, 'score', 'expect'))
+
+with meter.stage('output'):
+    output.close()
+
+metrics.finish(meter, args)
+
+if problems:
+    print >>sys.stderr, '%d of %d shards had problems:' % (len(problems),
+                                                           len(filenames))
+    for problem in problems:
+        print >>sys.stderr, '  ', problem
+    sys.exit(1)
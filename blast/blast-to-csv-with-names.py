@@ -1,46 +1,75 @@
 import sys
-import csv
+import argparse
 import blastparser
-import screed
+import fastaindex
+import metrics
+import writers
 
-def load_names(filename):
-    d = {}
-    for record in screed.open(filename):
-        if record.name.startswith('gi|'):
-           ident = record.name.split('|', 2)[2]
-        else:
-           ident = record.name
-        d[ident] = record.description
-    return d
+def load_names(filename, size):
+    "descriptions from the index of 'filename', looked up as they are needed"
+    return fastaindex.DescriptionCache(fastaindex.open_index(filename), size)
  
-# open the output file for reading
-query_seqs = sys.argv[1]
-against_seqs = sys.argv[2]
+parser = argparse.ArgumentParser()
+parser.add_argument('query_seqs')
+parser.add_argument('against_seqs')
+parser.add_argument('blast_file')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of processes to parse the BLAST file with')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) a cache of the parsed BLAST file')
+parser.add_argument('--descriptions', type=int,
+                    default=fastaindex.DESCRIPTION_CACHE_SIZE,
+                    help='number of sequence descriptions to keep in memory'
+                    ' (default: %(default)s)')
+parser.add_argument('--format', choices=writers.FORMATS, default='csv',
+                    help='output format (default: csv)')
+metrics.add_arguments(parser)
+args = parser.parse_args()
 
-fp = open(sys.argv[3])
+meter = metrics.from_args(args, 'blast-to-csv-with-names')
 
-print >>sys.stderr, "reading query seq names from", query_seqs
-query_db = load_names(query_seqs)
-print >>sys.stderr, "reading against seq names from", against_seqs
-against_db = load_names(against_seqs)
+query_seqs = args.query_seqs
+against_seqs = args.against_seqs
+
+with meter.stage('load'):
+    print >>sys.stderr, "opening query seq names from", query_seqs
+    query_db = load_names(query_seqs, args.descriptions)
+    print >>sys.stderr, "opening against seq names from", against_seqs
+    against_db = load_names(against_seqs, args.descriptions)
  
-# send output as comma-separated values to stdout
-output = csv.writer(sys.stdout)
+# send output as comma-separated values (by default) to stdout
+output = writers.open_writer(args.format, sys.stdout,
+                             [('query', 'str'), ('query_descr', 'str'),
+                              ('subject', 'str'), ('subject_descr', 'str'),
+                              ('score', 'float'), ('expect', 'float')])
  
 # parse BLAST records
 print >>sys.stderr, 'parsing BLAST output'
-for record in blastparser.parse_fp(fp):
+for record in blastparser.parse_file(args.blast_file, jobs=args.jobs,
+                                     cache=args.cache, metrics=meter,
+                                     compact=True, fields=('score', 'expect')):
     query_name = record.query_name
-    for hit in record:
-        for match in hit.matches:
-            if query_name.startswith('gi|'):
-               query_name= query_name.split('|', 2)[2]
-#               print >>sys.stderr, '**', query_descr
-            query_descr = query_db.get(query_name, "")
-            against_descr = against_db.get(hit.subject_name, "")
-            
-            # output each match as a separate row
-            row = [query_name, query_descr,
-                   hit.subject_name, against_descr, match.score,
-                   match.expect]
-            output.writerow(row)
+    with meter.stage('output'):
+        if query_name.startswith('gi|'):
+           query_name= query_name.split('|', 2)[2]
+        query_descr = query_db.get(query_name, "")
+
+        # output each match as a separate row
+        rows = []
+        against_descrs = {}
+        for _, subject_name, score, expect in \
+                writers.hsp_rows(record, 'score', 'expect'):
+            against_descr = against_descrs.get(subject_name)
+            if against_descr is None:
+                against_descr = against_db.get(subject_name, "")
+                against_descrs[subject_name] = against_descr
+            rows.append((query_name, query_descr, subject_name, against_descr,
+                         score, expect))
+        output.write_rows(rows)
+
+with meter.stage('output'):
+    output.close()
+
+for db in (query_db, against_db):
+    meter.count('descriptions_read', db.misses)
+metrics.finish(meter, args)
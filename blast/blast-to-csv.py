@@ -1,18 +1,52 @@
 import sys
-import csv
+import argparse
 import blastparser
+import metrics
+import writers
+
+parser = argparse.ArgumentParser()
+parser.add_argument('blast_file')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of processes to parse the BLAST file with')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) a cache of the parsed BLAST file')
+parser.add_argument('--follow', metavar='CHECKPOINT',
+                    help='follow a BLAST file that is still being written,'
+                    ' saving progress in CHECKPOINT')
+parser.add_argument('--follow-timeout', type=float, default=None,
+                    help='stop following after this many idle seconds')
+parser.add_argument('--format', choices=writers.FORMATS, default='csv',
+                    help='output format (default: csv)')
+metrics.add_arguments(parser)
+args = parser.parse_args()
+
+meter = metrics.from_args(args, 'blast-to-csv')
  
-# open the output file for reading
-fp = open(sys.argv[1])
- 
-# send output as comma-separated values to stdout
-output = csv.writer(sys.stdout)
+# send output as comma-separated values (by default) to stdout
+output = writers.open_writer(args.format, sys.stdout,
+                             [('query', 'str'), ('subject', 'str'),
+                              ('score', 'float'), ('expect', 'float')])
  
 # parse BLAST records
-for record in blastparser.parse_fp(fp):
-    for hit in record:
-        for match in hit.matches:
-            # output each match as a separate row
-            row = [record.query_name, hit.subject_name, match.score,
-                   match.expect]
-            output.writerow(row)
+if args.follow:
+    records = blastparser.follow_file(args.blast_file, args.follow,
+                                      idle_timeout=args.follow_timeout,
+                                      metrics=meter, compact=True,
+                                      fields=('score', 'expect'))
+else:
+    records = blastparser.parse_file(args.blast_file, jobs=args.jobs,
+                                     cache=args.cache, metrics=meter,
+                                     compact=True, fields=('score', 'expect'))
+
+for record in records:
+    with meter.stage('output'):
+        # output each match as a separate row
+        output.write_rows(writers.hsp_rows(record, 'score', 'expect'))
+
+        if args.follow:
+            output.flush()
+
+with meter.stage('output'):
+    output.close()
+
+metrics.finish(meter, args)
@@ -1,35 +1,10 @@
 import sys
 import csv
+import argparse
 import blastparser
-import screed
-
-def collect_best_hits(filename):
-    d = {}
-    for n, record in enumerate(blastparser.parse_fp(open(filename))):
-        if n % 25000 == 0:
-            print >>sys.stderr, '...', filename, n
-        best_score = None
-        for hit in record.hits:
-            for match in hit.matches:
-                query = record.query_name
-                if query.startswith('gi'):
-                    query = query.split('|', 2)[2]
-                subject = hit.subject_name
-
-                score = match.score
-
-                # only keep the best set of scores for any query
-                if best_score and best_score > score:
-                    continue
-                best_score = score
-
-                x = d.get(query, [])
-                x.append((subject, score))
-                d[query] = x
-
-            if best_score and best_score != score:
-                break
-    return d
+import fastaindex
+import metrics
+import rbh
 
 def parse_ncbi_query(name):
     name = name.split('|')[2:]
@@ -37,55 +12,57 @@ def parse_ncbi_query(name):
     return name
 
 def load_names(filename):
-    d = {}
-    for record in screed.open(filename):
-        if record.name.startswith('gi|'):
-           ident = record.name.split('|', 2)[2]
-        else:
-           ident = record.name
-        d[ident] = record.description
-    return d
+    "descriptions from the index of 'filename', looked up as they are needed"
+    return fastaindex.DescriptionCache(fastaindex.open_index(filename))
  
-# open the output file for reading
-query_seqs = sys.argv[1]
-against_seqs = sys.argv[2]
+parser = argparse.ArgumentParser()
+parser.add_argument('query_seqs')
+parser.add_argument('against_seqs')
+parser.add_argument('ab', help='BLAST of query_seqs against against_seqs')
+parser.add_argument('ba', help='BLAST of against_seqs against query_seqs')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) caches of the parsed BLAST files')
+parser.add_argument('--memory', type=int, default=256,
+                    help='MB of best-hit pairs to join in memory, beyond'
+                    ' which they are partitioned on disk (default: 256)')
+parser.add_argument('--tmpdir', default=None,
+                    help='where to keep temporary files')
+parser.add_argument('--serial', action='store_true',
+                    help='parse the two BLAST files one after the other')
+metrics.add_arguments(parser)
+args = parser.parse_args()
 
-ab = sys.argv[3]
-ba = sys.argv[4]
+meter = metrics.from_args(args, 'blast-to-ortho-csv')
 
-print >>sys.stderr, "reading query seq names from", query_seqs
-query_db = load_names(query_seqs)
-print >>sys.stderr, "reading against seq names from", against_seqs
-against_db = load_names(against_seqs)
+query_seqs = args.query_seqs
+against_seqs = args.against_seqs
+
+ab = args.ab
+ba = args.ba
+
+with meter.stage('load'):
+    print >>sys.stderr, "opening query seq names from", query_seqs
+    query_db = load_names(query_seqs)
+    print >>sys.stderr, "opening against seq names from", against_seqs
+    against_db = load_names(against_seqs)
  
 # send output as comma-separated values to stdout
 output = csv.writer(sys.stdout)
  
-# parse BLAST records
-print >>sys.stderr, 'parsing BLAST output', ab
-ab_dict = collect_best_hits(ab)
-print >>sys.stderr, 'parsing BLAST output', ba
-ba_dict = collect_best_hits(ba)
-
-print >>sys.stderr, 'calculating reciprocal best hits'
-dd = {}
-ee = {}
-for k in ab_dict:
-    v = map(lambda x: x[0], ab_dict[k])
-
-    for k2 in v:
-        v2 = map(lambda x: x[0], ba_dict.get(k2, []))
-
-        if k in v2:
-            dd[k] = k2
-            ee[k2] = k
+# parse BLAST records and join their best hits
+print >>sys.stderr, 'parsing BLAST output', ab, 'and', ba
+pairs = rbh.reciprocal_best_hits(ab, ba, cache=args.cache,
+                                 concurrent=not args.serial,
+                                 memory=args.memory * 1024 * 1024,
+                                 tmpdir=args.tmpdir, metrics=meter)
 
-for k in dd:
-    v = dd[k]
+for k, v in pairs:
+    with meter.stage('output'):
+        query_descr = query_db.get(k, "")
+        against_descr = against_db.get(v, "")
 
-    query_descr = query_db.get(k, "")
-    against_descr = against_db.get(v, "")
+        # output each match as a separate row
+        row = [k, query_descr, v, against_descr]
+        output.writerow(row)
 
-    # output each match as a separate row
-    row = [k, query_descr, v, against_descr]
-    output.writerow(row)
+metrics.finish(meter, args)
@@ -0,0 +1,141 @@
+"""
+All-vs-all reciprocal best hits between many genomes.
+
+Usage:
+
+   blast-to-ortho-matrix.py manifest outdir [-j jobs]
+
+The manifest lists the genomes and the BLAST reports between them, one
+per line, separated by whitespace; blank lines and '#' comments are
+ignored, and relative paths are taken from the manifest's directory: ::
+
+   genome  human   human.fa
+   genome  mouse   mouse.fa
+   blast   human   mouse   human.x.mouse
+   blast   mouse   human   mouse.x.human
+
+('blast A B report' is the BLAST of A's sequences against B's.)  For each
+pair of genomes with reports both ways, outdir/A-B.csv gets the reciprocal
+best hits, as by blast-to-ortho-csv.py; outdir/orthologs.csv gets the
+ortholog groups they make, one row per group and one column per genome.
+"""
+
+import os
+import sys
+import csv
+import argparse
+import itertools
+
+import fastaindex
+import metrics
+import rbh
+
+def read_manifest(filename):
+    "return ([(genome, fasta filename)], {(A, B): report filename})."
+    genomes = []
+    reports = {}
+    topdir = os.path.dirname(os.path.abspath(filename))
+    for n, line in enumerate(open(filename)):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        if fields[0] == 'genome' and len(fields) == 3:
+            genomes.append((fields[1], os.path.join(topdir, fields[2])))
+        elif fields[0] == 'blast' and len(fields) == 4:
+            reports[(fields[1], fields[2])] = os.path.join(topdir, fields[3])
+        else:
+            raise ValueError("%s, line %d: cannot parse %r"
+                             % (filename, n + 1, line.strip()))
+
+    known = set([ genome for genome, _ in genomes ])
+    for a, b in reports:
+        for genome in (a, b):
+            if genome not in known:
+                raise ValueError("%s: no sequences given for genome %r"
+                                 % (filename, genome))
+    return genomes, reports
+
+def load_names(filename, names):
+    "return a dict of name -> description; intern the names into 'names'."
+    d = {}
+    idx = fastaindex.open_index(filename)
+    for entry in idx:
+        ident = fastaindex.normalize_name(entry.name)
+        names.intern(ident)
+        d[ident] = entry.description
+    idx.close()
+    return d
+
+parser = argparse.ArgumentParser(
+    description='reciprocal best hits between all pairs of genomes')
+parser.add_argument('manifest', help='the genomes and BLAST reports')
+parser.add_argument('outdir', help='where to write the CSV files')
+parser.add_argument('-j', '--jobs', type=int, default=None,
+                    help='BLAST reports to parse at once (default: one per'
+                    ' CPU)')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) caches of the parsed BLAST files')
+parser.add_argument('--memory', type=int, default=256,
+                    help='MB of best-hit pairs to join in memory, beyond'
+                    ' which they are partitioned on disk (default: 256)')
+parser.add_argument('--tmpdir', default=None,
+                    help='where to keep temporary files')
+metrics.add_arguments(parser)
+args = parser.parse_args()
+
+meter = metrics.from_args(args, 'blast-to-ortho-matrix')
+
+genomes, reports = read_manifest(args.manifest)
+if not os.path.isdir(args.outdir):
+    os.makedirs(args.outdir)
+
+# interning the sequence names in FASTA order first numbers them the same
+# way however the reports come in, so that the output order is stable.
+names = rbh.NameTable()
+descriptions = {}
+with meter.stage('load'):
+    for genome, filename in genomes:
+        print >>sys.stderr, "reading %s seq names from %s" % (genome, filename)
+        descriptions[genome] = load_names(filename, names)
+
+print >>sys.stderr, 'parsing %d BLAST reports' % len(reports)
+pairs = rbh.all_reciprocal_best_hits(reports, names, jobs=args.jobs,
+                                     cache=args.cache,
+                                     memory=args.memory * 1024 * 1024,
+                                     tmpdir=args.tmpdir, metrics=meter)
+
+groups = rbh.OrthologGroups()
+written = set()
+for (a, b), rows in itertools.groupby(pairs, lambda row: row[:2]):
+    written.add((a, b))
+    filename = os.path.join(args.outdir, '%s-%s.csv' % (a, b))
+    print >>sys.stderr, 'writing', filename
+    fp = open(filename, 'wb')
+    output = csv.writer(fp)
+    for _, _, k, v in rows:
+        with meter.stage('output'):
+            query_descr = descriptions[a].get(k, "")
+            against_descr = descriptions[b].get(v, "")
+            output.writerow([k, query_descr, v, against_descr])
+            groups.add(a, k, b, v)
+    fp.close()
+
+# pairs with reports both ways but no reciprocal best hits get an empty file
+for a, b in sorted(reports):
+    if a < b and (b, a) in reports and (a, b) not in written:
+        filename = os.path.join(args.outdir, '%s-%s.csv' % (a, b))
+        print >>sys.stderr, 'writing', filename
+        open(filename, 'wb').close()
+
+with meter.stage('output'):
+    filename = os.path.join(args.outdir, 'orthologs.csv')
+    print >>sys.stderr, 'writing', filename
+    fp = open(filename, 'wb')
+    output = csv.writer(fp)
+    output.writerow(['group'] + [ genome for genome, _ in genomes ])
+    for n, group in enumerate(groups.groups()):
+        output.writerow([n + 1] + [ ';'.join(group.get(genome, []))
+                                    for genome, _ in genomes ])
+    fp.close()
+
+metrics.finish(meter, args)
@@ -0,0 +1,279 @@
+"""
+A columnar binary cache of the HSPs parsed from a BLAST report, so that
+repeat runs over the same report skip parsing entirely.
+
+The cache is written beside the report, in '<report>.bcache', the first
+time the report is parsed with caching on; later runs memory-map it and
+read the columns as NumPy arrays.  It holds, as 8-byte-aligned raw arrays:
+
+ - query and subject name tables (names concatenated, plus offsets); each
+   distinct subject name is stored once;
+ - per query, the range of its hits (query_hit_offsets); per hit, its
+   subject number and the range of its HSPs (hit_subjects,
+   hit_hsp_offsets);
+ - per HSP, the numeric columns of CompactBlastQuery (expects, scores,
+   query_starts, query_ends, subject_starts, subject_ends).
+
+Alignment strings are not cached.  The cache is keyed by the report's
+size, mtime and an MD5 digest of sampled blocks of its content (hashing all
+of a multi-GB report would cost more than parsing it), and is ignored if
+any of them differ.  Requires NumPy.
+"""
+
+import os
+import json
+import mmap
+import shutil
+import struct
+import hashlib
+import tempfile
+from array import array
+
+import numpy
+
+import blastparser
+
+__all__ = ['BlastCache', 'cache_filename', 'fingerprint', 'load_cache',
+           'cached_records']
+
+MAGIC = 'BLASTCOL'
+VERSION = 1
+
+# how much of the report, and at how many places, fingerprint() hashes.
+SAMPLE_SIZE = 1 << 20
+SAMPLE_COUNT = 3
+
+# (column, array typecode); the typecodes are also NumPy dtypes.
+HSP_COLUMNS = (('expects', 'd'), ('scores', 'd'),
+               ('query_starts', 'l'), ('query_ends', 'l'),
+               ('subject_starts', 'l'), ('subject_ends', 'l'))
+COLUMNS = HSP_COLUMNS + (('hit_hsp_offsets', 'l'), ('hit_subjects', 'l'),
+                         ('query_hit_offsets', 'l'),
+                         ('query_name_offsets', 'l'), ('query_names', 'c'),
+                         ('subject_name_offsets', 'l'),
+                         ('subject_names', 'c'))
+
+def cache_filename(blast_filename):
+    return blast_filename + '.bcache'
+
+def fingerprint(blast_filename):
+    "(size, mtime, sampled content digest) identifying 'blast_filename'."
+    st = os.stat(blast_filename)
+    h = hashlib.md5()
+    fp = open(blast_filename, 'rb')
+    try:
+        for i in range(SAMPLE_COUNT):
+            fp.seek(max(0, st.st_size - SAMPLE_SIZE) * i //
+                    max(1, SAMPLE_COUNT - 1))
+            h.update(fp.read(SAMPLE_SIZE))
+    finally:
+        fp.close()
+    return [st.st_size, st.st_mtime, h.hexdigest()]
+
+class _CacheWriter(object):
+    """
+    Streams CompactBlastQuery records into one temporary file per column,
+    then assembles them into a cache file, so that memory use depends only
+    on the number of distinct subjects.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmpdir = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(filename)))
+        self.files = dict([ (name, open(os.path.join(self.tmpdir, name), 'wb'))
+                            for name, _ in COLUMNS ])
+        self.subject_ids = {}
+        self.subject_names = []
+        self.n_hits = 0
+        self.n_hsps = 0
+        self.query_names_size = 0
+
+        array('l', [0]).tofile(self.files['hit_hsp_offsets'])
+        array('l', [0]).tofile(self.files['query_hit_offsets'])
+        array('l', [0]).tofile(self.files['query_name_offsets'])
+
+    def add(self, record):
+        files = self.files
+        for name, _ in HSP_COLUMNS:
+            getattr(record, name).tofile(files[name])
+
+        subjects = array('l')
+        for subject_name in record.subject_names:
+            i = self.subject_ids.get(subject_name)
+            if i is None:
+                i = self.subject_ids[subject_name] = len(self.subject_names)
+                self.subject_names.append(subject_name)
+            subjects.append(i)
+        subjects.tofile(files['hit_subjects'])
+
+        offsets = array('l', [ self.n_hsps + x
+                               for x in record.hit_offsets[1:] ])
+        offsets.tofile(files['hit_hsp_offsets'])
+
+        self.n_hits += len(record.subject_names)
+        self.n_hsps += len(record.scores)
+        array('l', [self.n_hits]).tofile(files['query_hit_offsets'])
+
+        files['query_names'].write(record.query_name)
+        self.query_names_size += len(record.query_name)
+        array('l', [self.query_names_size]).tofile(
+            files['query_name_offsets'])
+
+    def finish(self, key):
+        "write the cache file, tagged with the report fingerprint 'key'."
+        offsets = array('l', [0])
+        for name in self.subject_names:
+            self.files['subject_names'].write(name)
+            offsets.append(offsets[-1] + len(name))
+        offsets.tofile(self.files['subject_name_offsets'])
+
+        for fp in self.files.values():
+            fp.close()
+
+        # lay the columns out after the header, each 8-byte aligned.
+        columns = {}
+        pos = 0
+        for name, typecode in COLUMNS:
+            size = os.path.getsize(os.path.join(self.tmpdir, name))
+            itemsize = array(typecode).itemsize
+            columns[name] = (typecode, pos, size // itemsize)
+            pos += (size + 7) & ~7
+
+        header = json.dumps(dict(key=key, columns=columns))
+        start = (16 + len(header) + 7) & ~7
+
+        tmpname = self.filename + '.tmp'
+        out = open(tmpname, 'wb')
+        try:
+            out.write(MAGIC + struct.pack('<II', VERSION, len(header)))
+            out.write(header)
+            for name, _ in COLUMNS:
+                typecode, offset, _ = columns[name]
+                out.seek(start + offset)
+                fp = open(os.path.join(self.tmpdir, name), 'rb')
+                shutil.copyfileobj(fp, out, 1 << 20)
+                fp.close()
+            out.truncate(start + pos)
+        finally:
+            out.close()
+        os.rename(tmpname, self.filename)
+        self.abort()
+
+    def abort(self):
+        for fp in self.files.values():
+            fp.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+class BlastCache(object):
+    """
+    An open cache file.  Each column in COLUMNS is available as a NumPy
+    array attribute, mapped directly from the file.
+
+    Methods:
+
+      * len(cache) -- the number of queries.
+      * key -- the fingerprint of the report the cache was built from.
+      * query_name(i), subject_name(j)
+      * record(i) -- query i as a CompactBlastQuery.
+      * iter(cache) -- all CompactBlastQuery records, in report order.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        fp = open(filename, 'rb')
+        try:
+            self.m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        magic = self.m[:8]
+        version, header_len = struct.unpack('<II', self.m[8:16])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a BLAST cache" % (filename,))
+        header = json.loads(self.m[16:16 + header_len])
+        self.key = header['key']
+
+        start = (16 + header_len + 7) & ~7
+        for name, (typecode, offset, count) in header['columns'].items():
+            dtype = numpy.dtype(typecode == 'c' and 'S1' or str(typecode))
+            setattr(self, str(name),
+                    numpy.frombuffer(self.m, dtype, count, start + offset))
+
+        self.n = len(self.query_hit_offsets) - 1
+
+    def __len__(self):
+        return self.n
+
+    def _name(self, blob, offsets, i):
+        return blob[offsets[i]:offsets[i + 1]].tostring()
+
+    def query_name(self, i):
+        return self._name(self.query_names, self.query_name_offsets, i)
+
+    def subject_name(self, j):
+        return self._name(self.subject_names, self.subject_name_offsets, j)
+
+    def record(self, i):
+        h0, h1 = self.query_hit_offsets[i], self.query_hit_offsets[i + 1]
+        s0 = self.hit_hsp_offsets[h0]
+        s1 = self.hit_hsp_offsets[h1]
+
+        record = blastparser.CompactBlastQuery(self.query_name(i), False)
+        record.subject_names = [ self.subject_name(j)
+                                 for j in self.hit_subjects[h0:h1] ]
+        record.hit_offsets = array('l', (self.hit_hsp_offsets[h0:h1 + 1]
+                                         - s0).tostring())
+        for name, typecode in HSP_COLUMNS:
+            setattr(record, name,
+                    array(typecode, getattr(self, name)[s0:s1].tostring()))
+        return record
+
+    def __iter__(self):
+        for i in xrange(self.n):
+            yield self.record(i)
+
+    def close(self):
+        self.m.close()
+
+def load_cache(blast_filename, filename=None):
+    """
+    Return the BlastCache for 'blast_filename', or None if there is none or
+    it does not match the report's current fingerprint.
+    """
+    if filename is None:
+        filename = cache_filename(blast_filename)
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        cache = BlastCache(filename)
+    except ValueError:
+        return None
+    if cache.key != fingerprint(blast_filename):
+        cache.close()
+        return None
+    return cache
+
+def cached_records(blast_filename, parse_records, filename=None):
+    """
+    Yield CompactBlastQuery records for 'blast_filename' from its cache if
+    that is current; otherwise yield them from 'parse_records()', writing a
+    new cache as they go (the cache is only kept if they are all read).
+    """
+    cache = load_cache(blast_filename, filename)
+    if cache is not None:
+        for record in cache:
+            yield record
+        return
+
+    if filename is None:
+        filename = cache_filename(blast_filename)
+    key = fingerprint(blast_filename)
+    writer = _CacheWriter(filename)
+    try:
+        for record in parse_records():
+            writer.add(record)
+            yield record
+    except:
+        writer.abort()
+        raise
+    writer.finish(key)
@@ -0,0 +1,341 @@
+"""
+A persistent byte-offset index for random access to the records of a
+(plain or bgzip-compressed) text BLAST report, by query name.
+
+Building the index is a single sequential pass that notes where each
+'Query=' record starts and how long it is; nothing is parsed.  Looking a
+query up hashes its name into an on-disk table, reads just that record's
+bytes from the report and parses them.  Sample usage: ::
+
+   idx = open_index('blast_output.txt')      # builds it if necessary
+   record = idx['query_name']
+   for name, record in idx:
+      print name, len(record)
+
+The index is stored beside the report, in '<report>.bidx', as
+
+ - a header (see _HEADER) with the record and hash-slot counts and the
+   size and mtime of the report it was built from;
+ - one (offset, length, name offset, name length) entry per record, in
+   file order; offsets are virtual offsets for bgzip-compressed reports;
+ - an open-addressing hash table of record numbers, keyed by crc32(name);
+ - the record names, concatenated.
+"""
+
+import os
+import mmap
+import struct
+import zlib
+import itertools
+from cStringIO import StringIO
+
+import blastparser
+import bgzf
+
+__all__ = ['BlastIndex', 'build_index', 'open_index', 'index_filename']
+
+MAGIC = 'BLASTIDX'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIIQQQdQ')
+_ENTRY = struct.Struct('<QQQI4x')
+_SLOT = struct.Struct('<I')
+
+def index_filename(blast_filename):
+    return blast_filename + '.bidx'
+
+def _slot_of(name, n_slots):
+    return (zlib.crc32(name) & 0xffffffff) % n_slots
+
+def _query_name(line):
+    "the query name on a 'Query=' line, as BlastHitParser.save_query takes it"
+    return line.split()[1]
+
+def _scan_plain(filename):
+    "yield (offset, name) for each 'Query=' line of a plain text report."
+    fp = open(filename, 'rb')
+    try:
+        if not os.fstat(fp.fileno()).st_size:
+            return
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fp.close()
+
+    try:
+        pos = 0
+        if m[:6] != 'Query=':
+            pos = m.find('\nQuery=') + 1
+        while pos or m[:6] == 'Query=':
+            end = m.find('\n', pos)
+            if end < 0:
+                end = len(m)
+            yield pos, _query_name(m[pos:end])
+            pos = m.find('\nQuery=', end) + 1
+            if not pos:
+                break
+    finally:
+        m.close()
+
+def _scan_bgzf(filename):
+    """
+    yield (virtual offset, uncompressed offset, name) for each 'Query=' line
+    of a bgzip-compressed report, and finally (None, total size, None).
+    """
+    fp = open(filename, 'rb')
+    try:
+        carry = ''                      # incomplete last line so far...
+        carry_voffset = 0               # ...and where it starts
+        carry_upos = 0
+        upos = 0                        # uncompressed offset of this block
+
+        for coffset, block in bgzf.iter_blocks(fp):
+            data = carry + block
+            last_nl = data.rfind('\n')
+            if last_nl < 0:
+                carry = data
+                upos += len(block)
+                continue
+
+            lines = data[:last_nl + 1]
+            pos = 0
+            if not lines.startswith('Query='):
+                pos = lines.find('\nQuery=') + 1
+            while pos or lines.startswith('Query='):
+                end = lines.find('\n', pos)
+                if pos == 0:
+                    voffset, line_upos = carry_voffset, carry_upos
+                else:
+                    within = pos - len(carry)
+                    voffset = bgzf.make_voffset(coffset, within)
+                    line_upos = upos + within
+                yield voffset, line_upos, _query_name(lines[pos:end])
+                pos = lines.find('\nQuery=', end) + 1
+                if not pos:
+                    break
+
+            within = last_nl + 1 - len(carry)
+            carry = data[last_nl + 1:]
+            carry_voffset = bgzf.make_voffset(coffset, within)
+            carry_upos = upos + within
+            upos += len(block)
+    finally:
+        fp.close()
+
+    yield None, upos, None
+
+def build_index(blast_filename, filename=None):
+    """
+    Index the text BLAST report 'blast_filename' in one sequential pass,
+    writing the index to 'filename' (by default, index_filename()).
+    Returns the index filename.
+    """
+    if filename is None:
+        filename = index_filename(blast_filename)
+
+    st = os.stat(blast_filename)
+    compressed = bgzf.is_bgzf(blast_filename)
+    if not compressed and open(blast_filename, 'rb').read(2) == '\x1f\x8b':
+        raise ValueError("%s is gzipped, and cannot be indexed; recompress"
+                         " it with bgzip" % (blast_filename,))
+
+    offsets = []
+    names = []
+    if compressed:
+        upositions = []
+        for voffset, upos, name in _scan_bgzf(blast_filename):
+            upositions.append(upos)
+            if name is not None:
+                offsets.append(voffset)
+                names.append(name)
+        lengths = [ b - a for (a, b) in zip(upositions, upositions[1:]) ]
+    else:
+        for offset, name in _scan_plain(blast_filename):
+            offsets.append(offset)
+            names.append(name)
+        ends = offsets[1:] + [st.st_size]
+        lengths = [ b - a for (a, b) in zip(offsets, ends) ]
+
+    n = len(names)
+    n_slots = 2 * n + 1
+    slots = [0] * n_slots
+    for i, name in enumerate(names):
+        slot = _slot_of(name, n_slots)
+        while slots[slot]:
+            slot = (slot + 1) % n_slots
+        slots[slot] = i + 1
+
+    names_size = sum(map(len, names))
+
+    # write beside the index and rename it into place, so that a build
+    # that fails, or runs alongside another, never leaves a partial index
+    # that looks current.
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        fp = open(tmpname, 'wb')
+        try:
+            fp.write(_HEADER.pack(MAGIC, VERSION, int(compressed), n, n_slots,
+                                  st.st_size, st.st_mtime, names_size))
+            name_offset = 0
+            for offset, length, name in zip(offsets, lengths, names):
+                fp.write(_ENTRY.pack(offset, length, name_offset, len(name)))
+                name_offset += len(name)
+            for i in slots:
+                fp.write(_SLOT.pack(i))
+            for name in names:
+                fp.write(name)
+        finally:
+            fp.close()
+        os.rename(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+    return filename
+
+class BlastIndex(object):
+    """
+    An open index of a text BLAST report.  Records are parsed only when
+    they are asked for; keyword arguments are BlastParser options used to
+    parse them (e.g. fields=, compact=).
+
+    Methods:
+
+      * index[name] -- parse and return the BlastQuery for 'name'.
+      * get(name, default=None)
+      * name in index, len(index)
+      * names() -- the query names, in file order.
+      * iter(index) -- (name, BlastQuery) pairs, in file order.
+      * offset(name) -- (offset, length) of the record in the report.
+      * is_current() -- False if the report has changed since indexing.
+    """
+    def __init__(self, blast_filename, filename=None, **kw):
+        if filename is None:
+            filename = index_filename(blast_filename)
+        self.blast_filename = blast_filename
+        self.filename = filename
+        self.parser_options = kw
+
+        fp = open(filename, 'rb')
+        try:
+            self.m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        if len(self.m) < _HEADER.size:
+            raise ValueError("%s is not a BLAST index" % (filename,))
+        (magic, version, compressed, self.n, self.n_slots, self.source_size,
+         self.source_mtime, _) = _HEADER.unpack_from(self.m, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a BLAST index" % (filename,))
+        self.compressed = bool(compressed)
+
+        self._entries_start = _HEADER.size
+        self._slots_start = self._entries_start + self.n * _ENTRY.size
+        self._names_start = self._slots_start + self.n_slots * _SLOT.size
+
+        self.fp = open(blast_filename, 'rb')
+
+    def close(self):
+        self.m.close()
+        self.fp.close()
+
+    def is_current(self):
+        st = os.stat(self.blast_filename)
+        return st.st_size == self.source_size and \
+               st.st_mtime == self.source_mtime
+
+    def __len__(self):
+        return self.n
+
+    def _entry(self, i):
+        offset, length, name_offset, name_len = \
+                _ENTRY.unpack_from(self.m, self._entries_start +
+                                   i * _ENTRY.size)
+        start = self._names_start + name_offset
+        return self.m[start:start + name_len], offset, length
+
+    def _find(self, name):
+        "return the record number of 'name', or -1."
+        if not self.n:
+            return -1
+        slot = _slot_of(name, self.n_slots)
+        while 1:
+            i, = _SLOT.unpack_from(self.m, self._slots_start +
+                                   slot * _SLOT.size)
+            if not i:
+                return -1
+            if self._entry(i - 1)[0] == name:
+                return i - 1
+            slot = (slot + 1) % self.n_slots
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def offset(self, name):
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self._entry(i)[1:]
+
+    def _read(self, offset, length):
+        if self.compressed:
+            return bgzf.read_at(self.fp, offset, length)
+        self.fp.seek(offset)
+        return self.fp.read(length)
+
+    def _parse(self, name, offset, length):
+        b = blastparser.BlastParser(**self.parser_options)
+        lines = StringIO(self._read(offset, length))
+        hits = itertools.chain(b.p.parse_file(lines), b.p.flush())
+        for record in b.build_records(hits):
+            return record
+
+        # queries with no hits are indexed too; give them an empty record.
+        if b.compact:
+            return blastparser.CompactBlastQuery(name, b.p.keep_sequences)
+        return blastparser.BlastQuery(name, [])
+
+    def __getitem__(self, name):
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self._parse(*self._entry(i))
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def names(self):
+        for i in range(self.n):
+            yield self._entry(i)[0]
+
+    def __iter__(self):
+        for i in range(self.n):
+            entry = self._entry(i)
+            yield entry[0], self._parse(*entry)
+
+def open_index(blast_filename, filename=None, rebuild=True, **kw):
+    """
+    Open the index of 'blast_filename', building it first if it does not
+    exist or (when 'rebuild' is true) if it is not a readable index or the
+    report has changed since it was built.  Keyword arguments are
+    BlastParser options.
+    """
+    if filename is None:
+        filename = index_filename(blast_filename)
+    if os.path.exists(filename):
+        try:
+            idx = BlastIndex(blast_filename, filename, **kw)
+        except ValueError:
+            if not rebuild:
+                raise
+        else:
+            if not rebuild or idx.is_current():
+                return idx
+            idx.close()
+
+    build_index(blast_filename, filename)
+    return BlastIndex(blast_filename, filename, **kw)
@@ -32,16 +32,42 @@ Author: C. Titus Brown <titus@caltech.edu>
 __version__ = 0.2
 
 __all__ = ['BlastParser', 'parse_fp', 'parse_file', 'parse_string',
-           'open_shelf']
+           'parse_file_parallel', 'parse_shards', 'follow_file', 'open_shelf',
+           'open_index', 'CompactBlastQuery', 'aggregate', 'aggregate_file',
+           'Aggregator', 'Count', 'Sum', 'Max', 'Min', 'Mean', 'TopK',
+           'Histogram']
 __docformat__ = 'restructuredtext'
 
+import os
 import math
+import mmap
+import itertools
+from array import array
+from collections import deque
 from cStringIO import StringIO
 import parse_blast
+import inputs
+import alignstats
+from aggregate import Aggregator, aggregate, Count, Sum, Max, Min, Mean, \
+     TopK, Histogram
 
 ###
 
-class BlastSubjectSubmatch(object):
+class _Slotted(object):
+    """
+    Pickling support for the __slots__-based result classes below, which
+    have no __dict__ for pickle to save.
+    """
+    __slots__ = []
+
+    def __getstate__(self):
+        return tuple([ getattr(self, k) for k in self.__slots__ ])
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+class BlastSubjectSubmatch(_Slotted):
     """
     BlastSubjectSubmatch.
     
@@ -60,6 +86,10 @@ class BlastSubjectSubmatch(object):
      - subject_end
      - query_sequence
      - subject_sequence
+     - identity -- percent identity, as BLAST reports it
+     - identities, mismatches, gap_opens, gap_extends, align_length --
+       counted from the alignment if asked for with 'fields' (see
+       alignstats), and otherwise None
 
     Usage: ::
 
@@ -68,9 +98,11 @@ class BlastSubjectSubmatch(object):
     (etc.)
      
     """
-#    __slots__ = ['expect', 'frame1', 'frame2',
-#                 'query_start', 'query_end', 'query_sequence',
-#                 'subject_start', 'subject_end', 'subject_sequence', 'identity']
+    __slots__ = ['expect', 'frame1', 'frame2', 'score',
+                 'query_start', 'query_end', 'query_sequence',
+                 'subject_start', 'subject_end', 'subject_sequence',
+                 'identity', 'identities', 'mismatches', 'gap_opens',
+                 'gap_extends', 'align_length']
     
     def __init__(self, expect, frame1, frame2,
                  q_start, q_end, q_seq, s_start, s_end, s_seq, identity, score):
@@ -85,13 +117,16 @@ class BlastSubjectSubmatch(object):
         self.subject_end = s_end
         self.subject_sequence = s_seq
         self.score = score
+        self.identity = identity
+        self.identities = self.mismatches = self.align_length = None
+        self.gap_opens = self.gap_extends = None
 
     def __repr__(self):
         return "<BlastSubjectSubmatch(expect=%g, query %d-%d, subject %d-%d))>"\
                % (self.expect, self.query_start, self.query_end,
                 self.subject_start, self.subject_end)
 
-class BlastSubjectHits(object):
+class BlastSubjectHits(_Slotted):
     """
     BlastSubjectHits.
 
@@ -108,7 +143,7 @@ class BlastSubjectHits(object):
         for match in hits_object:
            print match
     """
-#    __slots__ = ['subject_name', 'matches' ]
+    __slots__ = ['subject_name', 'matches']
     def __init__(self, subject_name, matches):
         self.subject_name = str(subject_name)
         self.matches = matches
@@ -123,7 +158,7 @@ class BlastSubjectHits(object):
         seqname = build_short_sequence_name(self.subject_name)
         return "<BlastSubjectHits(%s, %d matches)>" % (seqname, len(self))
 
-class BlastQuery(object):
+class BlastQuery(_Slotted):
     """
     A BLAST query (single sequence against database) containing all results.
     
@@ -138,7 +173,7 @@ class BlastQuery(object):
         for hits_object in query_object:
            print hits_object.subject_name
     """
-#    __slots__ = ['query_name', 'hits' ]
+    __slots__ = ['query_name', 'hits']
     def __init__(self, query_name, hits):
         self.query_name = query_name
         self.hits = list(hits)
@@ -153,6 +188,261 @@ class BlastQuery(object):
     def __getitem__(self, i):
         return self.hits[i]
 
+###
+
+def _column(name, doc=None):
+    "a read-only attribute that reads one HSP's value out of a column."
+    def get(self):
+        return getattr(self._query, name)[self._i]
+    return property(get, doc=doc)
+
+def _stat_column(name):
+    "as _column, for a column that may be None."
+    def get(self):
+        values = getattr(self._query, name)
+        return values and values[self._i]
+    return property(get)
+
+class _CompactSubmatch(object):
+    """
+    A view of one HSP in a CompactBlastQuery, with the same attributes as
+    BlastSubjectSubmatch.
+    """
+    __slots__ = ['_query', '_i']
+    def __init__(self, query, i):
+        self._query = query
+        self._i = i
+
+    expect = _column('expects')
+    score = _column('scores')
+    query_start = _column('query_starts')
+    query_end = _column('query_ends')
+    subject_start = _column('subject_starts')
+    subject_end = _column('subject_ends')
+    identities = _stat_column('identities')
+    mismatches = _stat_column('mismatches')
+    gap_opens = _stat_column('gap_opens')
+    gap_extends = _stat_column('gap_extends')
+    align_length = _stat_column('align_lengths')
+    frame1 = frame2 = identity = None
+
+    @property
+    def query_sequence(self):
+        seqs = self._query.query_sequences
+        return seqs and seqs[self._i]
+
+    @property
+    def subject_sequence(self):
+        seqs = self._query.subject_sequences
+        return seqs and seqs[self._i]
+
+    __repr__ = BlastSubjectSubmatch.__repr__.im_func
+
+class _CompactSubjectHits(object):
+    """
+    A view of the HSPs against one subject in a CompactBlastQuery, with the
+    same attributes as BlastSubjectHits.
+    """
+    __slots__ = ['_query', '_k']
+    def __init__(self, query, k):
+        self._query = query
+        self._k = k
+
+    @property
+    def subject_name(self):
+        return self._query.subject_names[self._k]
+
+    def _range(self):
+        offsets = self._query.hit_offsets
+        return xrange(offsets[self._k], offsets[self._k + 1])
+
+    @property
+    def matches(self):
+        q = self._query
+        return [ _CompactSubmatch(q, i) for i in self._range() ]
+
+    def __getitem__(self, i):
+        return _CompactSubmatch(self._query, self._range()[i])
+
+    def __len__(self):
+        return len(self._range())
+
+    __repr__ = BlastSubjectHits.__repr__.im_func
+
+_HSP_ARRAYS = ('expects', 'scores', 'query_starts', 'query_ends',
+               'subject_starts', 'subject_ends')
+
+class CompactBlastQuery(_Slotted):
+    """
+    A BlastQuery that stores its HSPs in parallel typed arrays instead of
+    one object per HSP.  The HSPs against subject k are those with indices
+    hit_offsets[k] to hit_offsets[k+1]; 'hits' and indexing return light
+    views that provide the BlastSubjectHits/BlastSubjectSubmatch attributes.
+
+    Attributes:
+
+      * query_name -- name of query sequence (following 'Query=').
+      * subject_names -- list of subject names, one per hit.
+      * hit_offsets -- array of len(subject_names) + 1 HSP offsets.
+      * expects, scores -- arrays of doubles, one per HSP.
+      * query_starts, query_ends, subject_starts, subject_ends -- arrays of
+        longs, one per HSP.
+      * query_sequences, subject_sequences -- lists of alignment strings,
+        or None if the sequences were not requested.
+      * identities, mismatches, gap_opens, gap_extends, align_lengths --
+        arrays of longs, one per HSP, if the alignment statistics were
+        requested (see alignstats), or None.
+    """
+    __slots__ = ['query_name', 'subject_names', 'hit_offsets',
+                 'expects', 'scores', 'query_starts', 'query_ends',
+                 'subject_starts', 'subject_ends',
+                 'query_sequences', 'subject_sequences',
+                 'identities', 'mismatches', 'gap_opens', 'gap_extends',
+                 'align_lengths']
+
+    def __init__(self, query_name, keep_sequences=True):
+        self.query_name = query_name
+        self.subject_names = []
+        self.hit_offsets = array('l', [0])
+        self.expects = array('d')
+        self.scores = array('d')
+        self.query_starts = array('l')
+        self.query_ends = array('l')
+        self.subject_starts = array('l')
+        self.subject_ends = array('l')
+        if keep_sequences:
+            self.query_sequences = []
+            self.subject_sequences = []
+        else:
+            self.query_sequences = self.subject_sequences = None
+        self.identities = self.mismatches = self.align_lengths = None
+        self.gap_opens = self.gap_extends = None
+
+    def add_hsp(self, subject_name, e_value, q_start, q_end, q_seq,
+                s_start, s_end, s_seq, score):
+        """
+        Append one HSP; HSPs against the same subject must be added
+        consecutively.  'e_value' is -log10(expect), as in BlastHitParser.
+        """
+        if not self.subject_names or self.subject_names[-1] != subject_name:
+            self.subject_names.append(str(subject_name))
+            self.hit_offsets.append(len(self.scores))
+        self.expects.append(math.pow(10, -e_value))
+        self.scores.append(score)
+        self.query_starts.append(q_start)
+        self.query_ends.append(q_end)
+        self.subject_starts.append(s_start)
+        self.subject_ends.append(s_end)
+        if self.query_sequences is not None:
+            self.query_sequences.append(q_seq)
+            self.subject_sequences.append(s_seq)
+        self.hit_offsets[-1] = len(self.scores)
+
+    @property
+    def hits(self):
+        return [ _CompactSubjectHits(self, k)
+                 for k in range(len(self.subject_names)) ]
+
+    def __repr__(self):
+        query_short = build_short_sequence_name(self.query_name)
+        return "<BlastQuery(%s (%d hits))>" % (query_short, len(self))
+
+    def __len__(self):
+        return len(self.subject_names)
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self.subject_names)
+        if not 0 <= k < len(self.subject_names):
+            raise IndexError(k)
+        return _CompactSubjectHits(self, k)
+
+    def expand(self):
+        "Return the equivalent BlastQuery, with one object per HSP."
+        hits = []
+        offsets = self.hit_offsets
+        none = [None] * len(self.scores)
+        q_seqs = self.query_sequences or none
+        s_seqs = self.subject_sequences or none
+        stats = [ getattr(self, column) or none
+                  for _, column in alignstats.STAT_COLUMNS ]
+        for k, subject_name in enumerate(self.subject_names):
+            matches = []
+            for i in xrange(offsets[k], offsets[k + 1]):
+                # bypass __init__, which would recompute 'expect'
+                submatch = BlastSubjectSubmatch.__new__(BlastSubjectSubmatch)
+                submatch.__setstate__((self.expects[i], None, None,
+                                       self.scores[i],
+                                       self.query_starts[i],
+                                       self.query_ends[i], q_seqs[i],
+                                       self.subject_starts[i],
+                                       self.subject_ends[i], s_seqs[i],
+                                       None) +
+                                      tuple([ c[i] for c in stats ]))
+                matches.append(submatch)
+            hits.append(BlastSubjectHits(subject_name, matches))
+        return BlastQuery(self.query_name, hits)
+
+    def filtered(self, hsp_filter):
+        """
+        Return a copy holding only the HSPs that 'hsp_filter' (a
+        parse_blast.HspFilter) keeps, checked in order, as while parsing.
+        """
+        record = CompactBlastQuery(self.query_name,
+                                   self.query_sequences is not None)
+        for _, column in alignstats.STAT_COLUMNS:
+            if getattr(self, column) is not None:
+                setattr(record, column, array('l'))
+        offsets = self.hit_offsets
+        hsp_filter.start_query()
+        for k, subject_name in enumerate(self.subject_names):
+            hsp_filter.start_hit()
+            for i in xrange(offsets[k], offsets[k + 1]):
+                expect = self.expects[i]
+                e_value = 300.0
+                if expect > 0:
+                    e_value = -math.log10(expect)
+                verdict = hsp_filter.check(self.scores[i], e_value)
+                if verdict == 'query':
+                    return record
+                if verdict is None:
+                    record._copy_hsp(self, i, subject_name)
+        return record
+
+    def _copy_hsp(self, other, i, subject_name):
+        if not self.subject_names or self.subject_names[-1] != subject_name:
+            self.subject_names.append(subject_name)
+            self.hit_offsets.append(len(self.scores))
+        for name in _HSP_ARRAYS:
+            getattr(self, name).append(getattr(other, name)[i])
+        for _, column in alignstats.STAT_COLUMNS:
+            values = getattr(self, column)
+            if values is not None:
+                values.append(getattr(other, column)[i])
+        if self.query_sequences is not None:
+            self.query_sequences.append(other.query_sequences[i])
+            self.subject_sequences.append(other.subject_sequences[i])
+        self.hit_offsets[-1] = len(self.scores)
+
+    def __getstate__(self):
+        # arrays pickle as their raw machine bytes
+        state = list(_Slotted.__getstate__(self))
+        for i, v in enumerate(state):
+            if isinstance(v, array):
+                state[i] = (v.typecode, v.tostring())
+        return tuple(state)
+
+    def __setstate__(self, state):
+        state = list(state)
+        self.identities = self.mismatches = self.align_lengths = None
+        self.gap_opens = self.gap_extends = None
+        for i, v in enumerate(state):
+            if isinstance(v, tuple):
+                a = array(v[0])
+                a.fromstring(v[1])
+                state[i] = a
+        _Slotted.__setstate__(self, state)
+
 class _BlastShelf(object):
     def __init__(self, filename, mode='r'):
         from shelve import BsdDbShelf
@@ -176,33 +466,135 @@ def open_shelf(filename, mode='r'):
 
     return _BlastShelf(filename, mode)
 
-def parse_file(filename):
+def open_index(blast_filename, **kw):
+    """
+    Open (building or rebuilding it if necessary) the byte-offset index of
+    the text BLAST report 'blast_filename', for random access by query
+    name.  See blastindex.open_index.
+    """
+    import blastindex
+    return blastindex.open_index(blast_filename, **kw)
+
+def parse_shards(shards, **kw):
+    """
+    Parse the BLAST report shards 'shards' (file names and glob patterns)
+    with a pool of worker processes, as one stream of records; see
+    shards.parse_shards.
+    """
+    import shards as blast_shards
+    return blast_shards.parse_shards(shards, **kw)
+
+def parse_file(filename, jobs=1, engine='lines', cache=False, metrics=None,
+               **kw):
     """
     Parse records from a given file; 'filename' is the path to the file.
+
+    If 'jobs' is greater than 1, the file is split into byte ranges at
+    'Query=' boundaries and parsed by that many worker processes; records
+    are still yielded in their original order.  'engine' selects how the
+    file is read, 'cache' whether to use a columnar cache of the parsed
+    HSPs, and 'metrics' where to count and time the work; see
+    BlastParser.parse_file.  Other keyword arguments are BlastParser
+    options.
     """
-    b = BlastParser()
-    for record in b.parse_file(filename):
+    b = BlastParser(**kw)
+    for record in b.parse_file(filename, jobs=jobs, engine=engine,
+                               cache=cache, metrics=metrics):
         yield record
 
-def parse_fp(fp, **kw):
+def parse_fp(fp, metrics=None, **kw):
     """
-    Parse records out of the given file handle.
+    Parse records out of the given file handle.  Keyword arguments are
+    BlastParser options.
     """
-    b = BlastParser()
+    b = BlastParser(**kw)
     
-    for record in b.parse_fp(fp, **kw):
+    for record in b.parse_fp(fp, metrics):
         yield record
 
-def parse_string(s):
+def parse_string(s, **kw):
     """
     Parse records out of a string buffer.
     """
     fp = StringIO(s)
-    b = BlastParser()
+    b = BlastParser(**kw)
 
     for record in b.parse_fp(fp):
         yield record
 
+def aggregate_file(filename, by='query', jobs=1, cache=False, metrics=None,
+                   **aggregations):
+    """
+    Parse 'filename' into compact records with just the fields the
+    aggregations need, and aggregate their HSPs in the same pass; see
+    aggregate.Aggregator.  Sample usage: ::
+
+       hits = aggregate_file('blast_output.txt', by='subject', n=Count(),
+                             best=Max('score'))
+    """
+    agg = Aggregator(by, **aggregations)
+    for record in parse_file(filename, jobs=jobs, cache=cache,
+                             metrics=metrics, compact=True,
+                             fields=agg.fields()):
+        agg.add(record)
+    return agg.results()
+
+# attributes of BlastSubjectSubmatch that may be requested with 'fields'.
+SUBMATCH_FIELDS = ('expect', 'frame1', 'frame2', 'score',
+                   'query_start', 'query_end', 'query_sequence',
+                   'subject_start', 'subject_end', 'subject_sequence',
+                   'identity') + alignstats.STAT_FIELDS
+SEQUENCE_FIELDS = ('query_sequence', 'subject_sequence')
+
+FORMATS = ('text', 'tabular', 'xml')
+
+# BlastParser options that drop HSPs while parsing; see parse_blast.HspFilter.
+FILTER_OPTIONS = ('min_score', 'max_evalue', 'max_hits_per_query',
+                  'best_hits_only')
+
+class _Rewound(object):
+    """
+    A file-like object that replays lines already read from 'fp' before
+    reading the rest of it.
+    """
+    def __init__(self, head, fp):
+        self.head = head
+        self.fp = fp
+
+    def __iter__(self):
+        head, self.head = self.head, []
+        return itertools.chain(head, self.fp)
+
+    def read(self, size=-1):
+        if self.head:
+            head, self.head = self.head, []
+            return ''.join(head)
+        return self.fp.read(size)
+
+def detect_format(fp):
+    """
+    Guess the format of the BLAST output in 'fp' from its first non-blank
+    line.  Returns (format, fp2), where fp2 yields everything in 'fp',
+    including the lines read to sniff it.
+    """
+    head = []
+    line = ''
+    while not line.strip():
+        line = fp.readline()
+        if not line:
+            break
+        head.append(line)
+
+    return parse_blast.sniff_format(line), _Rewound(head, fp)
+
+def detect_file_format(filename):
+    "Guess the format of the BLAST output in the file 'filename'."
+    fp = inputs.open_input(filename)
+    try:
+        return detect_format(fp)[0]
+    finally:
+        fp.close()
+
 class _PygrBlastHitParser(parse_blast.BlastHitParser):
     def generate_intervals(self):
         yield self.query_id, self.subject_id, \
@@ -211,18 +603,50 @@ class _PygrBlastHitParser(parse_blast.BlastHitParser):
                                    None,
                                    self.query_start,
                                    self.query_end,
-                                   self.query_seq,
+                                   self.query_seq or None,
                                    self.subject_start,
                                    self.subject_end,
-                                   self.subject_seq,
+                                   self.subject_seq or None,
                                    self.identity_percent,
                                    self.blast_score)
+
+class _CompactBlastHitParser(parse_blast.BlastHitParser):
+    def generate_intervals(self):
+        yield self.query_id, self.subject_id, \
+              (self.e_value,
+               self.query_start, self.query_end, self.query_seq or None,
+               self.subject_start, self.subject_end, self.subject_seq or None,
+               self.blast_score)
     
 class BlastParser(object):
     """
     BlastParser objects coordinate the use of pyparsing parsers to
     parse complete BLAST records.
 
+    If 'fields' is given, it names the BlastSubjectSubmatch attributes
+    the caller needs (see SUBMATCH_FIELDS).  Unless it includes
+    'query_sequence' or 'subject_sequence', alignment strings are never
+    accumulated and those attributes are None.  The alignment statistics
+    in alignstats.STAT_FIELDS are only computed if named in 'fields'; they
+    need the alignment strings, which are dropped afterwards unless also
+    named.
+
+    If 'compact' is true, records are CompactBlastQuery objects, and no
+    per-HSP objects are created while parsing.
+
+    'format' is one of FORMATS -- the legacy pairwise 'text' report,
+    'tabular' (-m 8/9, -outfmt 6/7) or 'xml' (-m 7, -outfmt 5) -- or None
+    to detect it from the first line of input.  All formats produce the
+    same record objects, but tabular output carries no sequences.
+
+    'min_score', 'max_evalue', 'max_hits_per_query' and 'best_hits_only'
+    drop HSPs inside the parser, before any submatch object is built: only
+    HSPs scoring at least 'min_score', with expect at most 'max_evalue', in
+    the first 'max_hits_per_query' hits of their query and, with
+    'best_hits_only', scoring as high as the query's best HSP, are kept.
+    Since BLAST reports hits best first, the rest of a query is skipped
+    once none of it can pass.  Queries left without HSPs are not returned.
+
     Attributes:
 
       * blast_record -- an individual BLAST record; returns BlastQuery object.
@@ -234,24 +658,190 @@ class BlastParser(object):
       * parse_string(s)
       * parse_file(filename)
       * parse_fp(fp)
+      * build_records(hits)
     """
-    def __init__(self):
-        self.p = _PygrBlastHitParser()
+    def __init__(self, fields=None, compact=False, format=None,
+                 min_score=None, max_evalue=None, max_hits_per_query=None,
+                 best_hits_only=False):
+        if fields is not None:
+            fields = tuple(fields)
+            unknown = set(fields) - set(SUBMATCH_FIELDS)
+            if unknown:
+                raise ValueError("unknown submatch fields: %s" %
+                                 ", ".join(sorted(unknown)))
+        if format is not None and format not in FORMATS:
+            raise ValueError("unknown BLAST output format %r" % (format,))
+        if max_hits_per_query is not None and max_hits_per_query < 1:
+            raise ValueError("max_hits_per_query must be at least 1")
+        self.fields = fields
+        self.compact = compact
+        self.format = format
+        self.options = dict(fields=fields, compact=compact, format=format,
+                            min_score=min_score, max_evalue=max_evalue,
+                            max_hits_per_query=max_hits_per_query,
+                            best_hits_only=best_hits_only)
+
+        self.hsp_filter = None
+        if min_score is not None or max_evalue is not None or \
+           max_hits_per_query is not None or best_hits_only:
+            self.hsp_filter = parse_blast.HspFilter(min_score, max_evalue,
+                                                    max_hits_per_query,
+                                                    best_hits_only)
+
+        if compact:
+            self.p = _CompactBlastHitParser()
+        else:
+            self.p = _PygrBlastHitParser()
+        self.stats = False
+        if fields is not None:
+            self.stats = bool(set(fields) & set(alignstats.STAT_FIELDS))
+            self.p.keep_sequences = bool(set(fields) & set(SEQUENCE_FIELDS)) \
+                                    or self.stats
+        self.p.hsp_filter = self.hsp_filter
+
+    def parse_file(self, filename, jobs=1, engine='lines', cache=False,
+                   metrics=None):
+        """
+        Parse records from 'filename'.  'engine' is either 'lines', to read
+        the file a line at a time, or 'mmap', to memory-map it and jump
+        between record markers (see parse_blast.BlastHitParser.parse_mmap).
+        'jobs' and 'engine' only apply to uncompressed text reports; other
+        formats, and gzip- or bgzip-compressed reports, are always
+        streamed, with decompression in background threads (see inputs).
+
+        If 'cache' is true, and 'fields' excludes the alignment sequences,
+        records are read from a columnar cache beside the report when it
+        is current, and otherwise the cache is rewritten while parsing;
+        see blastcache.  This requires NumPy.
+
+        If 'metrics' is a metrics.Metrics object, the records, HSPs, lines
+        and bytes read are counted there, and the time spent reading,
+        parsing and building records is charged to those stages.
+        """
+        records = self._parse_file(filename, jobs, engine, cache, metrics)
+        if metrics is not None:
+            records = _metered(records, metrics)
+        return records
+
+    def _parse_file(self, filename, jobs, engine, cache, metrics):
+        if cache and not self.p.keep_sequences:
+            # the cache holds every HSP; filter what is read from it.
+            import blastcache
+            options = dict(self.options, compact=True)
+            for name in FILTER_OPTIONS:
+                options[name] = None
+            b = BlastParser(**options)
+            parse = lambda: b._parse_file(filename, jobs, engine, False,
+                                          metrics)
+            for record in blastcache.cached_records(filename, parse):
+                if self.hsp_filter is not None:
+                    record = record.filtered(self.hsp_filter)
+                    if not len(record):
+                        continue
+                if not self.compact:
+                    record = record.expand()
+                yield record
+            return
+
+        format = self.format or detect_file_format(filename)
+        if format != 'text' or inputs.detect_compression(filename):
+            fp = inputs.open_input(filename)
+            if metrics is not None:
+                fp = metrics.reader(fp)
+            for record in self._records(self._hits(fp, format), metrics):
+                yield record
+            return
+
+        if jobs > 1:
+            for record in parse_file_parallel(filename, jobs, engine=engine,
+                                              metrics=metrics,
+                                              **self.options):
+                yield record
+            return
+
+        if engine == 'mmap':
+            hits = self.p.parse_mmap(filename)
+        elif engine == 'lines':
+            fp = open(filename)
+            if metrics is not None:
+                fp = metrics.reader(fp)
+            hits = self.p.parse_file(fp)
+        else:
+            raise ValueError("unknown parsing engine %r" % (engine,))
+
+        for record in self._records(hits, metrics):
+            yield record
+
+        if engine == 'mmap' and metrics is not None:
+            metrics.count('bytes', os.path.getsize(filename))
+
+    def parse_fp(self, fp, metrics=None):
+        records = self._parse_fp(fp, metrics)
+        if metrics is not None:
+            records = _metered(records, metrics)
+        return records
 
-    def parse_file(self, filename):
-        fp = open(filename)
-        for record in self.parse_fp(fp):
+    def _parse_fp(self, fp, metrics):
+        if metrics is not None:
+            fp = metrics.reader(fp)
+        format = self.format
+        if format is None:
+            format, fp = detect_format(fp)
+
+        for record in self._records(self._hits(fp, format), metrics):
             yield record
 
-    def parse_fp(self, fp):
+    def _records(self, hits, metrics):
+        if metrics is not None:
+            hits = metrics.iterate(hits, 'parse')
+        return self.build_records(hits)
+
+    def _hits(self, fp, format):
+        if format == 'tabular':
+            if self.compact and self.hsp_filter is None:  # no per-HSP hook
+                return ( (row[0], row[1], (row[6], row[2], row[3], None,
+                                           row[4], row[5], None, row[7]))
+                         for row in parse_blast.read_tabular(fp) )
+            return self.p.parse_tabular(fp)
+        elif format == 'xml':
+            return self.p.parse_xml(fp)
+        return self.p.parse_file(fp)
+
+    def build_records(self, hits):
+        """
+        Group a stream of (query_id, subject_id, submatch) tuples from
+        self.p into BlastQuery (or CompactBlastQuery) objects.
+        """
+        if self.compact:
+            records = self._build_compact_records(hits)
+        else:
+            records = self._build_records(hits)
+        if self.stats:
+            keep = bool(set(self.fields) & set(SEQUENCE_FIELDS))
+            records = alignstats.add_stats(records, keep)
+        return records
+
+    def _build_compact_records(self, hits):
+        record = None
+        keep_sequences = self.p.keep_sequences
+        for query_id, subject_id, values in hits:
+            if record is None or record.query_name != query_id:
+                if record is not None:
+                    yield record
+                record = CompactBlastQuery(query_id, keep_sequences)
+            record.add_hsp(subject_id, *values)
+
+        if record is not None:
+            yield record
 
+    def _build_records(self, hits):
         subjects = []
         matches = []
 
         cur_query = None
         cur_subject = None
         
-        for query_id, subject_id, submatch in self.p.parse_file(fp):
+        for query_id, subject_id, submatch in hits:
             if cur_subject != subject_id or cur_query != query_id:
                 if matches:
                     assert cur_subject
@@ -277,6 +867,268 @@ class BlastParser(object):
         if subjects:
             yield BlastQuery(cur_query, subjects)
 
+def _count_hsps(record):
+    if isinstance(record, CompactBlastQuery):
+        return len(record.scores)
+    return sum([ len(hit.matches) for hit in record.hits ])
+
+def _metered(records, metrics):
+    "count 'records' and their HSPs, timing their production as 'build'."
+    counters = metrics.counters
+    for record in metrics.iterate(records, 'build', 'records'):
+        counters['hsps'] += _count_hsps(record)
+        yield record
+
+###
+
+# size of the byte ranges handed to each worker by parse_file_parallel.
+PARALLEL_CHUNK_SIZE = 32 * 1024 * 1024
+
+def split_at_queries(filename, n_ranges):
+    """
+    Split 'filename' into at most 'n_ranges' (start, end) byte ranges, each
+    of which begins at the start of the file or at a 'Query=' line.
+    """
+    size = os.path.getsize(filename)
+    if not size:
+        return []
+
+    fp = open(filename, 'rb')
+    try:
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fp.close()
+
+    try:
+        starts = [0]
+        for i in range(1, n_ranges):
+            target = max(size * i // n_ranges, starts[-1] + 1)
+            pos = m.find('\nQuery=', target - 1)
+            if pos == -1:
+                break
+            if pos + 1 > starts[-1]:
+                starts.append(pos + 1)
+    finally:
+        m.close()
+
+    return zip(starts, starts[1:] + [size])
+
+def _read_byte_range(fp, start, end):
+    "yield the lines of 'fp' between byte offsets 'start' and 'end'."
+    fp.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        line = fp.readline()
+        if not line:
+            break
+        remaining -= len(line)
+        yield line
+
+def _parse_byte_range(args):
+    "worker for parse_file_parallel: parse one byte range into a list."
+    filename, start, end, is_last, engine, options = args
+    b = BlastParser(**options)
+    if engine == 'mmap':
+        hits = b.p.parse_mmap(filename, start, end)
+    else:
+        hits = b.p.parse_file(_read_byte_range(open(filename, 'rb'),
+                                               start, end))
+
+    if not is_last:
+        # the next range starts with 'Query=', which would have flushed
+        # the final alignment of this range; do that here instead.
+        hits = itertools.chain(hits, b.p.flush())
+    return list(b.build_records(hits))
+
+def parse_file_parallel(filename, jobs, chunk_size=PARALLEL_CHUNK_SIZE,
+                        engine='lines', metrics=None, **kw):
+    """
+    Parse 'filename' with a pool of 'jobs' worker processes, yielding
+    BlastQuery records in the order they appear in the file.
+
+    Only a bounded number of byte ranges are in flight at any time, so
+    memory use does not grow with the size of the file.  Other keyword
+    arguments are BlastParser options.  Compressed files cannot be split,
+    and are parsed serially.
+
+    If 'metrics' is given, bytes are counted there as each range is
+    finished, and time spent waiting for the workers is charged to
+    'parse'; records and HSPs are left for the caller to count.
+    """
+    import multiprocessing
+
+    if inputs.detect_compression(filename):
+        b = BlastParser(**kw)
+        for record in b._parse_fp(inputs.open_input(filename), metrics):
+            yield record
+        return
+
+    size = os.path.getsize(filename)
+    n_ranges = max(jobs * 4, size // chunk_size + 1)
+    ranges = split_at_queries(filename, n_ranges)
+    if not ranges:                      # let the serial parser complain
+        for record in BlastParser(**kw).parse_fp(open(filename)):
+            yield record
+        return
+
+    last = len(ranges) - 1
+    tasks = iter([ (filename, start, end, i == last, engine, kw)
+                   for i, (start, end) in enumerate(ranges) ])
+    ranges = iter(ranges)
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = deque()
+        for task in itertools.islice(tasks, jobs * 2):
+            pending.append(pool.apply_async(_parse_byte_range, (task,)))
+
+        while pending:
+            if metrics is None:
+                records = pending.popleft().get()
+            else:
+                with metrics.stage('parse'):
+                    records = pending.popleft().get()
+                start, end = ranges.next()
+                metrics.count('bytes', end - start)
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(_parse_byte_range, (task,)))
+
+            for record in records:
+                yield record
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+###
+
+def load_checkpoint(filename):
+    "Return the follow_file state saved in 'filename', or None."
+    import json
+    if not os.path.exists(filename):
+        return None
+    fp = open(filename)
+    try:
+        return json.load(fp)
+    finally:
+        fp.close()
+
+def save_checkpoint(filename, state):
+    "Atomically save the follow_file state 'state' to 'filename'."
+    import json
+    tmpname = filename + '.tmp'
+    fp = open(tmpname, 'w')
+    try:
+        json.dump(state, fp)
+    finally:
+        fp.close()
+    os.rename(tmpname, filename)
+
+def _query_starts(filename, start, end):
+    "Return the offsets of the 'Query=' lines in (start, end) of 'filename'."
+    fp = open(filename, 'rb')
+    try:
+        m = mmap.mmap(fp.fileno(), end, access=mmap.ACCESS_READ)
+    finally:
+        fp.close()
+
+    starts = []
+    try:
+        pos = m.find('\nQuery=', start)
+        while pos >= 0:
+            starts.append(pos + 1)
+            pos = m.find('\nQuery=', pos + 1)
+    finally:
+        m.close()
+    return starts
+
+def follow_file(filename, checkpoint=None, interval=5.0, done=None,
+                idle_timeout=None, window=PARALLEL_CHUNK_SIZE, metrics=None,
+                **kw):
+    """
+    Parse a text BLAST report that is still being written, yielding each
+    BlastQuery as soon as it is complete: once the next 'Query=' line has
+    appeared, or once the 'done' callable returns true to say that BLAST
+    has finished writing.  A partially written query is never emitted, and
+    an empty or missing file is simply waited on.
+
+    If 'checkpoint' names a file, the state (the offset of the first
+    record not yet consumed, plus a record count and the last query name)
+    is saved there when the caller asks for the record after it, and a
+    later call with the same checkpoint resumes from it; so a record that
+    was handed out but whose processing was interrupted is emitted again.
+    Parsing always resumes at a 'Query=' line, so the parser has no other
+    state to save.
+
+    The file is polled every 'interval' seconds.  If 'idle_timeout' is
+    given, follow_file returns after that many seconds without a new
+    complete record, leaving any incomplete one for the next call.  At
+    most 'window' bytes are scanned at a time.  'metrics' is as for
+    BlastParser.parse_file.  Other keyword arguments are BlastParser
+    options.
+    """
+    import time
+
+    state = dict(offset=0, records=0, query=None)
+    if checkpoint:
+        state.update(load_checkpoint(checkpoint) or {})
+
+    b = BlastParser(**kw)
+    fp = None
+    idle_since = time.time()
+    try:
+        while 1:
+            # check 'done' first, so all output written before it is seen
+            finished = done is not None and done()
+            size = 0
+            if os.path.exists(filename):
+                size = os.path.getsize(filename)
+
+            offset = state['offset']
+            if size < offset:
+                raise IOError("%s is shorter than its checkpoint offset %d"
+                              % (filename, offset))
+
+            ends = []
+            scan_end = min(size, offset + window)
+            if scan_end > offset:
+                ends = _query_starts(filename, offset, scan_end)
+                if not ends and scan_end < size:
+                    scan_end = size
+                    ends = _query_starts(filename, offset, size)
+            if finished and scan_end == size > offset:
+                ends.append(size)
+
+            if not ends:
+                if finished:
+                    break
+                if idle_timeout is not None and \
+                       time.time() - idle_since > idle_timeout:
+                    break
+                time.sleep(interval)
+                continue
+            idle_since = time.time()
+
+            if fp is None:
+                fp = open(filename, 'rb')
+            for end in ends:
+                lines = _read_byte_range(fp, state['offset'], end)
+                hits = itertools.chain(b.p.parse_file(lines), b.p.flush())
+                records = b._records(hits, metrics)
+                if metrics is not None:
+                    records = _metered(records, metrics)
+                for record in records:
+                    yield record
+                    state['records'] += 1
+                    state['query'] = record.query_name
+                if metrics is not None:
+                    metrics.count('bytes', end - state['offset'])
+                state['offset'] = end
+                if checkpoint:
+                    save_checkpoint(checkpoint, state)
+    finally:
+        if fp is not None:
+            fp.close()
 
 def build_short_sequence_name(name, max_len=20):
     if len(name) < max_len:
@@ -295,47 +1147,24 @@ def build_short_sequence_name(name, max_len=20):
 
 if __name__ == '__main__':
     import sys
-    from shelve import BsdDbShelf
-    from bsddb import btopen
+    import blastindex
     from optparse import OptionParser
 
     ### read command line parameters
 
-    parser = OptionParser()
-    parser.add_option('-z', '--zlib-compressed', action="store_true",
-                      dest="zlib_compressed",
-                      help="read gzipped BLAST output file")
-
-    parser.add_option('-n', '--ignore-empty-hits', action="store_true",
-                      dest="ignore_empty_hits",
-                      help="ignore BLAST hits with no results")
-
+    parser = OptionParser(usage="%prog blast_file [index_file]")
     (options, args) = parser.parse_args()
+    if len(args) not in (1, 2):
+        parser.error("expected a BLAST file and an optional index filename")
 
-    (blast_file, output_file) = args
-
-    ### open blast file, open/create database r/w
-
-    if options.zlib_compressed:
-        import gzip
-        blast_fp = gzip.open(blast_file)
-    else:
-        blast_fp = open(blast_file)
-
-    _db = btopen(output_file, 'c')
-    db = BsdDbShelf(_db)
+    blast_file = args[0]
+    index_file = None
+    if len(args) == 2:
+        index_file = args[1]
 
     ### go!
 
-    for n, record in enumerate(parse_fp(blast_fp,
-                                        ignore_no_hits=options.ignore_empty_hits)):
-        if n % 100 == 0:
-            print '...', n
-
-        if options.ignore_empty_hits and not record:
-            continue
-
-        name = record.query_name
-        db[name] = record
+    index_file = blastindex.build_index(blast_file, index_file)
+    idx = blastindex.BlastIndex(blast_file, index_file)
 
-    print 'read %d records total' % (n + 1,)
+    print 'indexed %d records total in %s' % (len(idx), index_file)
@@ -7,74 +7,181 @@ Usage:
 calc-blast-cover calculates the fraction of bases in 'reference.fa' that are
 covered by BLAST matches from 'query.fa', for sequence in 'query.fa' that are
 longer than 'minmatch'.
+
+With --bedgraph, the depth of coverage (the number of HSPs covering each
+base) is also written as bedGraph, one line per run of bases at the same
+non-zero depth; with --histogram, the number of bases at each depth, per
+reference and for all of them ('genome'), as name, depth, bases, length
+and fraction of length.  Both come from the same pass as the totals.
+
+With --sweep, the coverage is found for every combination of the score
+thresholds in --scores and the query length cutoffs in --lengths (as well
+as 200 and 'minmatch'), in one pass over the BLAST file, and written to
+FILE as a table of min_score, min_query_len, covered, total and fraction.
 """
 
 import sys
+import argparse
 import blastparser
-
-import screed
-
-if len(sys.argv) != 5:
-   print>>sys.stderr, "Usage: calc-blast-cover.py b.seqs a.x.b matchlen a.seqs"
-   sys.exit(-1)
+import coverage
+import fastaindex
+import metrics
+
+parser = argparse.ArgumentParser(
+   usage="calc-blast-cover.py b.seqs a.x.b matchlen a.seqs")
+parser.add_argument('reference')
+parser.add_argument('blast_file')
+parser.add_argument('matchlen', type=int)
+parser.add_argument('query')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of processes to parse the BLAST file with')
+parser.add_argument('--cache', action='store_true',
+                    help='use (or create) a cache of the parsed BLAST file')
+parser.add_argument('--bedgraph', metavar='FILE',
+                    help='write the depth of coverage to FILE as bedGraph')
+parser.add_argument('--histogram', metavar='FILE',
+                    help='write histograms of the depth of coverage to FILE')
+parser.add_argument('--sweep', metavar='FILE',
+                    help='write the coverage at each --scores and --lengths'
+                    ' combination to FILE')
+parser.add_argument('--scores', default='',
+                    help='comma-separated score thresholds to sweep')
+parser.add_argument('--lengths', default='',
+                    help='comma-separated query length cutoffs to sweep')
+metrics.add_arguments(parser)
+args = parser.parse_args()
+
+if args.sweep and (args.bedgraph or args.histogram):
+    parser.error('--sweep cannot be combined with --bedgraph or --histogram')
+
+def int_list(s):
+    try:
+        return [ int(x) for x in s.split(',') if x.strip() ]
+    except ValueError:
+        parser.error('not a comma-separated list of integers: %r' % s)
+
+meter = metrics.from_args(args, 'calc-blast-cover')
 
 MIN_SCORE=200
-MIN_QUERY_LEN = int(sys.argv[3])
-
-# load in the query sequences into a list
-query_seqs = set([ record.name for record in screed.open(sys.argv[4]) \
-                       if len(record.sequence) >= MIN_QUERY_LEN ])
-
-# create empty lists representing the total number of bases in the reference
-covs = {}
-for n, record in enumerate(screed.open(sys.argv[1])):
-    if n % 1000 == 0:
-        sys.stdout.write('+')
-        sys.stdout.flush()
-
-    covs[record.name] = [0] * len(record.sequence)
-
-# run through the BLAST records in the query, and calculate how much of
-# the reference is covered by the query.
-for n, record in enumerate(blastparser.parse_fp(open(sys.argv[2]))):
-    if n % 100 == 0:
-        sys.stdout.write('.')
-        sys.stdout.flush()
-
-    if record.query_name not in query_seqs:
+MIN_QUERY_LEN = args.matchlen
+
+scores = sorted(set(int_list(args.scores) + [MIN_SCORE]))
+lengths = sorted(set(int_list(args.lengths) + [MIN_QUERY_LEN]))
+if not args.sweep:
+    scores, lengths = [MIN_SCORE], [MIN_QUERY_LEN]
+
+with meter.stage('load'):
+    # load in the lengths of the query sequences into a dictionary
+    query_seqs = {}
+    idx = fastaindex.open_index(args.query)
+    for entry in idx:
+        if entry.length >= lengths[0]:
+            query_seqs[entry.name] = entry.length
+    idx.close()
+
+# run through the BLAST records in the query, and collect the parts of
+# the reference covered by the query.
+if args.sweep:
+    cover = coverage.ThresholdCoverage(scores, lengths)
+else:
+    cover = coverage.Coverage()
+for record in blastparser.parse_file(args.blast_file, jobs=args.jobs,
+                                     cache=args.cache, metrics=meter,
+                                     min_score=scores[0],
+                                     fields=('score', 'subject_start',
+                                             'subject_end')):
+    query_len = query_seqs.get(record.query_name)
+    if query_len is None:
         continue
 
-    for hit in record.hits:
-        for match in hit.matches:
-            if match.score < MIN_SCORE:
-                continue
-
-            cov = covs.get(hit.subject_name)
-            if not cov:
-                continue
-
-            start = min(match.subject_start, match.subject_end) - 1
-            end = max(match.subject_start, match.subject_end)
-            for i in range(start, end):
-                cov[i] = 1
-
-print ''
-
-
-# print out summary statistics for each of the reference.
+    with meter.stage('cover'):
+        for hit in record.hits:
+            for match in hit.matches:
+                if args.sweep:
+                    cover.add_match(hit.subject_name, match, query_len)
+                else:
+                    cover.add_match(hit.subject_name, match)
+
+def write_histogram(fp, name, hist, length):
+    for depth, n in enumerate(hist):
+        if n:
+            print >>fp, '%s\t%d\t%d\t%d\t%g' % (name, depth, n, length,
+                                                n / float(length))
+
+bedgraph = histogram = None
+if args.bedgraph:
+    bedgraph = open(args.bedgraph, 'w')
+if args.histogram:
+    histogram = open(args.histogram, 'w')
+genome_hist = []
+swept = dict.fromkeys([ (score, cutoff) for score in scores
+                        for cutoff in lengths ], 0)
+
+# run through the lengths of the reference sequences, and total up the
+# bases covered.
 coved = 0
 total = 0
-for name in covs:
-    coved += sum(covs[name])
-    total += len(covs[name])
-    f = sum(covs[name]) / float(len(covs[name]))
-    #print name, sum(covs[name]), len(covs[name]), f
+with meter.stage('cover'):
+    for entry in fastaindex.open_index(args.reference):
+        meter.count('references')
+        name = entry.name
+        length = entry.length
+        if not length:
+            continue
+
+        if args.sweep:
+            covered = cover.covered(name, length)
+            for key, bases in covered.items():
+                swept[key] += bases
+            n = covered[(MIN_SCORE, MIN_QUERY_LEN)]
+        elif bedgraph or histogram:
+            hist = [0]
+            for start, end, depth in cover.depth(name, length):
+                if depth >= len(hist):
+                    hist.extend([0] * (depth + 1 - len(hist)))
+                hist[depth] += end - start
+                if depth and bedgraph:
+                    print >>bedgraph, '%s\t%d\t%d\t%d' % (name, start, end,
+                                                          depth)
+            n = length - hist[0]
+
+            if len(hist) > len(genome_hist):
+                genome_hist.extend([0] * (len(hist) - len(genome_hist)))
+            for depth, bases in enumerate(hist):
+                genome_hist[depth] += bases
+            if histogram:
+                write_histogram(histogram, name, hist, length)
+        else:
+            n = cover.covered(name, length)
+
+        cover.discard(name)
+        coved += n
+        total += length
+        #print name, n, length, n / float(length)
+
+if bedgraph:
+    bedgraph.close()
+if histogram:
+    if total:
+        write_histogram(histogram, 'genome', genome_hist, total)
+    histogram.close()
+if args.sweep:
+    fp = open(args.sweep, 'w')
+    print >>fp, 'min_score\tmin_query_len\tcovered\ttotal\tfraction'
+    for score in scores:
+        for cutoff in lengths:
+            n = swept[(score, cutoff)]
+            print >>fp, '%d\t%d\t%d\t%d\t%g' % (score, cutoff, n, total,
+                                                n / float(total or 1))
+    fp.close()
 
 print 'total bases in reference:', total
 print 'total ref bases covered :', coved
 print 'fraction                :', coved / float(total)
-print 'reference               :', sys.argv[1]
-print 'blast file              :', sys.argv[2]
-print 'query sequences         :', sys.argv[4]
+print 'reference               :', args.reference
+print 'blast file              :', args.blast_file
+print 'query sequences         :', args.query
+
+metrics.finish(meter, args)
 
 #print coved, total, coved / float(total), sys.argv[1], sys.argv[2], MIN_QUERY_LEN
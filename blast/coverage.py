@@ -0,0 +1,291 @@
+"""
+How much of each reference sequence is covered by BLAST matches.  Sample
+usage: ::
+
+   cover = Coverage()
+   for record in blastparser.parse_file(filename):
+      for hit in record.hits:
+         for match in hit.matches:
+            cover.add_match(hit.subject_name, match)
+
+   for name, length in reference_lengths:
+      print name, cover.covered(name, length), length
+
+Only the intervals are kept, as pairs of longs in an array per reference,
+so memory is proportional to the number of HSPs, not to the length of the
+references.  covered() sorts a reference's intervals and counts the bases
+of their union, clipped to the reference; the references themselves can
+be read one at a time, after the matches.
+
+depth() sweeps over the sorted interval starts and ends, a difference
+array in all but name, giving the runs of bases covered by the same
+number of intervals; depth_histogram() totals them by depth.
+
+ThresholdCoverage answers 'how much is covered by matches scoring at least
+S, from queries at least L long' for every S and L of a sweep at once.
+Each interval is kept with the highest score threshold and length cutoff
+it passes; for each cutoff, max_level_runs() gives the highest score
+threshold passed over each run of bases, and the bases covered at each
+threshold follow by summing from the top.
+"""
+
+import heapq
+from array import array
+from bisect import bisect_right
+
+__all__ = ['Coverage', 'ThresholdCoverage', 'merge_intervals',
+           'depth_runs', 'depth_histogram', 'max_level_runs']
+
+def merge_intervals(intervals, length=None):
+    """
+    Yield the union of 'intervals', a flat sequence of 0-based half-open
+    (start, end) pairs, as sorted disjoint (start, end) intervals, clipped
+    to [0, length) if 'length' is given.
+    """
+    pairs = sorted(zip(intervals[::2], intervals[1::2]))
+    cur_start = cur_end = None
+    for start, end in pairs:
+        if start < 0:
+            start = 0
+        if length is not None and end > length:
+            end = length
+        if start >= end:
+            continue
+        if cur_end is not None and start <= cur_end:
+            if end > cur_end:
+                cur_end = end
+            continue
+        if cur_end is not None:
+            yield cur_start, cur_end
+        cur_start, cur_end = start, end
+    if cur_end is not None:
+        yield cur_start, cur_end
+
+def _clipped(intervals, length):
+    "the (start, end) pairs of the flat 'intervals', clipped; empty ones go."
+    pairs = []
+    for start, end in zip(intervals[::2], intervals[1::2]):
+        if start < 0:
+            start = 0
+        if length is not None and end > length:
+            end = length
+        if start < end:
+            pairs.append((start, end))
+    return pairs
+
+def depth_runs(intervals, length=None):
+    """
+    Yield (start, end, depth) for each run of bases covered by 'depth' of
+    'intervals', a flat sequence of 0-based half-open (start, end) pairs.
+    The runs are in order and cover [0, length), or [0, the last end) if
+    'length' is not given; adjacent runs differ in depth.
+    """
+    pairs = _clipped(intervals, length)
+    starts = sorted([ start for start, _ in pairs ])
+    ends = sorted([ end for _, end in pairs ])
+    n = len(starts)
+
+    run_start = run_depth = 0           # the run not yet yielded
+    depth = i = j = 0
+    while j < n:
+        pos = ends[j]
+        if i < n and starts[i] < pos:
+            pos = starts[i]
+        while i < n and starts[i] == pos:
+            depth += 1
+            i += 1
+        while j < n and ends[j] == pos:
+            depth -= 1
+            j += 1
+        if depth != run_depth:
+            if pos > run_start:
+                yield run_start, pos, run_depth
+            run_start, run_depth = pos, depth
+
+    if length is not None and length > run_start:
+        yield run_start, length, run_depth
+
+def depth_histogram(runs):
+    "a list of the number of bases at each depth, 0 up, in 'runs'."
+    hist = []
+    for start, end, depth in runs:
+        if depth >= len(hist):
+            hist.extend([0] * (depth + 1 - len(hist)))
+        hist[depth] += end - start
+    return hist
+
+def max_level_runs(intervals, levels, length=None):
+    """
+    Yield (start, end, level) for each run of bases over which the highest
+    of 'levels' among the 'intervals' covering them is 'level', or -1 where
+    none do.  'intervals' is a flat sequence of 0-based half-open (start,
+    end) pairs, and 'levels' holds one level for each; the runs are as for
+    depth_runs.
+    """
+    items = []
+    for k in xrange(len(levels)):
+        start, end = intervals[2 * k], intervals[2 * k + 1]
+        if start < 0:
+            start = 0
+        if length is not None and end > length:
+            end = length
+        if start < end:
+            items.append((start, end, levels[k]))
+    items.sort()
+    n = len(items)
+
+    heap = []                           # (-level, end) of open intervals
+    pos = i = 0
+    run_start, run_level = 0, -1
+    while 1:
+        while heap and heap[0][1] <= pos:
+            heapq.heappop(heap)
+        if heap:
+            level, nxt = -heap[0][0], heap[0][1]
+        elif i < n:
+            level, nxt = -1, None
+        else:
+            break
+        if level != run_level:
+            if pos > run_start:
+                yield run_start, pos, run_level
+            run_start, run_level = pos, level
+
+        # the highest level can only change at a start, or where it ends.
+        if i < n and (nxt is None or items[i][0] < nxt):
+            nxt = items[i][0]
+        pos = nxt
+        while i < n and items[i][0] == pos:
+            start, end, level = items[i]
+            heapq.heappush(heap, (-level, end))
+            i += 1
+
+    if run_level != -1:
+        if pos > run_start:
+            yield run_start, pos, run_level
+        run_start, run_level = pos, -1
+    if length is not None and length > run_start:
+        yield run_start, length, run_level
+
+class Coverage(object):
+    """
+    Intervals matched on each of a set of references.
+
+      * cover.add(name, start, end) -- add the 0-based, half-open interval
+        [start, end) of reference 'name'.
+      * cover.add_match(name, match) -- add the subject interval of a
+        BLAST match, whichever strand it is on.
+      * cover.covered(name, length) -- bases of 'name' covered, counting
+        only those in [0, length).
+      * cover.intervals(name, length=None) -- the merged intervals of 'name'.
+      * cover.depth(name, length=None) -- the depth_runs of 'name'.
+      * cover.names() -- the references with intervals.
+      * cover.discard(name) -- forget the intervals of 'name'.
+    """
+    def __init__(self):
+        self._intervals = {}
+
+    def add(self, name, start, end):
+        a = self._intervals.get(name)
+        if a is None:
+            a = self._intervals[name] = array('l')
+        a.append(start)
+        a.append(end)
+
+    def add_match(self, name, match):
+        start, end = match.subject_start, match.subject_end
+        if start > end:
+            start, end = end, start
+        self.add(name, start - 1, end)
+
+    def intervals(self, name, length=None):
+        return merge_intervals(self._intervals.get(name, ()), length)
+
+    def depth(self, name, length=None):
+        return depth_runs(self._intervals.get(name, ()), length)
+
+    def covered(self, name, length):
+        return sum([ end - start
+                     for start, end in self.intervals(name, length) ])
+
+    def names(self):
+        return self._intervals.keys()
+
+    def discard(self, name):
+        self._intervals.pop(name, None)
+
+    def __len__(self):
+        return len(self._intervals)
+
+class ThresholdCoverage(object):
+    """
+    Intervals matched on each of a set of references, for a sweep over
+    score thresholds and query length cutoffs.
+
+      * cover.add(name, start, end, score, query_length) -- add the 0-based,
+        half-open interval [start, end) of reference 'name'.
+      * cover.add_match(name, match, query_length) -- add the subject
+        interval of a BLAST match, which must have its score.
+      * cover.covered(name, length) -- a dict of (score threshold, length
+        cutoff) -> bases of 'name' covered, for every combination.
+      * cover.discard(name) -- forget the intervals of 'name'.
+
+    Intervals that pass no threshold or no cutoff are not kept.
+    """
+    def __init__(self, scores, lengths):
+        self.scores = sorted(set(scores))
+        self.lengths = sorted(set(lengths))
+        self._intervals = {}
+
+    def add(self, name, start, end, score, query_length):
+        score_level = bisect_right(self.scores, score) - 1
+        length_level = bisect_right(self.lengths, query_length) - 1
+        if score_level < 0 or length_level < 0:
+            return
+        x = self._intervals.get(name)
+        if x is None:
+            x = self._intervals[name] = (array('l'), array('l'), array('l'))
+        intervals, score_levels, length_levels = x
+        intervals.append(start)
+        intervals.append(end)
+        score_levels.append(score_level)
+        length_levels.append(length_level)
+
+    def add_match(self, name, match, query_length):
+        start, end = match.subject_start, match.subject_end
+        if start > end:
+            start, end = end, start
+        self.add(name, start - 1, end, match.score, query_length)
+
+    def covered(self, name, length):
+        result = dict.fromkeys([ (score, cutoff) for score in self.scores
+                                 for cutoff in self.lengths ], 0)
+        x = self._intervals.get(name)
+        if x is None:
+            return result
+
+        intervals, score_levels, length_levels = x
+        for j, cutoff in enumerate(self.lengths):
+            keep = [ k for k in xrange(len(length_levels))
+                     if length_levels[k] >= j ]
+            selected = array('l')
+            for k in keep:
+                selected.append(intervals[2 * k])
+                selected.append(intervals[2 * k + 1])
+            levels = [ score_levels[k] for k in keep ]
+
+            bases = [0] * len(self.scores)
+            for start, end, level in max_level_runs(selected, levels, length):
+                if level >= 0:
+                    bases[level] += end - start
+            n = 0
+            for i in range(len(self.scores) - 1, -1, -1):
+                n += bases[i]
+                result[(self.scores[i], cutoff)] = n
+        return result
+
+    def discard(self, name):
+        self._intervals.pop(name, None)
+
+    def __len__(self):
+        return len(self._intervals)
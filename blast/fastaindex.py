@@ -0,0 +1,420 @@
+"""
+A persistent index of the sequence names, lengths, descriptions and byte
+offsets in a FASTA file, so that scripts that need only those never read
+the sequences again.  Sample usage: ::
+
+   idx = open_index('genome.fa')           # builds it if necessary
+   for entry in idx:
+      print entry.name, entry.length, entry.description
+   print idx['chr1'].length, idx.description('gi|123|ref|NC_1|', '')
+   seq = idx.sequence('chr1')
+
+   descriptions = DescriptionCache(idx)    # keeps the most recently used
+   print descriptions.get('chr1', '')
+
+Building the index is one sequential pass over the FASTA file (plain or
+compressed; see inputs.open_input), counting bases without keeping them.
+The name of a record is the first word of its header line and the
+description the rest, as screed has them.  Lookups go through
+normalize_name(), which drops a 'gi|NNN|' prefix as the blast/ scripts
+always have, so 'gi|123|ref|NC_1|' and 'ref|NC_1|' find the same record;
+where names collide, the last record wins.
+
+The index is stored beside the FASTA file, in '<fasta>.fidx' (or in a
+temporary file, removed on close, if that cannot be written), as
+
+ - a header (see _HEADER) with the record and hash-slot counts and the
+   size and mtime of the FASTA file it was built from;
+ - one (header offset, sequence offset, length, string offset, name length,
+   description length) entry per record, in file order; offsets are into
+   the decompressed data for compressed files;
+ - an open-addressing hash table of record numbers, keyed by the crc32 of
+   the normalized name;
+ - the names and descriptions, concatenated.
+
+Nothing is read into memory when an index is opened; each lookup hashes
+into the mapped file.  DescriptionCache puts an LRU cache of descriptions
+in front of that, so that a script can look descriptions up as it goes,
+in bounded memory, however many sequences the FASTA file holds.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
+
+import inputs
+
+__all__ = ['FastaIndex', 'FastaEntry', 'DescriptionCache', 'build_index',
+           'open_index', 'index_filename', 'normalize_name']
+
+MAGIC = 'FASTAIDX'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIIQQdQ')
+_ENTRY = struct.Struct('<QQQQII')
+_SLOT = struct.Struct('<I')
+
+BLOCK_SIZE = 1 << 20
+DESCRIPTION_CACHE_SIZE = 100000
+
+def index_filename(fasta_filename):
+    return fasta_filename + '.fidx'
+
+def normalize_name(name):
+    "drop the 'gi|NNN|' prefix from an NCBI sequence name."
+    if name.startswith('gi|'):
+        return name.split('|', 2)[2]
+    return name
+
+def _slot_of(name, n_slots):
+    return (zlib.crc32(name) & 0xffffffff) % n_slots
+
+def _split_header(header):
+    "(name, description) of a header line, without its '>'."
+    fields = header.strip().split(None, 1)
+    if not fields:
+        return '', ''
+    if len(fields) == 1:
+        return fields[0], ''
+    return fields[0], fields[1]
+
+def _scan(fp):
+    """
+    Yield (header offset, sequence offset, header line, bases) for each
+    record of the FASTA file 'fp', reading it a block at a time.
+    """
+    record = None
+    header = None                       # the header line being read
+    header_offset = 0
+    line_start = True
+    pos = 0                             # offset of 'block'
+    while 1:
+        block = fp.read(BLOCK_SIZE)
+        if not block:
+            break
+        i, n = 0, len(block)
+        while i < n:
+            if header is not None:
+                j = block.find('\n', i)
+                if j < 0:
+                    header += block[i:]
+                    i = n
+                    continue
+                header += block[i:j]
+                i = j + 1
+                if record is not None:
+                    yield tuple(record)
+                record = [header_offset, pos + i, header.rstrip('\r'), 0]
+                header = None
+                line_start = True
+            elif line_start and block[i] == '>':
+                header_offset = pos + i
+                header = ''
+                i += 1
+            else:
+                j = block.find('\n>', i)
+                end = j < 0 and n or j + 1
+                if record is not None:
+                    seq = block[i:end]
+                    record[3] += len(seq) - seq.count('\n') - seq.count('\r')
+                line_start = block[end - 1] == '\n'
+                i = end
+        pos += n
+
+    if header is not None:
+        if record is not None:
+            yield tuple(record)
+        record = [header_offset, pos, header.rstrip('\r'), 0]
+    if record is not None:
+        yield tuple(record)
+
+def build_index(fasta_filename, filename=None):
+    """
+    Index 'fasta_filename' in one sequential pass, writing the index to
+    'filename' (by default, index_filename()).  Returns the index filename.
+    """
+    if filename is None:
+        filename = index_filename(fasta_filename)
+
+    st = os.stat(fasta_filename)
+    compressed = inputs.detect_compression(fasta_filename) is not None
+
+    entries = []
+    strings = []
+    ids = {}
+    string_offset = 0
+    fp = inputs.open_input(fasta_filename)
+    try:
+        for header_offset, seq_offset, header, length in _scan(fp):
+            name, description = _split_header(header)
+            ids[normalize_name(name)] = len(entries)
+            entries.append((header_offset, seq_offset, length, string_offset,
+                            len(name), len(description)))
+            strings.append(name)
+            strings.append(description)
+            string_offset += len(name) + len(description)
+    finally:
+        fp.close()
+
+    n = len(entries)
+    n_slots = 2 * n + 1
+    slots = [0] * n_slots
+    for key, i in ids.iteritems():
+        slot = _slot_of(key, n_slots)
+        while slots[slot]:
+            slot = (slot + 1) % n_slots
+        slots[slot] = i + 1
+
+    # write beside the index and rename it into place, so that a build
+    # that fails, or runs alongside another, never leaves a partial index
+    # that looks current.
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        fp = open(tmpname, 'wb')
+        try:
+            fp.write(_HEADER.pack(MAGIC, VERSION, int(compressed), n, n_slots,
+                                  st.st_mtime, st.st_size))
+            for entry in entries:
+                fp.write(_ENTRY.pack(*entry))
+            for i in slots:
+                fp.write(_SLOT.pack(i))
+            for s in strings:
+                fp.write(s)
+        finally:
+            fp.close()
+        os.rename(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+    return filename
+
+class FastaEntry(object):
+    "The name, description, length and offsets of one FASTA record."
+    __slots__ = ['name', 'description', 'length', 'offset', 'header_offset',
+                 'index']
+
+    def __init__(self, name, description, length, offset, header_offset,
+                 index):
+        self.name = name
+        self.description = description
+        self.length = length
+        self.offset = offset
+        self.header_offset = header_offset
+        self.index = index
+
+    def __repr__(self):
+        return "<FastaEntry %s (%d bp)>" % (self.name, self.length)
+
+class FastaIndex(object):
+    """
+    An open index of a FASTA file.
+
+    Methods:
+
+      * index[name] -- the FastaEntry for 'name'; KeyError if none.
+      * get(name, default=None)
+      * name in index, len(index)
+      * iter(index) -- the FastaEntry of each record, in file order.
+      * length(name), description(name[, default]) -- one field of an entry.
+      * sequence(name) -- read the sequence of 'name' from the FASTA file.
+      * is_current() -- False if the FASTA file has changed since indexing.
+    """
+    def __init__(self, fasta_filename, filename=None):
+        if filename is None:
+            filename = index_filename(fasta_filename)
+        self.fasta_filename = fasta_filename
+        self.filename = filename
+        self.temporary = False
+
+        fp = open(filename, 'rb')
+        try:
+            self.m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        if len(self.m) < _HEADER.size:
+            raise ValueError("%s is not a FASTA index" % (filename,))
+        (magic, version, compressed, self.n, self.n_slots, self.source_mtime,
+         self.source_size) = _HEADER.unpack_from(self.m, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a FASTA index" % (filename,))
+        self.compressed = bool(compressed)
+
+        self._entries_start = _HEADER.size
+        self._slots_start = self._entries_start + self.n * _ENTRY.size
+        self._strings_start = self._slots_start + self.n_slots * _SLOT.size
+
+    def close(self):
+        self.m.close()
+        if self.temporary and os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_current(self):
+        st = os.stat(self.fasta_filename)
+        return st.st_size == self.source_size and \
+               st.st_mtime == self.source_mtime
+
+    def __len__(self):
+        return self.n
+
+    def _entry(self, i):
+        (header_offset, offset, length, string_offset, name_len,
+         description_len) = _ENTRY.unpack_from(self.m, self._entries_start +
+                                               i * _ENTRY.size)
+        start = self._strings_start + string_offset
+        name = self.m[start:start + name_len]
+        start += name_len
+        description = self.m[start:start + description_len]
+        return FastaEntry(name, description, length, offset, header_offset, i)
+
+    def _name(self, i):
+        (_, _, _, string_offset, name_len, _) = \
+            _ENTRY.unpack_from(self.m, self._entries_start + i * _ENTRY.size)
+        start = self._strings_start + string_offset
+        return self.m[start:start + name_len]
+
+    def _find(self, name):
+        "return the record number of 'name', or -1."
+        if not self.n:
+            return -1
+        key = normalize_name(name)
+        slot = _slot_of(key, self.n_slots)
+        while 1:
+            i, = _SLOT.unpack_from(self.m, self._slots_start +
+                                   slot * _SLOT.size)
+            if not i:
+                return -1
+            if normalize_name(self._name(i - 1)) == key:
+                return i - 1
+            slot = (slot + 1) % self.n_slots
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def __getitem__(self, name):
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self._entry(i)
+
+    def get(self, name, default=None):
+        i = self._find(name)
+        if i < 0:
+            return default
+        return self._entry(i)
+
+    def length(self, name):
+        return self[name].length
+
+    def description(self, name, default=None):
+        entry = self.get(name)
+        if entry is None:
+            return default
+        return entry.description
+
+    def __iter__(self):
+        for i in xrange(self.n):
+            yield self._entry(i)
+
+    def sequence(self, name):
+        entry = self[name]
+        if entry.index + 1 < self.n:
+            end = self._entry(entry.index + 1).header_offset
+        else:
+            end = None
+
+        fp = inputs.open_input(self.fasta_filename)
+        try:
+            if self.compressed:         # no seeking; read up to it
+                skip = entry.offset
+                while skip:
+                    data = fp.read(min(skip, BLOCK_SIZE))
+                    if not data:
+                        break
+                    skip -= len(data)
+            else:
+                fp.seek(entry.offset)
+            if end is None:
+                data = fp.read()
+            else:
+                data = fp.read(end - entry.offset)
+        finally:
+            fp.close()
+        return ''.join(data.split())
+
+class DescriptionCache(object):
+    """
+    Descriptions from a FastaIndex, with the 'size' most recently looked up
+    (found or not) kept in memory.
+
+      * cache.get(name, default=None) -- the description of 'name'.
+      * cache.hits, cache.misses -- lookups answered from memory, and not.
+    """
+    def __init__(self, index, size=DESCRIPTION_CACHE_SIZE):
+        self.index = index
+        self.size = size
+        self.hits = self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self, name, default=None):
+        cache = self._cache
+        try:
+            description = cache.pop(name)
+            self.hits += 1
+        except KeyError:
+            description = self.index.description(name)
+            self.misses += 1
+            if len(cache) >= self.size:
+                cache.popitem(last=False)
+        cache[name] = description
+        if description is None:
+            return default
+        return description
+
+    def __len__(self):
+        return len(self._cache)
+
+def open_index(fasta_filename, filename=None, rebuild=True):
+    """
+    Open the index of 'fasta_filename', building it first if it does not
+    exist or (when 'rebuild' is true) if it is not a readable index or the
+    FASTA file has changed since it was built.  If the index cannot be written beside the FASTA file, a
+    temporary one is built instead, and removed when the index is closed.
+    """
+    if filename is None:
+        filename = index_filename(fasta_filename)
+
+    temporary = False
+    if os.path.exists(filename):
+        try:
+            idx = FastaIndex(fasta_filename, filename)
+        except ValueError:
+            if not rebuild:
+                raise
+        else:
+            if not rebuild or idx.is_current():
+                return idx
+            idx.close()
+
+    try:
+        build_index(fasta_filename, filename)
+    except (IOError, OSError):
+        fd, filename = tempfile.mkstemp(suffix='.fidx')
+        os.close(fd)
+        build_index(fasta_filename, filename)
+        temporary = True
+
+    idx = FastaIndex(fasta_filename, filename)
+    idx.temporary = temporary
+    return idx
@@ -0,0 +1,223 @@
+"""
+Transparent reading of plain, gzip- and bgzip-compressed input files,
+shared by the scripts in blast/, bowtie/ and meme/.  Sample usage: ::
+
+   for line in open_input('hits.map.gz'):
+      ...
+
+Compression is detected from a file's magic bytes, not its name.
+Compressed files are decompressed by background threads, which hand
+buffers of text to the reader through a bounded queue, so decompression
+overlaps with parsing (zlib releases the GIL while it works).  bgzip files
+are a series of independent blocks, so batches of blocks are decompressed
+by several threads at once; plain gzip is one stream, and gets one thread.
+
+Scripts outside blast/ put this directory on sys.path to import it.
+"""
+
+import sys
+import zlib
+import Queue
+import threading
+from cStringIO import StringIO
+
+import bgzf
+
+__all__ = ['open_input', 'detect_compression', 'PipedReader']
+
+BUFFER_SIZE = 1 << 20                   # compressed bytes per gzip read
+BATCH_BLOCKS = 64                       # bgzip blocks (~4 MB) per batch
+QUEUE_SIZE = 8                          # decompressed buffers read ahead
+
+def default_threads():
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def detect_compression(filename):
+    "Return 'bgzip', 'gzip' or None, from the first bytes of 'filename'."
+    fp = open(filename, 'rb')
+    try:
+        magic = fp.read(2)
+    finally:
+        fp.close()
+    if magic != '\x1f\x8b':
+        return None
+    if bgzf.is_bgzf(filename):
+        return 'bgzip'
+    return 'gzip'
+
+def _gzip_buffers(fp):
+    "yield the decompressed contents of the (multi-member) gzip file 'fp'."
+    try:
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while 1:
+            data = fp.read(BUFFER_SIZE)
+            if not data:
+                break
+            while data:
+                out = d.decompress(data)
+                if out:
+                    yield out
+                data = d.unused_data
+                if data:                # another member follows
+                    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = d.flush()
+        if out:
+            yield out
+    finally:
+        fp.close()
+
+def _bgzf_buffers(fp, threads):
+    """
+    yield the decompressed contents of the bgzip file 'fp', one batch of
+    blocks at a time, decompressing each batch with 'threads' threads.
+    """
+    if threads > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(threads)
+        decompress = lambda raws: pool.map(bgzf.decompress_block, raws)
+    else:
+        pool = None
+        decompress = lambda raws: map(bgzf.decompress_block, raws)
+
+    try:
+        while 1:
+            raws = []
+            for i in range(BATCH_BLOCKS):
+                raw = bgzf.read_raw_block(fp)
+                if not raw:
+                    break
+                raws.append(raw)
+            if not raws:
+                break
+            yield ''.join(decompress(raws))
+            if len(raws) < BATCH_BLOCKS:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        fp.close()
+
+class PipedReader(object):
+    """
+    A read-only file object over the buffers yielded by 'produce()', which
+    is run in a background thread.  At most 'queue_size' buffers wait to
+    be read at any time, which bounds the memory used by reading ahead.
+
+    Supports iteration over lines, readline() and read().
+    """
+    def __init__(self, produce, queue_size=QUEUE_SIZE, name=None):
+        self.name = name
+        self.closed = False
+        self.queue = Queue.Queue(queue_size)
+        self._buf = StringIO('')        # complete lines of the last buffer
+        self._carry = ''                # ...and its incomplete last line
+        self._eof = False
+
+        self.thread = threading.Thread(target=self._run, args=(produce,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, produce):
+        try:
+            for data in produce():
+                if self.closed:
+                    break
+                self.queue.put(data)
+        except Exception:
+            self.queue.put(sys.exc_info())
+            return
+        self.queue.put(None)
+
+    def _fill(self):
+        "read the next buffer; return False at the end of the input."
+        while not self._eof:
+            item = self.queue.get()
+            if item is None:
+                self._eof = True
+                data, self._carry = self._carry, ''
+            elif isinstance(item, tuple):
+                self._eof = True
+                raise item[0], item[1], item[2]
+            else:
+                data = self._carry + item
+                end = data.rfind('\n') + 1
+                data, self._carry = data[:end], data[end:]
+
+            if data:
+                self._buf = StringIO(data)
+                return True
+        return False
+
+    def __iter__(self):
+        while 1:
+            for line in self._buf:
+                yield line
+            if not self._fill():
+                break
+
+    def readline(self):
+        line = self._buf.readline()
+        while not line and self._fill():
+            line = self._buf.readline()
+        return line
+
+    def read(self, size=-1):
+        chunks = []
+        n = 0
+        while size < 0 or n < size:
+            if size < 0:
+                data = self._buf.read()
+            else:
+                data = self._buf.read(size - n)
+            if not data:
+                if not self._fill():
+                    break
+                continue
+            chunks.append(data)
+            n += len(data)
+        return ''.join(chunks)
+
+    def close(self):
+        "stop reading, and wait for the background thread to finish."
+        if self.closed:
+            return
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_input(filename, threads=None, queue_size=QUEUE_SIZE):
+    """
+    Open 'filename' for reading text, decompressing it on the fly if it is
+    gzip- or bgzip-compressed; '-' is stdin, read as it is.  'threads' is
+    the number of threads decompressing bgzip blocks (by default, one per
+    CPU); 'queue_size' the number of buffers decompressed ahead.
+    """
+    if filename == '-':
+        return sys.stdin
+
+    compression = detect_compression(filename)
+    if compression is None:
+        return open(filename)
+
+    fp = open(filename, 'rb')
+    if compression == 'bgzip':
+        if threads is None:
+            threads = default_threads()
+        produce = lambda: _bgzf_buffers(fp, threads)
+    else:
+        produce = lambda: _gzip_buffers(fp)
+    return PipedReader(produce, queue_size, filename)
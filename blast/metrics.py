@@ -0,0 +1,238 @@
+"""
+Counters, stage timings and progress reporting for the blast/, bowtie/
+and meme/ scripts.  Sample usage: ::
+
+   metrics = Metrics(progress=print_progress)
+   for record in blastparser.parse_file(filename, metrics=metrics):
+      with metrics.stage('output'):
+         ...
+   metrics.write('json', sys.stderr)
+
+A Metrics object counts lines, records, HSPs and bytes read (and any other
+counter a script chooses), and times the stages of a run.  Stages nest,
+and time is charged only to the innermost one, so the 'read', 'parse',
+'build' and 'output' times add up to the run time (less anything outside
+a stage, shown as 'other').  Instrumenting costs a couple of clock reads
+per record and per HSP, and per megabyte read; nothing is done per line.
+
+'progress' is called with the Metrics object at most every 'interval'
+seconds, from inside the timed stages.  Scripts get --metrics, --metrics-
+file and --quiet from add_arguments(), and a Metrics object for them from
+from_args().  Scripts outside blast/ put this directory on sys.path.
+"""
+
+import sys
+import json
+import time
+from cStringIO import StringIO
+
+__all__ = ['Metrics', 'print_progress', 'add_arguments', 'from_args',
+           'finish']
+
+COUNTERS = ('lines', 'records', 'hsps', 'bytes')
+PROGRESS_INTERVAL = 5.0
+READ_SIZE = 1 << 20
+
+class _Stage(object):
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.enter(self.name)
+
+    def __exit__(self, *exc):
+        self.metrics.leave()
+
+class _MeteredReader(object):
+    """
+    A file object that reads 'fp' a block at a time, charging the time to
+    the 'read' stage and counting bytes and lines.
+    """
+    def __init__(self, fp, metrics):
+        self.fp = fp
+        self.metrics = metrics
+        self.name = getattr(fp, 'name', None)
+
+    def _count(self, data):
+        counters = self.metrics.counters
+        counters['bytes'] += len(data)
+        counters['lines'] += data.count('\n')
+
+    def read(self, size=-1):
+        self.metrics.enter('read')
+        try:
+            data = self.fp.read(size)
+        finally:
+            self.metrics.leave()
+        self._count(data)
+        return data
+
+    def readline(self):
+        self.metrics.enter('read')
+        try:
+            line = self.fp.readline()
+        finally:
+            self.metrics.leave()
+        self._count(line)
+        return line
+
+    def __iter__(self):
+        carry = ''
+        while 1:
+            data = self.read(READ_SIZE)
+            if not data:
+                break
+            data = carry + data
+            end = data.rfind('\n') + 1
+            carry = data[end:]
+            for line in StringIO(data[:end]):
+                yield line
+        if carry:
+            yield carry
+
+    def close(self):
+        self.fp.close()
+
+class Metrics(object):
+    """
+    Counters and stage timings for one run.
+
+    Methods:
+
+      * count(name, n=1) -- add 'n' to counter 'name'.
+      * stage(name) -- a context manager timing its body as stage 'name'.
+      * enter(name), leave() -- the same, by hand.
+      * iterate(iterable, stage, counter=None) -- yield from 'iterable',
+        timing each step as 'stage' and counting the items in 'counter'.
+      * reader(fp) -- wrap the file 'fp', timing and counting what is read.
+      * summary() -- a dict of counters, stage times and rates.
+      * write(format, fp) -- write the summary as 'json' or 'text'.
+    """
+    def __init__(self, progress=None, interval=PROGRESS_INTERVAL, name=None):
+        self.name = name
+        self.progress = progress
+        self.interval = interval
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.stages = {}
+        self.start = self._last = time.time()
+        self._stack = [None]            # None is time outside any stage
+        self._next_progress = self.start + interval
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def _switch(self):
+        "charge the time since the last switch to the current stage."
+        now = time.time()
+        top = self._stack[-1]
+        self.stages[top] = self.stages.get(top, 0.0) + now - self._last
+        self._last = now
+        return now
+
+    def enter(self, name):
+        self._switch()
+        self._stack.append(name)
+
+    def leave(self):
+        now = self._switch()
+        self._stack.pop()
+        if self.progress is not None and now >= self._next_progress:
+            self._next_progress = now + self.interval
+            self.progress(self)
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def iterate(self, iterable, stage, counter=None):
+        it = iter(iterable)
+        counters = self.counters
+        if counter is not None:
+            counters.setdefault(counter, 0)
+        while 1:
+            self.enter(stage)
+            try:
+                item = it.next()
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            if counter is not None:
+                counters[counter] += 1
+            yield item
+
+    def reader(self, fp):
+        return _MeteredReader(fp, self)
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def summary(self):
+        self._switch()
+        elapsed = self.elapsed()
+        stages = dict([ (name or 'other', t)
+                        for name, t in self.stages.items() ])
+        rates = {}
+        if elapsed > 0:
+            for name, n in self.counters.items():
+                rates[name + '_per_s'] = n / elapsed
+            rates['mb_per_s'] = self.counters['bytes'] / elapsed / 1e6
+        return dict(name=self.name, elapsed=elapsed,
+                    counters=dict(self.counters), stages=stages, rates=rates)
+
+    def write(self, format, fp):
+        summary = self.summary()
+        if format == 'json':
+            json.dump(summary, fp, sort_keys=True)
+            fp.write('\n')
+            return
+
+        print >>fp, '%s: %.2f s' % (summary['name'] or 'total',
+                                    summary['elapsed'])
+        for name in sorted(summary['counters']):
+            print >>fp, '  %-10s %12d  (%.1f/s)' % \
+                  (name, summary['counters'][name],
+                   summary['rates'].get(name + '_per_s', 0))
+        for name in sorted(summary['stages']):
+            print >>fp, '  %-10s %11.2fs' % (name, summary['stages'][name])
+
+def print_progress(metrics, fp=sys.stderr):
+    "the default progress callback: one line of counts and throughput."
+    counters = metrics.counters
+    elapsed = metrics.elapsed()
+    extra = [ '%d %s' % (counters[name], name)
+              for name in sorted(counters) if name not in COUNTERS ]
+    line = '... %d records, %d HSPs, %d lines, %.1f MB (%.1f MB/s)' % \
+           (counters['records'], counters['hsps'], counters['lines'],
+            counters['bytes'] / 1e6,
+            counters['bytes'] / 1e6 / max(elapsed, 1e-9))
+    if extra:
+        line += ', ' + ', '.join(extra)
+    print >>fp, line
+
+def add_arguments(parser):
+    "add --metrics, --metrics-file and --quiet to the argparse 'parser'."
+    parser.add_argument('--metrics', choices=('json', 'text'),
+                        help='print a summary of counters and stage timings'
+                        ' when done')
+    parser.add_argument('--metrics-file', default=None,
+                        help='where to write the summary (default: stderr)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not report progress')
+
+def from_args(args, name=None):
+    progress = print_progress
+    if args.quiet:
+        progress = None
+    return Metrics(progress, name=name)
+
+def finish(metrics, args):
+    "write the summary, if the command line asked for one."
+    if not args.metrics:
+        return
+    if args.metrics_file:
+        fp = open(args.metrics_file, 'w')
+        metrics.write(args.metrics, fp)
+        fp.close()
+    else:
+        metrics.write(args.metrics, sys.stderr)
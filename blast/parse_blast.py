@@ -1,5 +1,8 @@
 from __future__ import generators
+import os
+import re
 import math
+import mmap
 
 class CoordsGroupStart(object):
     pass
@@ -21,25 +24,194 @@ def get_ori_letterunit(start,end,seq,gapchar='-'):
         ori=1
     else:
         ori= -1
-    ngap=0
-    for l in seq:
-        if l==gapchar:
-            ngap+=1
-    seqlen=len(seq)-ngap
+    seqlen=len(seq)-seq.count(gapchar)
     if ori*float(end-start)/seqlen >2.0:
         letterunit=3
     else:
         letterunit=1
     return ori,letterunit
 
+def neg_log10_evalue(s):
+    """convert an expect value as printed by BLAST (e.g. 'e-100', '2e-10,')
+    to -log10(expect); 0.0 and unparseable values give 300."""
+    if s[0]=='e':
+        s='1'+s
+    if s.endswith(','): s = s.strip(',')
+    try:
+        return -math.log(float(s))/math.log(10.0)
+    except (ValueError,OverflowError), e:
+        return 300.
+
+def sniff_format(line):
+    """guess the format of BLAST output from its first non-blank line:
+    'xml' (-m 7 / -outfmt 5), 'tabular' (-m 8/9 / -outfmt 6/7) or 'text'"""
+    line=line.lstrip('\xef\xbb\xbf').lstrip()
+    if line.startswith('<?xml') or line.startswith('<BlastOutput'):
+        return 'xml'
+    if line.startswith('#') or line.count('\t')>=11:
+        return 'tabular'
+    return 'text'
+
+# default column order of tabular output, and the '# Fields:' names that
+# -m 9 / -outfmt 7 use for the columns parse_tabular needs.
+TABULAR_COLUMNS=('qseqid','sseqid','pident','length','mismatch','gapopen',
+                 'qstart','qend','sstart','send','evalue','bitscore')
+_tabular_field_names={'query id':'qseqid','query acc.':'qseqid',
+                      'query acc.ver':'qseqid','query acc':'qseqid',
+                      'subject id':'sseqid','subject acc.':'sseqid',
+                      'subject acc.ver':'sseqid','subject acc':'sseqid',
+                      '% identity':'pident','alignment length':'length',
+                      'mismatches':'mismatch','gap opens':'gapopen',
+                      'q. start':'qstart','q. end':'qend',
+                      's. start':'sstart','s. end':'send',
+                      'evalue':'evalue','bit score':'bitscore'}
+_tabular_needed=('qseqid','sseqid','pident','length','qstart','qend',
+                 'sstart','send','evalue','bitscore')
+
+# query and subject IDs that BLAST makes up when it does not parse
+# deflines; the text report names these sequences by their definitions.
+_generic_query_id=re.compile(r'Query_\d+$|lcl\|\d+_\d+$')
+_generic_subject_id=re.compile(r'gnl\|BL_ORD_ID\|\d+$|Subject_\d+$')
+
+# record markers recognized by BlastHitParser.parse_mmap; 'Identities ='
+# may appear anywhere in a line, the rest only at the start of one.
+_marker_re = re.compile(r'^(?:Query[=:]|>| Score =|Sbjct:|  Database:)'
+                        r'|Identities =', re.M)
+_flush_markers = ('Query=', '>', ' Score =', '  Database:')
+
+class HspFilter(object):
+    """decide, HSP by HSP and in report order, which HSPs to keep:
+    those scoring at least min_score, with expect at most max_evalue, in
+    the first max_hits_per_query hits of their query and, if
+    best_hits_only, scoring as high as the query's first (best) HSP.
+    Call start_query() and start_hit() as each begins, then check() for
+    each HSP, which returns None to keep it, 'hsp' to drop it, or 'query'
+    to drop it and the rest of the query.  BLAST reports hits best first,
+    so once the first HSP of a hit fails, no later hit can pass."""
+    def __init__(self,min_score=None,max_evalue=None,max_hits_per_query=None,
+                 best_hits_only=False):
+        self.min_score=min_score
+        self.max_evalue=max_evalue
+        self.max_hits_per_query=max_hits_per_query
+        self.best_hits_only=best_hits_only
+        self.min_e_value=None # AS -log10(expect), LIKE BlastHitParser.e_value
+        if max_evalue is not None:
+            if max_evalue>0:
+                self.min_e_value=-math.log(max_evalue)/math.log(10.0)-1e-9
+            else:
+                self.min_e_value=300.
+        self.start_query()
+    def start_query(self):
+        self.best_score=None
+        self.n_hits=0
+        self.n_hsps=0
+    def start_hit(self):
+        self.n_hits+=1
+        self.n_hsps=0
+    def check(self,score,e_value):
+        "return None, 'hsp' or 'query' for an HSP; e_value is -log10(expect)"
+        self.n_hsps+=1
+        if self.max_hits_per_query is not None and \
+           self.n_hits>self.max_hits_per_query:
+            return 'query'
+        if (self.min_score is not None and score<self.min_score) or \
+           (self.min_e_value is not None and e_value<self.min_e_value) or \
+           (self.best_hits_only and self.best_score is not None and \
+            score<self.best_score):
+            if self.n_hsps==1: # THE HIT'S BEST HSP FAILED; SO WILL THE REST
+                return 'query'
+            return 'hsp'
+        if self.best_score is None:
+            self.best_score=score
+        return None
+
+def read_tabular(myfile):
+    """generate (query_id, subject_id, query_start, query_end, subject_start,
+    subject_end, e_value, blast_score, identity_percent, length) tuples from
+    tabular BLAST output (blastall -m 8/9, BLAST+ -outfmt 6/7), converted as
+    BlastHitParser converts text output.  A '# Fields:' comment line, if
+    present, gives the column order."""
+    columns=TABULAR_COLUMNS
+    nline=0
+    log=math.log
+    ln10=log(10.0)
+    for line in myfile:
+        nline+=1
+        if line[0]=='#':
+            if line.startswith('# Fields:'):
+                names=line.split(':',1)[1].split(',')
+                columns=tuple([ _tabular_field_names.get(x.strip(),x.strip())
+                                for x in names ])
+            continue
+        if columns is not None:
+            missing=set(_tabular_needed)-set(columns)
+            if missing:
+                raise ValueError('tabular BLAST output lacks columns: %s'
+                                 % ', '.join(sorted(missing)))
+            (iq,isb,ipid,ilen,iqs,iqe,iss,ise,iev,ibs)= \
+                [ columns.index(x) for x in _tabular_needed ]
+            columns=None
+        c=line.rstrip('\r\n').split('\t')
+        if len(c)<2:
+            continue
+        q_start=int(c[iqs]); q_end=int(c[iqe])
+        s_start=int(c[iss]); s_end=int(c[ise])
+        if q_start<q_end:  # handles forward orientation
+            q_start-=1
+        if s_start<s_end:
+            s_start-=1
+        try:
+            e_value= -log(float(c[iev]))/ln10
+        except (ValueError,OverflowError), e:
+            e_value=neg_log10_evalue(c[iev].strip())
+        yield (c[iq],c[isb],q_start,q_end,s_start,s_end,e_value,
+               float(c[ibs]),int(float(c[ipid])),int(c[ilen]))
+    if nline == 0: # no blast output??
+        raise IOError('no BLAST output.  Check that blastall is in your PATH')
+
 class BlastIval(object):
     def __repr__(self):
         return '<BLAST-IVAL: '  + repr(self.__dict__) + '>'
 
+class BlastBlocks(BlastIval):
+    """all ungapped blocks of one alignment: the attributes of a BlastIval,
+    except that src_start, src_end, dest_start and dest_end are NumPy
+    arrays with one entry per block."""
+    def __len__(self):
+        return len(self.src_start)
+
+def ungapped_blocks(query_seq,subject_seq,gapchar='-'):
+    """find the ungapped blocks of an alignment with NumPy.  Returns arrays
+    (q_start,q_end,s_start,s_end) of the letter offsets of each block from
+    the start of the query and subject sequences, as generate_intervals
+    passes them to get_interval_obj."""
+    import numpy
+    q=numpy.frombuffer(query_seq,numpy.uint8)
+    s=numpy.frombuffer(subject_seq,numpy.uint8)
+    gap=ord(gapchar)
+    q_letter=q!=gap
+    s_letter=s!=gap
+    ungapped=numpy.zeros(len(q)+2,numpy.int8)
+    ungapped[1:-1]=q_letter&s_letter
+    edges=numpy.diff(ungapped) # +1 AT BLOCK STARTS, -1 JUST AFTER BLOCK ENDS
+    starts=numpy.flatnonzero(edges==1)
+    ends=numpy.flatnonzero(edges==-1)
+    q_before=numpy.zeros(len(q)+1,numpy.int64) # LETTERS BEFORE EACH COLUMN
+    numpy.cumsum(q_letter,out=q_before[1:])
+    s_before=numpy.zeros(len(s)+1,numpy.int64)
+    numpy.cumsum(s_letter,out=s_before[1:])
+    return q_before[starts],q_before[ends],s_before[starts],s_before[ends]
+
 class BlastHitParser(object):
     """reads alignment info from blastall standard output.
     Method parse_file(fo) reads file object fo, and generates tuples
-    suitable for BlastIval.
+    suitable for BlastIval.  If keep_sequences is False, query_seq and
+    subject_seq are left empty and only their lengths are recorded.
+    parse_tabular(fo) and parse_xml(fo) read tabular and XML output into
+    the same attributes; tabular output has no sequences, so with it
+    only subclasses that do not scan the alignment can be used.  If
+    hsp_filter is set, HSPs it rejects are dropped before
+    generate_intervals is called, and skipped over where possible.
 
     Attributes:
             query_seq
@@ -48,6 +220,8 @@ class BlastHitParser(object):
             subject_seq
             subject_start
             subject_end
+            query_len
+            subject_len
             query_id
             subject_id
             e_value
@@ -55,6 +229,8 @@ class BlastHitParser(object):
             identity_percent
     """
     gapchar='-'
+    keep_sequences=True # SET False TO TRACK ALIGNMENT LENGTHS ONLY
+    hsp_filter=None # AN HspFilter, TO DROP HSPs WHILE PARSING
     def __init__(self):
         self.hit_id=0
         self.nline = 0
@@ -63,6 +239,8 @@ class BlastHitParser(object):
         "flush any alignment info, so we can start reading new alignment"
         self.query_seq=""
         self.subject_seq=""
+        self.query_len=0
+        self.subject_len=0
         self.hit_id+=1
     def save_query(self,line):
         self.query_id=line.split()[1]
@@ -70,15 +248,9 @@ class BlastHitParser(object):
         self.subject_id=line.split()[0][1:]
     def save_score(self,line):
         "save a Score: line"
-        self.blast_score=float(line.split()[2])
-        s=line.split()[7]
-        if s[0]=='e':
-            s='1'+s
-        if s.endswith(','): s = s.strip(',')
-        try:
-            self.e_value= -math.log(float(s))/math.log(10.0)
-        except (ValueError,OverflowError), e:
-            self.e_value=300.
+        c=line.split()
+        self.blast_score=float(c[2])
+        self.e_value=neg_log10_evalue(c[7])
     def save_identity(self,line):
         "save Identities line"
         s=line.split()[3][1:]
@@ -87,11 +259,13 @@ class BlastHitParser(object):
         "save a Query: line"
         c=line.split()
         self.query_end=int(c[3])
-        if not self.query_seq:
+        if not self.query_len:
             self.query_start=int(c[1])
             if self.query_start < self.query_end:  # handles forward orientation
                 self.query_start -= 1
-        self.query_seq+=c[2]
+        if self.keep_sequences:
+            self.query_seq+=c[2]
+        self.query_len+=len(c[2])
         self.seq_start_char=line.find(c[2], 5) # IN CASE BLAST SCREWS UP Sbjct:
     def save_subject_line(self,line):
         "save a Sbjct: line, attempt to handle various BLAST insanities"
@@ -103,15 +277,19 @@ class BlastHitParser(object):
             c=['Sbjct:',line[6:self.seq_start_char]] \
                +line[self.seq_start_char:].split() # FIX BLAST SCREW-UP
         self.subject_end=int(c[3])
-        if not self.subject_seq:
+        if not self.subject_len:
             self.subject_start=int(c[1])
             if self.subject_start < self.subject_end:  # handles forward orientation
                 self.subject_start -= 1
-        self.subject_seq+=c[2]
-        lendiff=len(self.query_seq)-len(self.subject_seq)
+        if self.keep_sequences:
+            self.subject_seq+=c[2]
+        self.subject_len+=len(c[2])
+        lendiff=self.query_len-self.subject_len
         if lendiff>0: # HANDLE TBLASTN SCREWINESS: Sbjct SEQ OFTEN TOO SHORT!!
             # THIS APPEARS TO BE ASSOCIATED ESPECIALLY WITH STOP CODONS *
-            self.subject_seq+=lendiff*'A' # EXTEND TO SAME LENGTH AS QUERY...
+            if self.keep_sequences: # EXTEND TO SAME LENGTH AS QUERY...
+                self.subject_seq+=lendiff*'A'
+            self.subject_len+=lendiff
         elif lendiff<0 and not hasattr(self,'ignore_query_truncation'):
             # WHAT THE HECK?!?!  WARN THE USER: BLAST RESULTS ARE SCREWY...
             raise ValueError(
@@ -151,8 +329,28 @@ class BlastHitParser(object):
             o.dest_start = subject_end
             o.dest_end = subject_start
         return o
+    def get_interval_arrays(self):
+        """return (src_start,src_end,dest_start,dest_end) NumPy arrays for
+        every ungapped block of the current alignment, computed in bulk;
+        they match the BlastIval objects from generate_intervals."""
+        import numpy
+        query_ori,query_factor=get_ori_letterunit(self.query_start,\
+                  self.query_end,self.query_seq,self.gapchar)
+        subject_ori,subject_factor=get_ori_letterunit(self.subject_start,\
+                  self.subject_end,self.subject_seq,self.gapchar)
+        q_start,q_end,s_start,s_end=ungapped_blocks(self.query_seq,
+                                                    self.subject_seq,
+                                                    self.gapchar)
+        query_start=self.query_start+q_start*(query_ori*query_factor)
+        query_end=self.query_start+q_end*(query_ori*query_factor)
+        subject_start=self.subject_start+s_start*(subject_ori*subject_factor)
+        subject_end=self.subject_start+s_end*(subject_ori*subject_factor)
+        return (numpy.minimum(query_start,query_end),
+                numpy.maximum(query_start,query_end),
+                numpy.minimum(subject_start,subject_end),
+                numpy.maximum(subject_start,subject_end))
     def is_valid_hit(self):
-        return self.query_seq and self.subject_seq
+        return self.query_len and self.subject_len
     def generate_intervals(self):
         "generate interval tuples for the current alignment"
         yield CoordsGroupStart() # bracket with grouping markers
@@ -190,6 +388,10 @@ class BlastHitParser(object):
 
     def parse_file(self,myfile):
         "generate interval tuples by parsing BLAST output from myfile"
+        if self.hsp_filter is not None:
+            for t in self.parse_file_filtered(myfile):
+                yield t
+            return
         for line in myfile:
             self.nline += 1
             if self.is_valid_hit() and \
@@ -214,6 +416,264 @@ class BlastHitParser(object):
         if self.nline == 0: # no blast output??
             raise IOError('no BLAST output.  Check that blastall is in your PATH')
 
+    def parse_file_filtered(self,myfile):
+        """parse_file, keeping only the HSPs that pass self.hsp_filter: the
+        lines of a rejected HSP are skipped unparsed, and once a query
+        can have no more passing HSPs, so is the rest of it."""
+        f=self.hsp_filter
+        skip=None # None, 'hsp' OR 'query'
+        for line in myfile:
+            self.nline += 1
+            if skip is not None:
+                if line.startswith('Query='):
+                    skip=None
+                elif skip=='hsp' and (line.startswith('>') or \
+                     line.startswith(' Score =') or \
+                     line.startswith('  Database:')):
+                    skip=None
+                else:
+                    continue
+            if self.is_valid_hit() and \
+               (is_line_start('>',line) or is_line_start(' Score =',line) \
+                or is_line_start('  Database:',line) \
+                or is_line_start('Query=',line)):
+                for t in self.generate_intervals(): # REPORT THIS ALIGNMENT
+                    yield t # GENERATE ALL ITS INTERVAL MATCHES
+                self.reset() # RESET TO START A NEW ALIGNMENT
+            if is_line_start('Query=',line):
+                self.save_query(line)
+                f.start_query()
+            elif is_line_start('>',line):
+                self.save_subject(line)
+                f.start_hit()
+            elif is_line_start(' Score =',line):
+                self.save_score(line)
+                skip=f.check(self.blast_score,self.e_value)
+            elif 'Identities =' in line:
+                self.save_identity(line)
+            elif is_line_start('Query:',line):
+                self.save_query_line(line)
+            elif is_line_start('Sbjct:',line):
+                self.save_subject_line(line)
+        if self.nline == 0: # no blast output??
+            raise IOError('no BLAST output.  Check that blastall is in your PATH')
+
+    def flush(self):
+        "generate interval tuples for any alignment not yet reported"
+        if self.is_valid_hit():
+            for t in self.generate_intervals():
+                yield t
+            self.reset()
+
+    def parse_mmap(self,filename,start=0,end=None):
+        """generate the same interval tuples as parse_file, but memory-map
+        filename and jump from one record marker to the next, so that only
+        marker lines are ever copied out of the file.  start and end limit
+        the scan to a byte range, which must begin at the start of a line.
+        With self.hsp_filter set, rejected HSPs are skipped, and once a
+        query can have no more passing HSPs, the scan jumps to the next."""
+        fp=open(filename,'rb')
+        try:
+            size=os.fstat(fp.fileno()).st_size
+            if size==0: # no blast output??
+                raise IOError('no BLAST output.  Check that blastall is in your PATH')
+            m=mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        if end is None:
+            end=size
+        search=_marker_re.search
+        f=self.hsp_filter
+        skip_hsp=False
+        pos=start
+        try:
+            while 1:
+                match=search(m,pos,end)
+                if match is None:
+                    break
+                token=match.group()
+                line_start=match.start()
+                if token=='Identities =': # FIND THE START OF ITS LINE
+                    line_start=m.rfind('\n',start,line_start)+1 or start
+                line_end=m.find('\n',match.end(),end)
+                if line_end<0:
+                    line_end=end
+                line=m[line_start:line_end]
+                pos=line_end+1
+                self.nline+=1
+                if skip_hsp:
+                    if token not in _flush_markers:
+                        continue
+                    skip_hsp=False
+                if token in _flush_markers and self.is_valid_hit():
+                    for t in self.generate_intervals(): # REPORT THIS ALIGNMENT
+                        yield t
+                    self.reset() # RESET TO START A NEW ALIGNMENT
+                if token=='Query:':
+                    self.save_query_line(line)
+                elif token=='Sbjct:':
+                    self.save_subject_line(line)
+                elif token=='Identities =':
+                    self.save_identity(line)
+                elif token==' Score =':
+                    self.save_score(line)
+                    if f is not None:
+                        verdict=f.check(self.blast_score,self.e_value)
+                        if verdict=='query': # JUMP TO THE NEXT QUERY
+                            pos=m.find('\nQuery=',pos-1,end)+1 or end
+                        elif verdict=='hsp':
+                            skip_hsp=True
+                elif token=='>':
+                    self.save_subject(line)
+                    if f is not None:
+                        f.start_hit()
+                elif token=='Query=':
+                    self.save_query(line)
+                    if f is not None:
+                        f.start_query()
+        finally:
+            m.close()
+
+    def _save_hsp(self,query_id,subject_id,q_start,q_end,s_start,s_end,
+                  e_value,score,identity,length,q_seq="",s_seq=""):
+        """set the alignment attributes from one already-parsed HSP, with
+        coordinates and e_value converted as in save_query_line etc."""
+        self.query_id=query_id
+        self.subject_id=subject_id
+        self.query_start=q_start
+        self.query_end=q_end
+        self.subject_start=s_start
+        self.subject_end=s_end
+        self.e_value=e_value
+        self.blast_score=score
+        self.identity_percent=identity
+        self.query_len=self.subject_len=length
+        if self.keep_sequences:
+            self.query_seq=q_seq
+            self.subject_seq=s_seq
+
+    def parse_tabular(self,myfile):
+        """generate interval tuples by parsing tabular BLAST output
+        (blastall -m 8/9, BLAST+ -outfmt 6/7) from myfile."""
+        f=self.hsp_filter
+        query_id=subject_id=None
+        skip=False
+        for row in read_tabular(myfile):
+            self.nline += 1
+            if f is not None:
+                if row[0]!=query_id:
+                    query_id,subject_id,skip=row[0],None,False
+                    f.start_query()
+                if skip:
+                    continue
+                if row[1]!=subject_id:
+                    subject_id=row[1]
+                    f.start_hit()
+                verdict=f.check(row[7],row[6])
+                if verdict is not None:
+                    skip=verdict=='query'
+                    continue
+            self.reset()
+            self._save_hsp(*row)
+            for t in self.generate_intervals():
+                yield t
+
+    def parse_xml(self,myfile):
+        """generate interval tuples by parsing BLAST XML output
+        (blastall -m 7, BLAST+ -outfmt 5) from myfile, one HSP at a time.
+        As in the text report, query and subject names are the first word
+        of their definition lines."""
+        try:
+            from xml.etree.cElementTree import iterparse
+        except ImportError:
+            from xml.etree.ElementTree import iterparse
+
+        f=self.hsp_filter
+        skip=False
+        query_id=subject_id=None
+        container=None
+        for event,elem in iterparse(myfile,events=('start','end')):
+            tag=elem.tag
+            if event=='start':
+                if tag=='BlastOutput_iterations':
+                    container=elem
+                continue
+            self.nline += 1
+            if tag=='Hsp':
+                get=elem.findtext
+                if f is not None:
+                    if skip:
+                        elem.clear()
+                        continue
+                    verdict=f.check(float(get('Hsp_bit-score')),
+                                    neg_log10_evalue(get('Hsp_evalue')))
+                    if verdict is not None:
+                        skip=verdict=='query'
+                        elem.clear()
+                        continue
+                length=int(get('Hsp_align-len'))
+                identity=int(get('Hsp_identity') or 0)
+                q_start=int(get('Hsp_query-from'))
+                q_end=int(get('Hsp_query-to'))
+                s_start=int(get('Hsp_hit-from'))
+                s_end=int(get('Hsp_hit-to'))
+                if q_start<q_end:  # handles forward orientation
+                    q_start-=1
+                if s_start<s_end:
+                    s_start-=1
+                self.reset()
+                self._save_hsp(query_id,subject_id,q_start,q_end,s_start,s_end,
+                               neg_log10_evalue(get('Hsp_evalue')),
+                               float(get('Hsp_bit-score')),
+                               100*identity//length,length,
+                               get('Hsp_qseq') or "",get('Hsp_hseq') or "")
+                for t in self.generate_intervals():
+                    yield t
+                elem.clear()
+            elif tag=='Iteration_query-ID':
+                query_id=elem.text
+                if f is not None:
+                    f.start_query()
+                    skip=False
+            elif tag=='Iteration_query-def':
+                if elem.text and _generic_query_id.match(query_id or ''):
+                    query_id=elem.text.split()[0]
+            elif tag=='Hit_id':
+                subject_id=elem.text
+                if f is not None:
+                    f.start_hit()
+            elif tag=='Hit_def':
+                if elem.text and _generic_subject_id.match(subject_id or ''):
+                    subject_id=elem.text.split()[0]
+            elif tag=='Hit':
+                elem.clear()
+            elif tag=='Iteration':
+                elem.clear()
+                if container is not None:
+                    container.clear()
+        if self.nline == 0: # no blast output??
+            raise IOError('no BLAST output.  Check that blastall is in your PATH')
+
+class BlastBlockParser(BlastHitParser):
+    """batched version of BlastHitParser: generate_intervals yields a single
+    BlastBlocks object per alignment instead of a BlastIval per ungapped
+    block, with no grouping markers.  Requires NumPy."""
+    def generate_intervals(self):
+        o=BlastBlocks()
+        o.hit_id=self.hit_id
+        o.src_id=self.query_id
+        o.dest_id=self.subject_id
+        o.blast_score=self.blast_score
+        o.e_value=self.e_value
+        o.percent_id=self.identity_percent
+        o.src_ori=get_ori_letterunit(self.query_start,self.query_end,
+                                     self.query_seq,self.gapchar)[0]
+        o.dest_ori=get_ori_letterunit(self.subject_start,self.subject_end,
+                                      self.subject_seq,self.gapchar)[0]
+        o.src_start,o.src_end,o.dest_start,o.dest_end= \
+            self.get_interval_arrays()
+        yield o
+
 if __name__=='__main__':
     import sys
     p=BlastHitParser()
@@ -0,0 +1,394 @@
+"""
+Parse a BLAST report once and feed each record to several consumers in
+the same pass.  Sample usage: ::
+
+   p = Pipeline()
+   p.add('csv', CSVConsumer('hits.csv'))
+   p.add('summary', SummaryConsumer())
+   p.add('best', BestHitsConsumer(), mode='process')
+   results = p.run_file('blast_output.txt')
+   print results['summary']
+
+A consumer has a tuple of the HSP 'fields' it needs, consume(record),
+called for each record in file order, and finish(), which returns its
+result.  The report is parsed with compact=True and the union of the
+consumers' fields.  Each consumer runs in one of three modes:
+
+ - 'inline': in the parsing thread;
+ - 'thread': in a thread of its own, fed through a bounded queue -- for
+   consumers that mostly wait on I/O;
+ - 'process': in a process of its own, fed through a bounded queue -- for
+   CPU-bound consumers.  Records are pickled to it in batches, and its
+   result pickled back.
+
+A consumer that fails stops being fed; its error is raised from run()
+once the others are done.
+"""
+
+import sys
+import Queue
+import threading
+import traceback
+
+import blastparser
+import coverage
+import fastaindex
+import rbh
+import writers
+
+__all__ = ['Pipeline', 'Consumer', 'CSVConsumer', 'SummaryConsumer',
+           'CoverageConsumer', 'BestHitsConsumer', 'MODES']
+
+MODES = ('inline', 'thread', 'process')
+BATCH_RECORDS = 256
+QUEUE_SIZE = 16
+
+class Consumer(object):
+    "The consumer interface; see the module docstring."
+    fields = ()
+
+    def consume(self, record):
+        raise NotImplementedError
+
+    def finish(self):
+        return None
+
+###
+
+class _Inline(object):
+    def __init__(self, name, consumer, metrics):
+        self.name = name
+        self.consumer = consumer
+        self.metrics = metrics
+
+    def put(self, batch):
+        consume = self.consumer.consume
+        if self.metrics is None:
+            for record in batch:
+                consume(record)
+        else:
+            with self.metrics.stage(self.name):
+                for record in batch:
+                    consume(record)
+
+    def result(self):
+        return self.consumer.finish()
+
+def _drain(get):
+    "read batches until the end-of-input None; it must not have come yet."
+    while get() is not None:
+        pass
+
+class _Threaded(object):
+    def __init__(self, name, consumer, queue_size):
+        self.name = name
+        self.consumer = consumer
+        self.queue = Queue.Queue(queue_size)
+        self._result = None
+        self.thread = threading.Thread(target=self._run,
+                                       name='consumer-%s' % name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        get = self.queue.get
+        ended = False
+        try:
+            consume = self.consumer.consume
+            while 1:
+                batch = get()
+                if batch is None:
+                    ended = True
+                    break
+                for record in batch:
+                    consume(record)
+            self._result = (True, self.consumer.finish())
+        except:
+            self._result = (False, sys.exc_info())
+            if not ended:
+                _drain(get)
+
+    def put(self, batch):
+        self.queue.put(batch)
+
+    def result(self):
+        self.queue.put(None)
+        self.thread.join()
+        ok, value = self._result
+        if not ok:
+            raise value[0], value[1], value[2]
+        return value
+
+def _process_main(consumer, queue, results):
+    ended = False
+    try:
+        consume = consumer.consume
+        while 1:
+            batch = queue.get()
+            if batch is None:
+                ended = True
+                break
+            for record in batch:
+                consume(record)
+        results.put((True, consumer.finish()))
+    except:
+        results.put((False, traceback.format_exc()))
+        if not ended:
+            _drain(queue.get)
+
+class _InProcess(object):
+    def __init__(self, name, consumer, queue_size):
+        import multiprocessing
+        self.name = name
+        self.queue = multiprocessing.Queue(queue_size)
+        self.results = multiprocessing.Queue(1)
+        self.process = multiprocessing.Process(
+            target=_process_main, args=(consumer, self.queue, self.results),
+            name='consumer-%s' % name)
+        self.process.daemon = True
+        self.process.start()
+
+    def put(self, batch):
+        self.queue.put(batch)
+
+    def result(self):
+        self.queue.put(None)
+        ok, value = self.results.get()
+        self.process.join()
+        if not ok:
+            raise RuntimeError("consumer %r failed:\n%s" % (self.name, value))
+        return value
+
+class Pipeline(object):
+    """
+    A set of named consumers, fed from one pass over a report.
+
+      * p.add(name, consumer, mode='inline') -- register a consumer.
+      * p.fields() -- the HSP fields the consumers need.
+      * p.run(records, metrics=None) -- feed 'records' to every consumer;
+        return a dict of name -> result.
+      * p.run_file(filename, ...) -- parse 'filename' and run; arguments
+        are as for blastparser.parse_file.
+    """
+    def __init__(self, batch_size=BATCH_RECORDS, queue_size=QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.consumers = []
+
+    def add(self, name, consumer, mode='inline'):
+        if mode not in MODES:
+            raise ValueError("unknown consumer mode %r" % (mode,))
+        if name in [ n for n, _, _ in self.consumers ]:
+            raise ValueError("there is already a consumer named %r" % (name,))
+        self.consumers.append((name, consumer, mode))
+
+    def fields(self):
+        fields = []
+        for _, consumer, _ in self.consumers:
+            for field in consumer.fields:
+                if field not in fields:
+                    fields.append(field)
+        return tuple(fields)
+
+    def _start(self, metrics):
+        runners = []
+        for name, consumer, mode in self.consumers:
+            if mode == 'thread':
+                runners.append(_Threaded(name, consumer, self.queue_size))
+            elif mode == 'process':
+                runners.append(_InProcess(name, consumer, self.queue_size))
+            else:
+                runners.append(_Inline(name, consumer, metrics))
+        return runners
+
+    def run(self, records, metrics=None):
+        runners = self._start(metrics)
+        failed = {}
+
+        def put(batch):
+            for runner in runners:
+                if runner.name not in failed:
+                    try:
+                        runner.put(batch)
+                    except Exception:
+                        failed[runner.name] = sys.exc_info()
+
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                put(batch)
+                batch = []
+        if batch:
+            put(batch)
+
+        results = {}
+        for runner in runners:
+            if runner.name in failed:
+                continue
+            try:
+                results[runner.name] = runner.result()
+            except Exception:
+                failed[runner.name] = sys.exc_info()
+
+        for name, _, _ in self.consumers:
+            if name in failed:
+                exc = failed[name]
+                raise exc[0], exc[1], exc[2]
+        return results
+
+    def run_file(self, filename, jobs=1, engine='lines', cache=False,
+                 metrics=None, **kw):
+        records = blastparser.parse_file(filename, jobs=jobs, engine=engine,
+                                         cache=cache, metrics=metrics,
+                                         compact=True, fields=self.fields(),
+                                         **kw)
+        return self.run(records, metrics)
+
+### consumers
+
+class CSVConsumer(Consumer):
+    """
+    Writes (query, subject, score, expect) rows to 'filename' ('-' for
+    stdout) in one of the writers.FORMATS, as blast-to-csv.py does.
+    Returns the number of rows.
+    """
+    fields = ('score', 'expect')
+
+    def __init__(self, filename, format='csv'):
+        self.filename = filename
+        self.format = format
+        self.output = None
+
+    def _open(self):
+        if self.filename == '-':
+            self.fp = sys.stdout
+        else:
+            self.fp = open(self.filename, 'wb')
+        self.output = writers.open_writer(
+            self.format, self.fp,
+            [('query', 'str'), ('subject', 'str'), ('score', 'float'),
+             ('expect', 'float')])
+
+    def consume(self, record):
+        if self.output is None:         # in the process that writes
+            self._open()
+        self.output.write_rows(writers.hsp_rows(record, 'score', 'expect'))
+
+    def finish(self):
+        if self.output is None:
+            self._open()
+        self.output.close()
+        if self.fp is not sys.stdout:
+            self.fp.close()
+        return self.output.n_rows
+
+class SummaryConsumer(Consumer):
+    """
+    Counts queries, queries with hits, hits and HSPs, and finds the range
+    and mean of the scores and the lowest expect.  Returns a dict.
+    """
+    fields = ('score', 'expect')
+
+    def __init__(self):
+        self.queries = self.queries_with_hits = self.hits = self.hsps = 0
+        self.score_sum = 0.0
+        self.min_score = self.max_score = self.min_expect = None
+
+    def consume(self, record):
+        self.queries += 1
+        if not len(record):
+            return
+        self.queries_with_hits += 1
+        self.hits += len(record)
+
+        scores, expects = record.scores, record.expects
+        self.hsps += len(scores)
+        self.score_sum += sum(scores)
+        lo, hi, expect = min(scores), max(scores), min(expects)
+        if self.min_score is None or lo < self.min_score:
+            self.min_score = lo
+        if self.max_score is None or hi > self.max_score:
+            self.max_score = hi
+        if self.min_expect is None or expect < self.min_expect:
+            self.min_expect = expect
+
+    def finish(self):
+        mean = None
+        if self.hsps:
+            mean = self.score_sum / self.hsps
+        return dict(queries=self.queries,
+                    queries_with_hits=self.queries_with_hits,
+                    hits=self.hits, hsps=self.hsps, min_score=self.min_score,
+                    max_score=self.max_score, mean_score=mean,
+                    min_expect=self.min_expect)
+
+class CoverageConsumer(Consumer):
+    """
+    The bases of 'reference' (a FASTA file) covered by HSPs scoring at
+    least 'min_score', as calc-blast-cover.py finds them; if 'queries' is
+    given, only the HSPs of those query names count.  Returns a dict of
+    'covered' and 'total' bases.
+    """
+    fields = ('score', 'subject_start', 'subject_end')
+
+    def __init__(self, reference, queries=None, min_score=None):
+        self.reference = reference
+        self.queries = queries
+        self.min_score = min_score
+        self.cover = coverage.Coverage()
+
+    def consume(self, record):
+        if self.queries is not None and record.query_name not in self.queries:
+            return
+        min_score = self.min_score
+        add = self.cover.add
+        scores = record.scores
+        starts, ends = record.subject_starts, record.subject_ends
+        offsets = record.hit_offsets
+        for k, name in enumerate(record.subject_names):
+            for i in xrange(offsets[k], offsets[k + 1]):
+                if min_score is not None and scores[i] < min_score:
+                    continue
+                start, end = starts[i], ends[i]
+                if start > end:
+                    start, end = end, start
+                add(name, start - 1, end)
+
+    def finish(self):
+        covered = total = 0
+        idx = fastaindex.open_index(self.reference)
+        try:
+            for entry in idx:
+                if entry.length:
+                    covered += self.cover.covered(entry.name, entry.length)
+                    total += entry.length
+                self.cover.discard(entry.name)
+        finally:
+            idx.close()
+        return dict(covered=covered, total=total)
+
+class BestHitsConsumer(Consumer):
+    """
+    The best-scoring hits of each query, as rbh.collect_best_hits collects
+    them.  Returns an rbh.BestHits, whose pair file is in 'tmpdir' and is
+    the caller's to remove.
+    """
+    fields = ('score',)
+
+    def __init__(self, tmpdir=None, blast_filename=None):
+        self.tmpdir = tmpdir
+        self.blast_filename = blast_filename
+        self.collector = None
+
+    def consume(self, record):
+        if self.collector is None:
+            self.collector = rbh.BestHitCollector(self.blast_filename,
+                                                  self.tmpdir)
+        self.collector.add(record)
+
+    def finish(self):
+        if self.collector is None:
+            self.collector = rbh.BestHitCollector(self.blast_filename,
+                                                  self.tmpdir)
+        return self.collector.finish()
@@ -0,0 +1,472 @@
+"""
+Reciprocal best hits (RBH) between two BLAST reports, A against B and B
+against A.  Sample usage: ::
+
+   for a_name, b_name in reciprocal_best_hits('a.x.b', 'b.x.a'):
+      print a_name, b_name
+
+A pair (a, b) is reciprocal if b is among the best-scoring hits of query a
+in the A->B report, and a among those of query b in the B->A report; each
+query of A is paired with the last such b in report order.  Query names
+starting with 'gi' lose their 'gi|NNN|' prefix; subject names are used as
+they are.
+
+The work is done in three steps, which are also available separately:
+
+ - collect_best_hits() parses one report with best_hits_only, interning
+   its names into a table of its own and writing (query, subject) ID
+   pairs to a file.  The two reports are collected concurrently, by two
+   worker processes.
+ - the names of both are interned into one shared NameTable, which maps
+   each worker's IDs to global ones;
+ - join_best_hits() joins the two sets of pairs on their A-side ID with a
+   hash join.  If the B->A pairs will not fit in 'memory' bytes, both
+   sides are first split by ranges of A IDs into partition files, which
+   are joined one at a time.
+
+So memory use is bounded by the name table and 'memory', however many
+HSPs the reports hold.  Pairs are produced in order of A ID, i.e. in the
+order the A names were first interned.
+
+all_reciprocal_best_hits() does the same for every pair of a set of
+genomes, parsing all the reports with one pool of worker processes and
+interning all names into one table; OrthologGroups merges the pairs into
+groups of orthologs.
+"""
+
+import os
+import shutil
+import tempfile
+from array import array
+
+import blastparser
+
+__all__ = ['NameTable', 'BestHits', 'BestHitCollector', 'OrthologGroups',
+           'normalize_query_name', 'collect_best_hits', 'join_best_hits',
+           'reciprocal_best_hits', 'all_reciprocal_best_hits']
+
+DEFAULT_MEMORY = 256 * 1024 * 1024
+
+# roughly what one pair costs in the in-memory hash join.
+BYTES_PER_PAIR = 100
+
+# pairs read or written at a time.
+CHUNK_PAIRS = 1 << 16
+
+# partition files open at once, well below the usual descriptor limit.
+MAX_PARTITIONS = 256
+
+class NameTable(object):
+    """
+    Interns sequence names as consecutive integer IDs.
+
+      * table.intern(name) -- the ID of 'name', assigning one if need be.
+      * table[name] -- the ID of 'name'; KeyError if it has none.
+      * table.name(i) -- the name with ID 'i'.
+      * len(table), name in table
+    """
+    def __init__(self, names=()):
+        self.ids = {}
+        self.names = []
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def name(self, i):
+        return self.names[i]
+
+class BestHits(object):
+    """
+    The best hits of one report: 'names', the names the IDs in the pair
+    file refer to; 'filename', a file of n_pairs (query ID, subject ID)
+    pairs as native longs; and 'counters', from the metrics of the parse.
+    """
+    def __init__(self, blast_filename, names, filename, n_pairs, counters):
+        self.blast_filename = blast_filename
+        self.names = names
+        self.filename = filename
+        self.n_pairs = n_pairs
+        self.counters = counters
+
+    def translation(self, table):
+        "intern self.names into 'table'; return the map of IDs to its IDs."
+        return array('l', [ table.intern(name) for name in self.names ])
+
+    def pairs(self, translation=None):
+        "yield the (query ID, subject ID) pairs, optionally translated."
+        fp = open(self.filename, 'rb')
+        try:
+            while 1:
+                chunk = _read_chunk(fp)
+                if not chunk:
+                    break
+                if translation is not None:
+                    chunk = [ translation[i] for i in chunk ]
+                for i in xrange(0, len(chunk), 2):
+                    yield chunk[i], chunk[i + 1]
+        finally:
+            fp.close()
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+def _read_chunk(fp):
+    chunk = array('l')
+    try:
+        chunk.fromfile(fp, CHUNK_PAIRS * 2)
+    except EOFError:                    # a short read keeps what it got
+        pass
+    return chunk
+
+def normalize_query_name(name):
+    "drop the 'gi|NNN|' prefix from an NCBI query name."
+    if name.startswith('gi'):
+        return name.split('|', 2)[2]
+    return name
+
+class BestHitCollector(object):
+    """
+    Collects the best-scoring hits of a stream of records into a BestHits,
+    whose pair file is written in 'tmpdir'.  Records need not have been
+    parsed with best_hits_only, but need their scores.
+
+      * collector.add(record) -- add the best hits of one record.
+      * collector.finish(counters={}) -- close the pair file and return the
+        BestHits.
+    """
+    def __init__(self, blast_filename=None, tmpdir=None):
+        self.blast_filename = blast_filename
+        self.names = NameTable()
+        fd, self.filename = tempfile.mkstemp(suffix='.pairs', dir=tmpdir)
+        self.out = os.fdopen(fd, 'wb')
+        self.n_pairs = 0
+        self.buf = array('l')
+
+    def _best_subjects(self, record):
+        if hasattr(record, 'hit_offsets'):
+            scores = record.scores
+            if not scores:
+                return []
+            best = max(scores)
+            offsets = record.hit_offsets
+            return [ name for k, name in enumerate(record.subject_names)
+                     if best in scores[offsets[k]:offsets[k + 1]] ]
+
+        best, subjects = None, []
+        for hit in record.hits:
+            for match in hit.matches:
+                if best is None or match.score > best:
+                    best, subjects = match.score, [hit.subject_name]
+                elif match.score == best:
+                    subjects.append(hit.subject_name)
+        return subjects
+
+    def add(self, record):
+        names, buf = self.names, self.buf
+        query = names.intern(normalize_query_name(record.query_name))
+        seen = set()
+        for subject_name in self._best_subjects(record):
+            subject = names.intern(subject_name)
+            if subject not in seen:
+                seen.add(subject)
+                buf.append(query)
+                buf.append(subject)
+        if len(buf) >= CHUNK_PAIRS * 2:
+            self._flush()
+
+    def _flush(self):
+        self.buf.tofile(self.out)
+        self.n_pairs += len(self.buf) // 2
+        self.buf = array('l')
+
+    def finish(self, counters={}):
+        self._flush()
+        self.out.close()
+        return BestHits(self.blast_filename, self.names.names, self.filename,
+                        self.n_pairs, dict(counters))
+
+def collect_best_hits(blast_filename, tmpdir=None, cache=False, metrics=None):
+    """
+    Parse 'blast_filename', keeping the best-scoring hits of each query, and
+    return them as a BestHits whose pair file is written in 'tmpdir'.
+    """
+    collector = BestHitCollector(blast_filename, tmpdir)
+    try:
+        for record in blastparser.parse_file(blast_filename, cache=cache,
+                                             metrics=metrics,
+                                             fields=('score',), compact=True,
+                                             best_hits_only=True):
+            collector.add(record)
+    except:
+        collector.out.close()
+        os.unlink(collector.filename)
+        raise
+
+    counters = {}
+    if metrics is not None:
+        counters = metrics.counters
+    return collector.finish(counters)
+
+def _collect_worker(args):
+    "collect_best_hits in a worker process, with metrics of its own."
+    import metrics
+    key, blast_filename, tmpdir, cache = args
+    return key, collect_best_hits(blast_filename, tmpdir, cache,
+                                  metrics.Metrics())
+
+def _collect_all(reports, jobs, tmpdir, cache, metrics):
+    """
+    Collect the best hits of each report in 'reports', a dict of key ->
+    filename, with a pool of 'jobs' worker processes (None for one per
+    CPU); yield (key, BestHits) as each is done.  With jobs=1 the reports
+    are parsed in this process, in turn.
+    """
+    items = sorted(reports.items())
+    if jobs == 1 or len(items) < 2:
+        for key, filename in items:
+            yield key, collect_best_hits(filename, tmpdir, cache, metrics)
+        return
+
+    import multiprocessing
+    jobs = min(jobs or multiprocessing.cpu_count(), len(items))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.imap_unordered(_collect_worker,
+                                      [ (key, filename, tmpdir, cache)
+                                        for key, filename in items ])
+        if metrics is not None:
+            results = metrics.iterate(results, 'parse')
+        for key, best in results:
+            if metrics is not None:
+                for name, n in best.counters.items():
+                    metrics.count(name, n)
+            yield key, best
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class _Partitions(object):
+    "(a, b) pairs split into 'n' files by ranges of 'a' up to 'n_ids'."
+    def __init__(self, n, n_ids, tmpdir):
+        self.n = n
+        self.n_ids = n_ids
+        self.filenames = []
+        self.files = []
+        for i in range(n):
+            fd, filename = tempfile.mkstemp(suffix='.part', dir=tmpdir)
+            self.filenames.append(filename)
+            self.files.append(os.fdopen(fd, 'wb'))
+        self.bufs = [ array('l') for i in range(n) ]
+
+    def add(self, a, b):
+        i = a * self.n // self.n_ids
+        buf = self.bufs[i]
+        buf.append(a)
+        buf.append(b)
+        if len(buf) >= CHUNK_PAIRS * 2:
+            buf.tofile(self.files[i])
+            self.bufs[i] = array('l')
+
+    def close(self):
+        for buf, fp in zip(self.bufs, self.files):
+            buf.tofile(fp)
+            fp.close()
+        self.bufs = []
+
+    def pairs(self, i):
+        fp = open(self.filenames[i], 'rb')
+        try:
+            while 1:
+                chunk = _read_chunk(fp)
+                if not chunk:
+                    break
+                for j in xrange(0, len(chunk), 2):
+                    yield chunk[j], chunk[j + 1]
+        finally:
+            fp.close()
+
+    def remove(self):
+        for filename in self.filenames:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+def _join(ab_pairs, ba_pairs):
+    "hash join: yield (a, b) for each reciprocal pair, in order of a."
+    reverse = set([ (a << 32) | b for a, b in ba_pairs ])
+    best = {}
+    for a, b in ab_pairs:
+        if (a << 32) | b in reverse:
+            best[a] = b
+    for a in sorted(best):
+        yield a, best[a]
+
+def join_best_hits(ab, ba, names, memory=DEFAULT_MEMORY, tmpdir=None):
+    """
+    Join the BestHits 'ab' (A->B) and 'ba' (B->A), interning their names
+    into the NameTable 'names'; yield (a ID, b ID) reciprocal pairs.  At
+    most about 'memory' bytes of pairs are held at once.
+    """
+    ab_ids = ab.translation(names)
+    ba_ids = ba.translation(names)
+    ab_pairs = lambda: ab.pairs(ab_ids)
+    ba_pairs = lambda: ( (a, b) for b, a in ba.pairs(ba_ids) )
+
+    n_parts = ba.n_pairs * BYTES_PER_PAIR // max(memory, 1) + 1
+    n_parts = min(n_parts, MAX_PARTITIONS)
+    if n_parts == 1 or not len(names):
+        for pair in _join(ab_pairs(), ba_pairs()):
+            yield pair
+        return
+
+    ab_parts = _Partitions(n_parts, len(names), tmpdir)
+    ba_parts = _Partitions(n_parts, len(names), tmpdir)
+    try:
+        for a, b in ab_pairs():
+            ab_parts.add(a, b)
+        ab_parts.close()
+        for a, b in ba_pairs():
+            ba_parts.add(a, b)
+        ba_parts.close()
+
+        for i in range(n_parts):
+            for pair in _join(ab_parts.pairs(i), ba_parts.pairs(i)):
+                yield pair
+    finally:
+        ab_parts.remove()
+        ba_parts.remove()
+
+def reciprocal_best_hits(ab_filename, ba_filename, names=None, cache=False,
+                         concurrent=True, memory=DEFAULT_MEMORY, tmpdir=None,
+                         metrics=None):
+    """
+    Yield (a name, b name) for the reciprocal best hits between the reports
+    'ab_filename' (A against B) and 'ba_filename' (B against A).
+
+    Names are interned into the NameTable 'names', if given.  With
+    'concurrent', the two reports are parsed at the same time by two
+    worker processes; 'cache' is as for blastparser.parse_file.  Pair
+    files are kept in a temporary directory under 'tmpdir'.
+    """
+    if names is None:
+        names = NameTable()
+    workdir = tempfile.mkdtemp(prefix='rbh-', dir=tmpdir)
+    try:
+        reports = dict(ab=ab_filename, ba=ba_filename)
+        best = dict(_collect_all(reports, concurrent and 2 or 1, workdir,
+                                 cache, metrics))
+
+        pairs = join_best_hits(best['ab'], best['ba'], names, memory, workdir)
+        if metrics is not None:
+            pairs = metrics.iterate(pairs, 'join', 'pairs')
+        for a, b in pairs:
+            yield names.name(a), names.name(b)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def all_reciprocal_best_hits(reports, names=None, jobs=None, cache=False,
+                             memory=DEFAULT_MEMORY, tmpdir=None, metrics=None):
+    """
+    The reciprocal best hits between many genomes.  'reports' maps (A, B)
+    genome pairs to the report of A against B; for each pair of genomes
+    with reports both ways, yield (A, B, a name, b name), A < B, with the
+    rows of one pair together.
+
+    Each report is parsed once, by a pool of 'jobs' worker processes, and
+    each pair is joined as soon as both of its reports are in, while the
+    rest are still being parsed.  All names are interned into the one
+    NameTable 'names'.  Other arguments are as for reciprocal_best_hits.
+    """
+    if names is None:
+        names = NameTable()
+    wanted = {}
+    for a, b in reports:
+        if a != b and (b, a) in reports:
+            wanted[(a, b)] = reports[(a, b)]
+
+    workdir = tempfile.mkdtemp(prefix='rbh-', dir=tmpdir)
+    try:
+        waiting = {}
+        for (a, b), best in _collect_all(wanted, jobs, workdir, cache,
+                                         metrics):
+            other = waiting.pop((b, a), None)
+            if other is None:
+                waiting[(a, b)] = best
+                continue
+            if a > b:
+                a, b, best, other = b, a, other, best
+
+            pairs = join_best_hits(best, other, names, memory, workdir)
+            if metrics is not None:
+                pairs = metrics.iterate(pairs, 'join', 'pairs')
+            for x, y in pairs:
+                yield a, b, names.name(x), names.name(y)
+            best.remove()
+            other.remove()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+class OrthologGroups(object):
+    """
+    Merges pairwise reciprocal best hits into groups of orthologs, the
+    connected components of the RBH graph.
+
+      * groups.add(a_genome, a_name, b_genome, b_name) -- add one RBH pair.
+      * groups.groups() -- the groups, each a dict of genome -> list of
+        names; groups and names are in the order they were first added.
+    """
+    def __init__(self):
+        self.parent = {}
+        self.order = {}
+
+    def _find(self, node):
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:     # path compression
+            parent[node], node = root, parent[node]
+        return root
+
+    def _node(self, node):
+        if node not in self.parent:
+            self.parent[node] = node
+            self.order[node] = len(self.order)
+        return self._find(node)
+
+    def add(self, a_genome, a_name, b_genome, b_name):
+        a = self._node((a_genome, a_name))
+        b = self._node((b_genome, b_name))
+        if a != b:
+            if self.order[b] < self.order[a]:
+                a, b = b, a
+            self.parent[b] = a          # the root is the first node added
+
+    def groups(self):
+        members = {}
+        for node in self.parent:
+            members.setdefault(self._find(node), []).append(node)
+
+        groups = []
+        for root in sorted(members, key=self.order.get):
+            group = {}
+            for genome, name in sorted(members[root], key=self.order.get):
+                group.setdefault(genome, []).append(name)
+            groups.append(group)
+        return groups
@@ -0,0 +1,308 @@
+"""
+Parse a BLAST search that was split into many report shards (one per
+chunk of the query FASTA file) with a pool of worker processes, as one
+stream of records.  Sample usage: ::
+
+   problems = []
+   for record in parse_shards(['out/chunk*.blast'], jobs=8,
+                              problems=problems, compact=True):
+      ...
+   for problem in problems:
+      print >>sys.stderr, problem
+
+Shards are given as file names or glob patterns; the matches of each
+pattern are taken in natural order ('chunk2' before 'chunk10').  Records
+come out in shard order, and in file order within each shard ('shard'),
+or merged into query name order ('query').  In shard order, a bounded
+number of shards are parsed ahead, so memory grows with the size of a
+shard, not of the search.  In query order, each worker sorts its shard
+and spills it to a temporary file, and the spilled shards are merged
+k ways as they are read back.
+
+A shard whose report is cut short -- BLAST was killed, or the disk
+filled up -- or that the parser cannot read is a ShardProblem.  It does
+not stop the run: the records of its complete queries are kept (the last
+query of a truncated shard is dropped, as it may be missing HSPs), and
+the problem is reported as soon as the shard has been parsed; in query
+order, that is the order the workers finish the shards in.  check_shard()
+looks for the end of the report that each format has: the statistics
+after the last alignment of a text report, the closing tag of XML, and
+a complete last line (and, with comments, the '# BLAST processed' line)
+of tabular output.
+"""
+
+import os
+import re
+import sys
+import glob
+import heapq
+import shutil
+import tempfile
+import itertools
+import cPickle
+from collections import deque
+
+import blastparser
+import inputs
+
+__all__ = ['parse_shards', 'expand_shards', 'check_shard', 'ShardProblem',
+           'ORDERS']
+
+ORDERS = ('shard', 'query')
+
+# how much of the end of a report check_shard() looks at.
+TAIL_BYTES = 64 * 1024
+
+def _natural_key(s):
+    key = []
+    for part in re.split(r'(\d+)', s):
+        if part.isdigit():
+            part = int(part)
+        key.append(part)
+    return key
+
+def expand_shards(patterns):
+    """
+    The shard file names in 'patterns', a list of file names and glob
+    patterns, in order and without repeats.  Raise ValueError if a
+    pattern matches nothing.
+    """
+    filenames = []
+    seen = set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern), key=_natural_key)
+        else:
+            matches = [pattern]
+        if not matches:
+            raise ValueError("no BLAST shards match %r" % (pattern,))
+        for filename in matches:
+            if filename not in seen:
+                seen.add(filename)
+                filenames.append(filename)
+    return filenames
+
+class ShardProblem(object):
+    """
+    A shard that is truncated or could not be parsed: 'filename', 'index'
+    (its place in the list of shards), 'reason' and 'records', the number
+    of its records that were kept.
+    """
+    __slots__ = ['filename', 'index', 'reason', 'records']
+
+    def __init__(self, filename, index, reason, records):
+        self.filename = filename
+        self.index = index
+        self.reason = reason
+        self.records = records
+
+    def __str__(self):
+        return '%s: %s (%d records kept)' % (self.filename, self.reason,
+                                             self.records)
+
+    def __repr__(self):
+        return '<ShardProblem(%r, %r)>' % (self.filename, self.reason)
+
+def _head_and_tail(filename):
+    "the first line of (decompressed) 'filename', and its last TAIL_BYTES."
+    if not inputs.detect_compression(filename):
+        fp = open(filename, 'rb')
+        try:
+            head = fp.readline()
+            fp.seek(max(os.path.getsize(filename) - TAIL_BYTES, 0))
+            return head, fp.read()
+        finally:
+            fp.close()
+
+    # compressed data can only be read from the start
+    fp = inputs.open_input(filename, threads=1)
+    try:
+        head = fp.readline()
+        tail = head
+        while 1:
+            data = fp.read(TAIL_BYTES)
+            if not data:
+                break
+            tail = (tail + data)[-TAIL_BYTES:]
+        return head, tail
+    finally:
+        fp.close()
+
+def check_shard(filename, format=None):
+    """
+    Return None if the BLAST report in 'filename' ends the way a complete
+    report in 'format' (one of blastparser.FORMATS, or None to detect it)
+    does, or else the reason it looks truncated.
+    """
+    head, tail = _head_and_tail(filename)
+    if not tail.strip():
+        return 'empty report'
+    if format is None:
+        format = blastparser.detect_file_format(filename)
+
+    if format == 'xml':
+        if not tail.rstrip().endswith('</BlastOutput>'):
+            return 'truncated: no closing </BlastOutput>'
+    elif format == 'tabular':
+        if not tail.endswith('\n'):
+            return 'truncated: last line is incomplete'
+        last = tail.rstrip('\n').rsplit('\n', 1)[-1]
+        if head.startswith('#'):
+            if not last.startswith('# BLAST processed'):
+                return "truncated: no '# BLAST processed' line"
+        elif len(last.split('\t')) < 12:
+            return 'truncated: last line is incomplete'
+    else:
+        words = head.split(None, 1)
+        if not words or not (words[0] == 'Query=' or
+                             'BLAST' in words[0].upper()):
+            return 'not a BLAST report'
+        tail = '\n' + tail
+        if tail.rfind('\nLambda') < tail.rfind('\nSbjct'):
+            return 'truncated: no statistics after the last alignment'
+    return None
+
+def _parse_shard(args):
+    """
+    worker for parse_shards: parse one shard, returning (index, records or
+    spill file, record count, HSP count, problem reason or None).
+    """
+    index, filename, options, cache, spill_dir = args
+    records = []
+    reason = None
+    try:
+        reason = check_shard(filename, options.get('format'))
+        b = blastparser.BlastParser(**options)
+        for record in b.parse_file(filename, cache=cache):
+            records.append(record)
+        if reason is not None and records:
+            records.pop()
+    except Exception, e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+        if reason is None:
+            reason = error
+        else:
+            reason = '%s (%s)' % (reason, error)
+
+    n_hsps = 0
+    for record in records:
+        for hit in record.hits:
+            n_hsps += len(hit)
+
+    if spill_dir is None:
+        return index, records, len(records), n_hsps, reason
+
+    # sort() is stable, so queries with the same name keep their order
+    records.sort(key=lambda record: record.query_name)
+    fd, spill = tempfile.mkstemp(suffix='.shard', dir=spill_dir)
+    fp = os.fdopen(fd, 'wb')
+    try:
+        for record in records:
+            cPickle.dump(record, fp, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fp.close()
+    return index, spill, len(records), n_hsps, reason
+
+def _read_spill(filename, index):
+    "yield (query name, shard index, n, record) for each spilled record."
+    fp = open(filename, 'rb')
+    try:
+        for n in itertools.count():
+            try:
+                record = cPickle.load(fp)
+            except EOFError:
+                break
+            yield record.query_name, index, n, record
+    finally:
+        fp.close()
+        os.unlink(filename)
+
+def parse_shards(shards, jobs=None, order='shard', cache=False, tmpdir=None,
+                 problems=None, metrics=None, **kw):
+    """
+    Parse the BLAST reports 'shards' (a list of file names and glob
+    patterns; see expand_shards) with 'jobs' worker processes (by default,
+    one per CPU), yielding their records as one stream in 'order' (one of
+    ORDERS).  'cache' is as for BlastParser.parse_file; spilled shards
+    are kept in 'tmpdir'.
+
+    Each ShardProblem is appended to the list 'problems', or written to
+    stderr if it is None.  If 'metrics' is given, shards, bad shards,
+    records and HSPs are counted there, and time spent waiting for the
+    workers is charged to 'parse'.  Other keyword arguments are
+    BlastParser options.
+    """
+    import multiprocessing
+
+    if order not in ORDERS:
+        raise ValueError("unknown shard order %r" % (order,))
+    if isinstance(shards, basestring):
+        shards = [shards]
+    filenames = expand_shards(shards)
+    blastparser.BlastParser(**kw)       # check the options here, not later
+
+    spill_dir = None
+    if order == 'query':
+        spill_dir = tempfile.mkdtemp(prefix='blast-shards-', dir=tmpdir)
+    tasks = iter([ (index, filename, kw, cache, spill_dir)
+                   for index, filename in enumerate(filenames) ])
+
+    def finished(result):
+        index, records, n_records, n_hsps, reason = result
+        if metrics is not None:
+            metrics.count('shards')
+            metrics.count('records', n_records)
+            metrics.count('hsps', n_hsps)
+        if reason is not None:
+            problem = ShardProblem(filenames[index], index, reason,
+                                   n_records)
+            if metrics is not None:
+                metrics.count('bad_shards')
+            if problems is None:
+                print >>sys.stderr, 'BLAST shard problem:', problem
+            else:
+                problems.append(problem)
+        return records
+
+    def wait(get):
+        if metrics is None:
+            return get()
+        with metrics.stage('parse'):
+            return get()
+
+    streams = []
+    pool = multiprocessing.Pool(jobs)
+    try:
+        if order == 'shard':
+            window = (jobs or multiprocessing.cpu_count()) * 2
+            pending = deque()
+            for task in itertools.islice(tasks, window):
+                pending.append(pool.apply_async(_parse_shard, (task,)))
+
+            while pending:
+                records = finished(wait(pending.popleft().get))
+                for task in itertools.islice(tasks, 1):
+                    pending.append(pool.apply_async(_parse_shard, (task,)))
+                for record in records:
+                    yield record
+        else:
+            results = pool.imap_unordered(_parse_shard, tasks)
+            spills = []
+            while 1:
+                result = wait(lambda: next(results, None))
+                if result is None:
+                    break
+                spills.append((result[0], finished(result)))
+            spills.sort()
+            streams.extend([ _read_spill(spill, index)
+                             for index, spill in spills ])
+            for _, _, _, record in heapq.merge(*streams):
+                yield record
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        for stream in streams:
+            stream.close()
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
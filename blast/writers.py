@@ -0,0 +1,252 @@
+"""
+Batched writers for tables of BLAST hits, as CSV, TSV or a compact binary
+columnar format.  Sample usage: ::
+
+   columns = [('query', 'str'), ('subject', 'str'), ('score', 'float'),
+              ('expect', 'float')]
+   w = open_writer('csv', sys.stdout, columns)
+   for record in blastparser.parse_file(filename, compact=True):
+      w.write_rows(hsp_rows(record, 'score', 'expect'))
+   w.close()
+
+Rows are tuples of column values.  They are kept until 'batch_size' have
+come in, then formatted together -- one '%' operation per row, with a
+format made once for the columns -- and written in one call.  CSV output
+is what csv.writer writes (floats as repr(), fields quoted only if they
+have to be, '\\r\\n' line ends); TSV output is the same, tab-separated,
+with no quoting, '\\n' line ends, and tabs and newlines in strings turned
+into spaces.
+
+The 'columns' format is for loaders: a header, then one block per batch
+with each column stored whole -- numbers as arrays of doubles or longs,
+strings as an array of lengths and the strings run together.  The size of
+a long depends on the platform, so the header records the item sizes the
+file was written with.  read_columns() reads it back a batch at a time.
+Rows are written in the order they are given, so output made from the
+ordered records of a parallel parse is the same as from a serial one.
+"""
+
+import json
+import struct
+from array import array
+
+import alignstats
+
+__all__ = ['FORMATS', 'open_writer', 'read_columns', 'hsp_rows',
+           'CSVWriter', 'TSVWriter', 'ColumnarWriter']
+
+FORMATS = ('csv', 'tsv', 'columns')
+BATCH_ROWS = 10000
+
+COLUMN_TYPES = ('str', 'int', 'float')
+
+MAGIC = 'BLASTTBL'
+VERSION = 1
+# magic, version, item sizes of 'int' values and of string lengths, and
+# the length of the JSON column list that follows.
+_FILE_HEADER = struct.Struct('<8sIBB2xI')
+_BLOCK_HEADER = struct.Struct('<Q')
+_TYPECODES = dict(str='L', int='l', float='d')
+
+def _read_typecodes(int_size, length_size):
+    "the typecodes that read back columns written with these item sizes."
+    typecodes = dict(float='d')
+    for typ, codes, size in (('int', 'il', int_size),
+                             ('str', 'IL', length_size)):
+        for code in codes:
+            if array(code).itemsize == size:
+                typecodes[typ] = code
+                break
+        else:
+            raise ValueError("BLAST columns file has %d-byte integers,"
+                             " which cannot be read here" % size)
+    return typecodes
+
+class _BatchWriter(object):
+    "rows are kept in 'self.rows' until there are batch_size of them."
+    def __init__(self, fp, columns, batch_size=BATCH_ROWS):
+        for name, typ in columns:
+            if typ not in COLUMN_TYPES:
+                raise ValueError("column %r: unknown type %r" % (name, typ))
+        self.fp = fp
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.rows = []
+        self.n_rows = 0
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            rows, self.rows = self.rows, []
+            self._write_batch(rows)
+            self.n_rows += len(rows)
+        if hasattr(self.fp, 'flush'):
+            self.fp.flush()
+
+    def close(self):
+        "flush what is left; the file itself is the caller's to close."
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _TextWriter(_BatchWriter):
+    delimiter = None
+    terminator = None
+    special = None                      # characters strings must not have
+
+    def __init__(self, fp, columns, batch_size=BATCH_ROWS):
+        _BatchWriter.__init__(self, fp, columns, batch_size)
+        formats = dict(str='%s', int='%d', float='%r')
+        self.format = self.delimiter.join([ formats[typ]
+                                            for _, typ in self.columns ]) \
+                      + self.terminator
+        self.str_columns = [ i for i, (_, typ) in enumerate(self.columns)
+                             if typ == 'str' ]
+
+    def _escape(self, s):
+        raise NotImplementedError
+
+    def _write_batch(self, rows):
+        # check each string column of the batch at once; rows are only
+        # rebuilt in the rare batches that need escaping.
+        special = self.special
+        for i in self.str_columns:
+            text = ''.join([ row[i] or '' for row in rows ])
+            if [ c for c in special if c in text ] or None in \
+               [ row[i] for row in rows ]:
+                escape = self._escape
+                rows = [ row[:i] + (escape(row[i]),) + row[i + 1:]
+                         for row in rows ]
+        fmt = self.format
+        self.fp.write(''.join([ fmt % row for row in rows ]))
+
+class CSVWriter(_TextWriter):
+    delimiter = ','
+    terminator = '\r\n'
+    special = ',"\r\n'
+
+    def _escape(self, s):
+        if s is None:
+            return ''
+        for c in self.special:
+            if c in s:
+                return '"' + s.replace('"', '""') + '"'
+        return s
+
+class TSVWriter(_TextWriter):
+    delimiter = '\t'
+    terminator = '\n'
+    special = '\t\r\n'
+
+    def _escape(self, s):
+        if s is None:
+            return ''
+        return s.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+
+class ColumnarWriter(_BatchWriter):
+    """
+    Writes the 'columns' format: a header of (MAGIC, VERSION, item sizes
+    of ints and of string lengths, length of the JSON that follows) and
+    the JSON list of [name, type] columns; then for each batch, its row
+    count and each column's arrays, in column order.
+    """
+    def __init__(self, fp, columns, batch_size=BATCH_ROWS):
+        _BatchWriter.__init__(self, fp, columns, batch_size)
+        header = json.dumps([ list(c) for c in self.columns ])
+        fp.write(_FILE_HEADER.pack(MAGIC, VERSION,
+                                   array(_TYPECODES['int']).itemsize,
+                                   array(_TYPECODES['str']).itemsize,
+                                   len(header)))
+        fp.write(header)
+
+    def _write_batch(self, rows):
+        fp = self.fp
+        fp.write(_BLOCK_HEADER.pack(len(rows)))
+        for i, (name, typ) in enumerate(self.columns):
+            values = [ row[i] for row in rows ]
+            if typ == 'str':
+                values = [ v or '' for v in values ]
+                array(_TYPECODES['str'], map(len, values)).tofile(fp)
+                fp.write(''.join(values))
+            else:
+                array(_TYPECODES[typ], values).tofile(fp)
+
+def read_columns(fp):
+    """
+    Read a file in the 'columns' format; yield a dict of column name ->
+    values (an array, or a list of strings) for each batch.
+    """
+    magic, version, int_size, length_size, header_len = \
+           _FILE_HEADER.unpack(fp.read(_FILE_HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a BLAST columns file")
+    typecodes = _read_typecodes(int_size, length_size)
+    columns = json.loads(fp.read(header_len))
+
+    while 1:
+        data = fp.read(_BLOCK_HEADER.size)
+        if not data:
+            break
+        n, = _BLOCK_HEADER.unpack(data)
+        batch = {}
+        for name, typ in columns:
+            values = array(typecodes[typ])
+            values.fromfile(fp, n)
+            if typ == 'str':
+                lengths, values, pos = values, [], 0
+                text = fp.read(sum(lengths))
+                for length in lengths:
+                    values.append(text[pos:pos + length])
+                    pos += length
+            batch[str(name)] = values
+        yield batch
+
+# HSP attributes whose CompactBlastQuery column is not the plural
+_COLUMNS = dict(alignstats.STAT_COLUMNS)
+
+_WRITERS = dict(csv=CSVWriter, tsv=TSVWriter, columns=ColumnarWriter)
+
+def open_writer(format, fp, columns, batch_size=BATCH_ROWS):
+    "a writer of 'format' (one of FORMATS) for 'columns' to the file 'fp'."
+    try:
+        cls = _WRITERS[format]
+    except KeyError:
+        raise ValueError("unknown output format %r" % (format,))
+    return cls(fp, columns, batch_size)
+
+def hsp_rows(record, *fields):
+    """
+    A list of (query name, subject name, field, ...) tuples, one per HSP of
+    'record', with the named HSP attributes ('score', 'expect', ...).
+    Compact records are read a column at a time.
+    """
+    query_name = record.query_name
+    if hasattr(record, 'hit_offsets'):
+        offsets = record.hit_offsets
+        subjects = []
+        for k, name in enumerate(record.subject_names):
+            subjects.extend([name] * (offsets[k + 1] - offsets[k]))
+        columns = [ getattr(record, _COLUMNS.get(field, field + 's'))
+                    for field in fields ]
+        return zip([query_name] * len(subjects), subjects, *columns)
+
+    rows = []
+    for hit in record.hits:
+        subject_name = hit.subject_name
+        for match in hit.matches:
+            rows.append((query_name, subject_name) +
+                        tuple([ getattr(match, field) for field in fields ]))
+    return rows
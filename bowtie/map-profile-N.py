@@ -1,25 +1,40 @@
 #! /usr/bin/env python
 import csv
+import os
 import sys
+import argparse
 
-map_file = sys.argv[1]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'blast'))
+from inputs import open_input
+import metrics
+
+parser = argparse.ArgumentParser()
+parser.add_argument('map_file')
+metrics.add_arguments(parser)
+args = parser.parse_args()
+
+meter = metrics.from_args(args, os.path.basename(sys.argv[0]))
 
 mismatch_count = [0] * 200
 
-r = csv.reader(open(map_file), delimiter='\t')
-for n, row in enumerate(r):
-    if n % 100000 == 0:
-        print >>sys.stderr, '...', n
+r = csv.reader(meter.reader(open_input(args.map_file)), delimiter='\t')
+with meter.stage('parse'):
+    for row in r:
+        mismatches = row[7]
+
+        mismatch_list = mismatches.split(',')
+        for mismatch in mismatch_list:
+            if not mismatch.endswith('N'): continue
+            mismatch = mismatch.split(':')
+            mismatch = mismatch[0]
+            mismatch = int(mismatch)
+            mismatch_count[mismatch] += 1
 
-    mismatches = row[7]
+meter.count('records', r.line_num)
 
-    mismatch_list = mismatches.split(',')
-    for mismatch in mismatch_list:
-        if not mismatch.endswith('N'): continue
-        mismatch = mismatch.split(':')
-        mismatch = mismatch[0]
-        mismatch = int(mismatch)
-        mismatch_count[mismatch] += 1
+with meter.stage('output'):
+    for position, count in enumerate(mismatch_count):
+        print position, count
 
-for position, count in enumerate(mismatch_count):
-    print position, count
+metrics.finish(meter, args)
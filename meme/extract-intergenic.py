@@ -1,7 +1,12 @@
 #! /usr/bin/env python
 import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'blast'))
+import fastaindex
 import load_gff
-import screed
 
 def main():
     parser = argparse.ArgumentParser()
@@ -16,21 +21,24 @@ def main():
     chr_operons = load_gff.make_operons(gff_d)
     chr_intergenic = load_gff.make_intergenic(genomefile, chr_operons)
 
-    seqs = {}
-    for record in screed.open(genomefile):
-        name = record.name
-        if name.startswith('gi|'):
-            name = name.split('|')[3]
-        seqs[name] = record.sequence
+    # read only the chromosomes with intergenic regions, via the index
+    # make_intergenic built.
+    idx = fastaindex.open_index(genomefile)
+    try:
+        names = {}
+        for entry in idx:
+            names[load_gff.chr_name(entry.name)] = entry.name
 
-    for chr in chr_intergenic:
-        seq = seqs[chr]
-        intergenic = chr_intergenic[chr]
-        for ig in intergenic:
-            (start, name1, stop, name2) = ig
-            if stop - start < 20:
-                continue
-            print '>ig:%s:%s\n%s' % (name1, name2, seq[start:stop])
+        for chr in chr_intergenic:
+            seq = idx.sequence(names[chr])
+            intergenic = chr_intergenic[chr]
+            for ig in intergenic:
+                (start, name1, stop, name2) = ig
+                if stop - start < 20:
+                    continue
+                print '>ig:%s:%s\n%s' % (name1, name2, seq[start:stop])
+    finally:
+        idx.close()
 
 if __name__ == '__main__':
     main()
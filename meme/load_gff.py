@@ -1,10 +1,15 @@
+import os
 import sys
-import screed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'blast'))
+from inputs import open_input
+import fastaindex
 
 def load(filenames):
     d = {}
     for filename in filenames:
-        for line in open(filename):
+        for line in open_input(filename):
             if line.startswith('#'):
                 continue
 
@@ -95,13 +100,18 @@ def get_operon_start(operon):
 def get_operon_stop(operon):
     return operon[-1][1]
 
+def chr_name(name):
+    "the chromosome name in a GFF file for the FASTA sequence 'name'."
+    if name.startswith('gi|'):
+        name = name.split('|')[3]
+    return name
+
 def make_intergenic(dbfile, chr_operons):
     seqs = {}
-    for record in screed.open(dbfile):
-        name = record.name
-        if name.startswith('gi|'):
-            name = name.split('|')[3]
-        seqs[name] = len(record.sequence)
+    idx = fastaindex.open_index(dbfile)
+    for entry in idx:
+        seqs[chr_name(entry.name)] = entry.length
+    idx.close()
 
     chr_intergenic = {}
     for chr in chr_operons:
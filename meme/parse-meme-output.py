@@ -1,5 +1,11 @@
 #! /usr/bin/env python
 import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'blast'))
+from inputs import open_input
 
 def main():
     parser = argparse.ArgumentParser()
@@ -7,7 +13,7 @@ def main():
 
     args = parser.parse_args()
     
-    data = open(args.memefile).read()
+    data = open_input(args.memefile).read()
     
     n = 0
     loc = data.find('\nMOTIF ')
@@ -0,0 +1,29 @@
+"""
+Shared fixtures: the blast/ modules and the synthetic reports of
+benchmarks/blast_report.py, written into a per-test directory.
+"""
+
+import os
+import sys
+
+import pytest
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOPDIR, 'blast'))
+sys.path.insert(0, os.path.join(TOPDIR, 'benchmarks'))
+
+import blast_report
+
+def write_report(filename, **kw):
+    fp = open(filename, 'w')
+    try:
+        blast_report.write_report(fp, **kw)
+    finally:
+        fp.close()
+    return filename
+
+@pytest.fixture
+def report(tmpdir):
+    "a small text BLAST report, with gapped alignments."
+    return write_report(str(tmpdir.join('report.blast')), queries=40,
+                        hits=4, hsps=3, length=90, seed=7)
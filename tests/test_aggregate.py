@@ -0,0 +1,132 @@
+"""
+Aggregator against a plain group-by over every HSP.
+"""
+
+import pytest
+
+import aggregate
+import blastparser
+
+from conftest import write_report
+
+FIELDS = ('score', 'expect', 'query_start', 'subject_end')
+
+@pytest.fixture(scope='module')
+def report(tmpdir_factory):
+    filename = str(tmpdir_factory.mktemp('aggregate').join('report.blast'))
+    # few subjects, so that they are shared between queries
+    return write_report(filename, queries=30, hits=4, hsps=3, length=90,
+                        seed=9, subjects=12)
+
+def hsps(filename):
+    "(query, subject, {field: value}) for each HSP."
+    result = []
+    for record in blastparser.parse_file(filename):
+        for hit in record.hits:
+            for m in hit.matches:
+                result.append((record.query_name, hit.subject_name,
+                               dict([ (f, getattr(m, f)) for f in FIELDS ])))
+    return result
+
+def group_key(by, query, subject):
+    if by == 'query':
+        return query
+    if by == 'subject':
+        return subject
+    if by == 'pair':
+        return (query, subject)
+    return None
+
+def naive(filename, by, edges):
+    groups = {}
+    for query, subject, values in hsps(filename):
+        groups.setdefault(group_key(by, query, subject), []).append(
+            (query, subject, values))
+
+    results = {}
+    for key, members in groups.items():
+        scores = [ v['score'] for _, _, v in members ]
+        expects = [ v['expect'] for _, _, v in members ]
+        top = sorted([ (v['score'], q, s) for q, s, v in members ],
+                     key=lambda x: -x[0])[:3]
+        low = sorted([ (v['query_start'], q, s) for q, s, v in members ],
+                     key=lambda x: x[0])[:2]
+        hist = [0] * (len(edges) + 1)
+        for e in expects:
+            hist[len([ edge for edge in edges if edge <= e ])] += 1
+        results[key] = dict(n=len(members), total=sum(scores),
+                            best=max(scores), least=min(expects),
+                            mean=sum(scores) / len(scores),
+                            top=top, low=low, hist=hist,
+                            ends=sum([ v['subject_end']
+                                       for _, _, v in members ]))
+    return results
+
+EDGES = [1e-40, 1e-30, 1e-20]
+
+def aggregations():
+    return dict(n=aggregate.Count(), total=aggregate.Sum('score'),
+                best=aggregate.Max('score'), least=aggregate.Min('expect'),
+                mean=aggregate.Mean('score'),
+                top=aggregate.TopK('score', 3),
+                low=aggregate.TopK('query_start', 2, largest=False),
+                hist=aggregate.Histogram('expect', EDGES),
+                ends=aggregate.Sum('subject_end'))
+
+def close(a, b):
+    "results equal, allowing for the order floats were added in."
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(a - b) <= 1e-9 * max(abs(a), abs(b), 1)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and \
+               all([ close(x, y) for x, y in zip(a, b) ])
+    return a == b
+
+@pytest.mark.parametrize('by', aggregate.GROUP_KEYS)
+@pytest.mark.parametrize('compact', [False, True])
+def test_aggregator(report, by, compact):
+    agg = aggregate.Aggregator(by, **aggregations())
+    fields = agg.fields()
+    assert set(fields) == set(FIELDS)
+    for record in blastparser.parse_file(report, compact=compact,
+                                         fields=fields):
+        agg.add(record)
+    results = agg.results()
+
+    expected = naive(report, by, EDGES)
+    assert agg.groups == len(expected)
+    assert sorted(results) == sorted(expected)
+    for key in expected:
+        for name in expected[key]:
+            # TopK ties may come out in any order; compare values there
+            got, want = results[key][name], expected[key][name]
+            if name in ('top', 'low'):
+                got = [ x[0] for x in got ]
+                want = [ x[0] for x in want ]
+            assert close(got, want), (key, name, got, want)
+
+def test_topk_labels(report):
+    results = aggregate.aggregate(blastparser.parse_file(report,
+                                                         compact=True),
+                                  by=None, top=aggregate.TopK('score', 1))
+    (score, query, subject), = results[None]['top']
+    best = max([ v['score'] for _, _, v in hsps(report) ])
+    assert score == best
+    assert (query, subject) in [ (q, s) for q, s, v in hsps(report)
+                                 if v['score'] == best ]
+
+def test_bad_aggregations():
+    with pytest.raises(ValueError):
+        aggregate.Aggregator('genome', n=aggregate.Count())
+    with pytest.raises(ValueError):
+        aggregate.Aggregator('query')
+    with pytest.raises(ValueError):
+        aggregate.Max('bogus')
+
+def test_empty_groups():
+    agg = aggregate.Aggregator(None, mean=aggregate.Mean('score'),
+                               best=aggregate.Max('score'))
+    assert agg.results() == {}
+    record = blastparser.CompactBlastQuery('q0')
+    agg.add(record)
+    assert agg.results() == {None: dict(mean=None, best=None)}
@@ -0,0 +1,114 @@
+"""
+alignment_stats against counting each column of each alignment.
+"""
+
+import os
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import alignstats
+import blastparser
+
+from conftest import write_report
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def brute_force(qseq, sseq, gapchar='-'):
+    "(identities, mismatches, gap opens, gap extends, length), by column."
+    identities = mismatches = opens = extends = 0
+    q_open = s_open = False
+    for q, s in zip(qseq.upper(), sseq.upper()):
+        q_gap, s_gap = q == gapchar, s == gapchar
+        if q_gap or s_gap:
+            if (q_gap and not q_open) or (s_gap and not s_open):
+                opens += 1
+            else:
+                extends += 1
+        elif q == s:
+            identities += 1
+        else:
+            mismatches += 1
+        q_open, s_open = q_gap, s_gap
+    return identities, mismatches, opens, extends, len(qseq)
+
+def random_alignment(rnd):
+    length = rnd.choice([0, 1, 2, rnd.randint(3, 200)])
+    q, s = [], []
+    for _ in range(length):
+        a = rnd.choice('ACGTacgtN')
+        r = rnd.random()
+        if r < 0.1:
+            q.append('-')
+            s.append(a)
+        elif r < 0.2:
+            q.append(a)
+            s.append('-')
+        elif r < 0.35:
+            q.append(a)
+            s.append(rnd.choice('ACGTacgt'))
+        else:
+            q.append(a)
+            s.append(rnd.choice([a, a.swapcase()]))
+    return ''.join(q), ''.join(s)
+
+def stat_rows(stats):
+    return zip(*[ stats[column].tolist()
+                  for _, column in alignstats.STAT_COLUMNS ])
+
+def test_alignment_stats_brute_force():
+    rnd = random.Random(1)
+    pairs = [ random_alignment(rnd) for _ in range(500) ]
+    stats = alignstats.alignment_stats([ q for q, _ in pairs ],
+                                       [ s for _, s in pairs ])
+    assert stat_rows(stats) == [ brute_force(q, s) for q, s in pairs ]
+
+def test_gap_runs_on_both_sides():
+    # a query gap run straight after a subject gap run opens a new gap
+    stats = alignstats.alignment_stats(['AC--GT', 'A-C'], ['A-TTGT', 'AG-'])
+    assert stat_rows(stats) == [(3, 0, 2, 1, 6), (1, 0, 2, 0, 3)]
+
+def test_alignment_stats_errors_and_empty():
+    assert stat_rows(alignstats.alignment_stats([], [])) == []
+    with pytest.raises(ValueError):
+        alignstats.alignment_stats(['ACGT'], ['ACG'])
+
+def match_stats(records):
+    result = []
+    for record in records:
+        for hit in record.hits:
+            for m in hit.matches:
+                result.append((m.identities, m.mismatches, m.gap_opens,
+                               m.gap_extends, m.align_length))
+    return result
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('batch_size', [1, 7, 10000])
+def test_add_stats(tmpdir, compact, batch_size):
+    report = write_report(str(tmpdir.join('report.blast')), queries=20,
+                          hits=3, hsps=2, length=80, seed=3)
+    expected = [ brute_force(m.query_sequence, m.subject_sequence)
+                 for r in blastparser.parse_file(report)
+                 for hit in r.hits for m in hit.matches ]
+
+    records = blastparser.parse_file(report, compact=compact)
+    with_stats = list(alignstats.add_stats(records, keep_sequences=False,
+                                           batch_size=batch_size))
+    assert match_stats(with_stats) == expected
+    for record in with_stats:
+        for hit in record.hits:
+            for m in hit.matches:
+                assert m.query_sequence is None
+
+    # through the parser's 'fields', as writers and aggregate use them
+    records = blastparser.parse_file(report, compact=True,
+                                     fields=('score',) +
+                                     alignstats.STAT_FIELDS)
+    assert match_stats(records) == expected
+
+def test_tabular_has_no_stats():
+    records = list(blastparser.parse_file(os.path.join(DATA, 'search.tab'),
+                                          fields=alignstats.STAT_FIELDS))
+    assert set(match_stats(records)) == set([(None,) * 5])
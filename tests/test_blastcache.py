@@ -0,0 +1,107 @@
+"""
+The .bcache columnar cache must give back exactly what parsing gives.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import blastcache
+import blastparser
+
+from conftest import write_report
+
+FIELDS = ('score', 'expect', 'query_start', 'query_end', 'subject_start',
+          'subject_end')
+
+def rows(records):
+    "one (query, subject, score, expect, starts and ends) row per HSP."
+    result = []
+    for record in records:
+        for hit in record.hits:
+            for m in hit.matches:
+                result.append((record.query_name, hit.subject_name,
+                               m.score, m.expect, m.query_start, m.query_end,
+                               m.subject_start, m.subject_end))
+    return result
+
+def parse(filename, cache, **kw):
+    return list(blastparser.parse_file(filename, cache=cache, compact=True,
+                                       fields=FIELDS, **kw))
+
+def test_cache_round_trip(report):
+    expected = parse(report, False)
+    assert not os.path.exists(blastcache.cache_filename(report))
+
+    first = parse(report, True)
+    assert os.path.exists(blastcache.cache_filename(report))
+    assert rows(first) == rows(expected)
+
+    cache = blastcache.load_cache(report)
+    assert cache is not None
+    try:
+        assert len(cache) == len(expected)
+        cached = list(cache)
+    finally:
+        cache.close()
+
+    assert [ r.query_name for r in cached ] == \
+           [ r.query_name for r in expected ]
+    for got, want in zip(cached, expected):
+        assert got.subject_names == want.subject_names
+        assert list(got.hit_offsets) == list(want.hit_offsets)
+        for column, _ in blastcache.HSP_COLUMNS:
+            assert list(getattr(got, column)) == list(getattr(want, column))
+
+    assert rows(parse(report, True)) == rows(expected)
+
+def test_cached_filters_and_objects(report):
+    parse(report, True)
+    assert blastcache.load_cache(report) is not None
+
+    for kw in [dict(min_score=370), dict(max_evalue=1e-36),
+               dict(max_hits_per_query=2), dict(best_hits_only=True)]:
+        assert rows(parse(report, True, **kw)) == rows(parse(report, False,
+                                                            **kw))
+
+    objects = list(blastparser.parse_file(report, cache=True, fields=FIELDS))
+    assert not hasattr(objects[0], 'hit_offsets')
+    assert rows(objects) == rows(parse(report, False))
+
+def test_stale_cache_is_ignored(report, tmpdir):
+    parse(report, True)
+    write_report(report, queries=25, hits=3, hsps=2, length=90, seed=11)
+    assert blastcache.load_cache(report) is None
+
+    expected = parse(report, False)
+    assert rows(parse(report, True)) == rows(expected)
+    assert blastcache.load_cache(report) is not None
+
+def test_same_size_rewrite_is_noticed(report):
+    parse(report, True)
+    key = blastcache.fingerprint(report)
+
+    # swap two digits in place: same size, different content
+    data = open(report, 'rb').read()
+    i = data.index('Score =') + len('Score =')
+    while not data[i].isdigit():
+        i += 1
+    digit = data[i] == '9' and '1' or '9'
+    fp = open(report, 'wb')
+    fp.write(data[:i] + digit + data[i + 1:])
+    fp.close()
+    st = os.stat(report)
+    os.utime(report, (st.st_atime, key[1]))
+
+    assert blastcache.fingerprint(report) != key
+    assert blastcache.load_cache(report) is None
+    assert rows(parse(report, True)) == rows(parse(report, False))
+
+def test_partial_read_leaves_no_cache(report):
+    records = blastparser.parse_file(report, cache=True, compact=True,
+                                     fields=FIELDS)
+    next(records)
+    records.close()
+    assert blastcache.load_cache(report) is None
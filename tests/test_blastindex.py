@@ -0,0 +1,133 @@
+"""
+Lookups through the .bidx index must match a full parse, and a stale
+index must be noticed and rebuilt.
+"""
+
+import os
+
+import pytest
+
+import bgzf
+import blastindex
+import blastparser
+
+from conftest import write_report
+
+def parsed(filename):
+    "query name -> (subject names, scores) from a full parse."
+    result = {}
+    for record in blastparser.parse_file(filename, compact=True):
+        result[record.query_name] = (record.subject_names,
+                                     list(record.scores))
+    return result
+
+def lookup(idx, name):
+    record = idx[name]
+    return record.subject_names, list(record.scores)
+
+def test_lookups_match_parse(report):
+    expected = parsed(report)
+    idx = blastindex.open_index(report, compact=True)
+    try:
+        assert os.path.exists(blastindex.index_filename(report))
+        assert idx.is_current()
+        assert len(idx) == len(expected)
+        assert list(idx.names()) == [ 'q%d' % i for i in range(40) ]
+        for name in expected:
+            assert name in idx
+            assert lookup(idx, name) == expected[name]
+        assert 'nosuchquery' not in idx
+        assert idx.get('nosuchquery') is None
+        for name, record in idx:
+            assert record.query_name == name
+    finally:
+        idx.close()
+
+def test_missing_name_raises(report):
+    idx = blastindex.open_index(report)
+    try:
+        with pytest.raises(KeyError):
+            idx['nosuchquery']
+    finally:
+        idx.close()
+
+def test_stale_index_is_rebuilt(report):
+    blastindex.open_index(report).close()
+    old_size = os.path.getsize(report)
+
+    # fewer, longer queries under other names
+    write_report(report, queries=12, hits=5, hsps=2, length=120, seed=3,
+                 query_prefix='x')
+    assert os.path.getsize(report) != old_size
+    expected = parsed(report)
+
+    idx = blastindex.open_index(report, rebuild=False)
+    try:
+        assert not idx.is_current()
+    finally:
+        idx.close()
+
+    idx = blastindex.open_index(report, compact=True)
+    try:
+        assert idx.is_current()
+        assert len(idx) == 12
+        assert 'q0' not in idx
+        for name in expected:
+            assert lookup(idx, name) == expected[name]
+    finally:
+        idx.close()
+
+def test_touched_report_is_stale(report):
+    idx = blastindex.open_index(report)
+    try:
+        st = os.stat(report)
+        os.utime(report, (st.st_atime, st.st_mtime + 10))
+        assert not idx.is_current()
+    finally:
+        idx.close()
+
+def test_bgzf_report(tmpdir):
+    plain = write_report(str(tmpdir.join('plain.blast')), queries=200,
+                         hits=4, hsps=3, length=90, seed=5)
+    report = str(tmpdir.join('report.blast.gz'))
+    w = bgzf.BgzfWriter(open(report, 'wb'))
+    w.write(open(plain, 'rb').read())
+    w.close()
+    expected = parsed(plain)
+
+    idx = blastindex.open_index(report, compact=True)
+    try:
+        assert idx.compressed
+        assert len(idx) == 200
+        for name in expected:
+            assert lookup(idx, name) == expected[name]
+    finally:
+        idx.close()
+
+@pytest.mark.parametrize('data', ['', 'BLASTIDX', 'NOTANIDX' + '\0' * 100])
+def test_unreadable_index_is_rebuilt(report, data):
+    fp = open(blastindex.index_filename(report), 'wb')
+    fp.write(data)
+    fp.close()
+
+    with pytest.raises(ValueError):
+        blastindex.open_index(report, rebuild=False)
+
+    expected = parsed(report)
+    idx = blastindex.open_index(report, compact=True)
+    try:
+        assert len(idx) == len(expected)
+        for name in expected:
+            assert lookup(idx, name) == expected[name]
+    finally:
+        idx.close()
+
+def test_failed_build_leaves_no_index(report, monkeypatch):
+    class Failing(object):
+        def pack(self, *args):
+            raise IOError('disk full')
+    monkeypatch.setattr(blastindex, '_SLOT', Failing())
+
+    with pytest.raises(IOError):
+        blastindex.build_index(report)
+    assert os.listdir(os.path.dirname(report)) == ['report.blast']
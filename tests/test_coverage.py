@@ -0,0 +1,179 @@
+"""
+coverage.py against counting every base.
+"""
+
+import random
+
+import coverage
+
+class Match(object):
+    "the subject coordinates of a BLAST match, 1-based and inclusive."
+    def __init__(self, subject_start, subject_end, score=None):
+        self.subject_start = subject_start
+        self.subject_end = subject_end
+        self.score = score
+
+def random_intervals(rnd, n, length):
+    "a flat list of n (start, end) pairs, some empty or out of range."
+    flat = []
+    for _ in range(n):
+        start = rnd.randint(-5, length + 5)
+        end = start + rnd.choice([0, 1, 2, rnd.randint(0, length // 3)])
+        flat.extend([start, end])
+    return flat
+
+def per_base(flat, length):
+    "the depth of each of 'length' bases."
+    depth = [0] * length
+    for start, end in zip(flat[::2], flat[1::2]):
+        for pos in range(max(start, 0), min(end, length)):
+            depth[pos] += 1
+    return depth
+
+def runs_of(covered):
+    "the (start, end) runs of true values in 'covered'."
+    runs = []
+    start = None
+    for pos, flag in enumerate(covered + [False]):
+        if flag and start is None:
+            start = pos
+        elif not flag and start is not None:
+            runs.append((start, pos))
+            start = None
+    return runs
+
+def test_merge_intervals_brute_force():
+    rnd = random.Random(1)
+    for trial in range(300):
+        length = rnd.randint(1, 60)
+        flat = random_intervals(rnd, rnd.randint(0, 12), length)
+        depth = per_base(flat, length)
+
+        merged = coverage.merge_intervals(flat, length)
+        assert [ tuple(pair) for pair in merged ] == \
+               runs_of([ d > 0 for d in depth ])
+
+def test_merge_intervals_touching_and_unclipped():
+    merge = lambda *args: list(coverage.merge_intervals(*args))
+    assert merge([5, 10, 0, 5, 20, 20]) == [(0, 10)]
+    assert merge([0, 3, 2, 8, 9, 12]) == [(0, 8), (9, 12)]
+    assert merge([-4, 3, 8, 30], 10) == [(0, 3), (8, 10)]
+    assert merge([]) == []
+
+def test_coverage_brute_force():
+    rnd = random.Random(2)
+    for trial in range(100):
+        lengths = dict(a=rnd.randint(1, 50), b=rnd.randint(1, 50))
+        c = coverage.Coverage()
+        flats = dict(a=[], b=[])
+        for _ in range(rnd.randint(0, 20)):
+            name = rnd.choice('ab')
+            start, end = random_intervals(rnd, 1, lengths[name])
+            c.add(name, start, end)
+            flats[name].extend([start, end])
+
+        for name, length in lengths.items():
+            depth = per_base(flats[name], length)
+            assert c.covered(name, length) == sum([ 1 for d in depth
+                                                    if d > 0 ])
+            runs = runs_of([ d > 0 for d in depth ])
+            assert [ tuple(pair) for pair in c.intervals(name, length) ] \
+                   == runs
+
+def test_coverage_of_matches():
+    c = coverage.Coverage()
+    c.add_match('chr1', Match(11, 20))
+    c.add_match('chr1', Match(25, 16))      # minus strand
+    c.add_match('chr2', Match(1, 1))
+    assert sorted(c.names()) == ['chr1', 'chr2']
+    assert list(c.intervals('chr1')) == [(10, 25)]
+    assert c.covered('chr1', 100) == 15
+    assert c.covered('chr2', 100) == 1
+    assert c.covered('chr3', 100) == 0
+
+    c.discard('chr1')
+    assert len(c) == 1
+    assert c.covered('chr1', 100) == 0
+
+def check_depth_runs(runs, depth):
+    "the runs are adjacent, differ in depth, and match 'depth' per base."
+    bases = []
+    last_end = 0
+    last_depth = None
+    for start, end, d in runs:
+        assert start == last_end and start < end
+        assert d != last_depth
+        bases.extend([d] * (end - start))
+        last_end, last_depth = end, d
+    assert bases == depth
+
+def test_depth_runs_brute_force():
+    rnd = random.Random(3)
+    for trial in range(200):
+        length = rnd.randint(1, 40)
+        flat = random_intervals(rnd, rnd.randint(0, 10), length)
+        depth = per_base(flat, length)
+        check_depth_runs(coverage.depth_runs(flat, length), depth)
+
+        hist = coverage.depth_histogram(coverage.depth_runs(flat, length))
+        assert hist == [ depth.count(d) for d in range(max(depth) + 1) ]
+
+def test_depth_runs_without_length():
+    runs = list(coverage.depth_runs([2, 5, 4, 8]))
+    assert runs == [(0, 2, 0), (2, 4, 1), (4, 5, 2), (5, 8, 1)]
+    assert list(coverage.depth_runs([])) == []
+
+def test_coverage_depth():
+    rnd = random.Random(4)
+    c = coverage.Coverage()
+    flat = random_intervals(rnd, 30, 80)
+    for start, end in zip(flat[::2], flat[1::2]):
+        c.add('chr1', start, end)
+    check_depth_runs(c.depth('chr1', 80), per_base(flat, 80))
+    assert list(c.depth('chr2', 10)) == [(0, 10, 0)]
+
+def test_max_level_runs_brute_force():
+    rnd = random.Random(5)
+    for trial in range(200):
+        length = rnd.randint(1, 40)
+        n = rnd.randint(0, 10)
+        flat = random_intervals(rnd, n, length)
+        levels = [ rnd.randint(0, 3) for _ in range(n) ]
+
+        best = [-1] * length
+        for k in range(n):
+            for pos in range(max(flat[2 * k], 0), min(flat[2 * k + 1],
+                                                      length)):
+                best[pos] = max(best[pos], levels[k])
+        check_depth_runs(coverage.max_level_runs(flat, levels, length), best)
+
+def test_threshold_coverage_brute_force():
+    rnd = random.Random(6)
+    scores = [50, 100, 200]
+    cutoffs = [0, 100, 500]
+    for trial in range(50):
+        length = rnd.randint(1, 60)
+        c = coverage.ThresholdCoverage(scores, cutoffs)
+        added = []
+        for _ in range(rnd.randint(0, 15)):
+            start, end = random_intervals(rnd, 1, length)
+            score = rnd.choice([10, 50, 75, 100, 150, 200, 300])
+            query_length = rnd.choice([50, 100, 300, 500, 1000])
+            c.add('chr1', start, end, score, query_length)
+            added.append((start, end, score, query_length))
+
+        covered = c.covered('chr1', length)
+        assert sorted(covered) == [ (s, q) for s in scores for q in cutoffs ]
+        for (score, cutoff), n in covered.items():
+            flat = []
+            for start, end, s, q in added:
+                if s >= score and q >= cutoff:
+                    flat.extend([start, end])
+            assert n == sum([ 1 for d in per_base(flat, length) if d ])
+
+def test_threshold_coverage_of_matches():
+    c = coverage.ThresholdCoverage([100], [0])
+    c.add_match('chr1', Match(30, 21, score=150), 80)
+    c.add_match('chr1', Match(1, 10, score=99), 80)
+    assert c.covered('chr1', 100) == {(100, 0): 10}
+    assert c.covered('chr2', 100) == {(100, 0): 0}
@@ -0,0 +1,103 @@
+"""
+The .fidx FASTA index against the FASTA file itself, and what happens
+to an index that is stale, unreadable or only half written.
+"""
+
+import os
+import gzip
+
+import pytest
+
+import fastaindex
+
+RECORDS = [('chr1', 'first chromosome', 'ACGTACGTAA' * 13),
+           ('gi|123|ref|NC_2|', '', 'GGCCA' * 7),
+           ('empty', 'no bases', ''),
+           ('chr3', 'third', 'T' * 61)]
+
+def write_fasta(filename, records, width=60, opener=open):
+    fp = opener(filename, 'wb')
+    for name, description, seq in records:
+        fp.write('>%s %s\n' % (name, description))
+        for i in range(0, len(seq), width):
+            fp.write(seq[i:i + width] + '\n')
+    fp.close()
+    return filename
+
+@pytest.fixture
+def fasta(tmpdir):
+    return write_fasta(str(tmpdir.join('genome.fa')), RECORDS)
+
+def check(idx, records):
+    assert len(idx) == len(records)
+    assert [ e.name for e in idx ] == [ name for name, _, _ in records ]
+    for name, description, seq in records:
+        assert name in idx
+        assert idx.length(name) == len(seq)
+        assert idx.description(name) == description
+        assert idx.sequence(name) == seq
+    assert 'nosuchname' not in idx
+
+def test_lookups(fasta):
+    idx = fastaindex.open_index(fasta)
+    try:
+        assert idx.is_current()
+        check(idx, RECORDS)
+        # lookups drop a 'gi|NNN|' prefix
+        assert idx.length('ref|NC_2|') == 35
+        assert idx.length('gi|999|ref|NC_2|') == 35
+    finally:
+        idx.close()
+
+def test_compressed(tmpdir):
+    fasta = write_fasta(str(tmpdir.join('genome.fa.gz')), RECORDS,
+                        opener=gzip.open)
+    idx = fastaindex.open_index(fasta)
+    try:
+        check(idx, RECORDS)
+    finally:
+        idx.close()
+
+def test_stale_index_is_rebuilt(fasta):
+    fastaindex.open_index(fasta).close()
+    records = RECORDS[:2] + [('chr4', 'new', 'ACGT' * 40)]
+    write_fasta(fasta, records)
+
+    idx = fastaindex.open_index(fasta, rebuild=False)
+    try:
+        assert not idx.is_current()
+    finally:
+        idx.close()
+
+    idx = fastaindex.open_index(fasta)
+    try:
+        assert idx.is_current()
+        check(idx, records)
+    finally:
+        idx.close()
+
+@pytest.mark.parametrize('data', ['', 'FASTAIDX', 'NOTANIDX' + '\0' * 100])
+def test_unreadable_index_is_rebuilt(fasta, data):
+    filename = fastaindex.index_filename(fasta)
+    fp = open(filename, 'wb')
+    fp.write(data)
+    fp.close()
+
+    with pytest.raises(ValueError):
+        fastaindex.open_index(fasta, rebuild=False)
+
+    idx = fastaindex.open_index(fasta)
+    try:
+        check(idx, RECORDS)
+    finally:
+        idx.close()
+
+def test_failed_build_leaves_no_index(fasta, monkeypatch):
+    class Failing(object):
+        def pack(self, *args):
+            raise IOError('disk full')
+    monkeypatch.setattr(fastaindex, '_SLOT', Failing())
+
+    with pytest.raises(IOError):
+        fastaindex.build_index(fasta)
+    assert os.listdir(os.path.dirname(fasta)) == ['genome.fa']
@@ -0,0 +1,93 @@
+"""
+The parser's HSP filters must keep exactly what filtering the full
+parse afterwards keeps.
+"""
+
+import os
+
+import pytest
+
+import blastparser
+
+from conftest import write_report
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# e-values in the synthetic reports fall with the score a power of ten at
+# a time, so thresholds between powers keep report order best first.
+OPTIONS = [dict(min_score=370), dict(min_score=1000),
+           dict(max_evalue=9.5e-37), dict(max_evalue=1e-300),
+           dict(max_hits_per_query=1), dict(max_hits_per_query=3),
+           dict(best_hits_only=True),
+           dict(min_score=300, max_hits_per_query=2),
+           dict(max_evalue=9.5e-31, best_hits_only=True)]
+
+def rows(records):
+    "(query, subject, score, expect) per HSP, expect rounded from -log10."
+    return [ (record.query_name, hit.subject_name, m.score,
+              float('%.10g' % m.expect))
+             for record in records for hit in record.hits
+             for m in hit.matches ]
+
+def filtered(records, min_score=None, max_evalue=None,
+             max_hits_per_query=None, best_hits_only=False):
+    "the rows of 'records' that the options keep, found the slow way."
+    result = []
+    for record in records:
+        hits = record.hits
+        if max_hits_per_query is not None:
+            hits = hits[:max_hits_per_query]
+        kept = []
+        for hit in hits:
+            for m in hit.matches:
+                if min_score is not None and m.score < min_score:
+                    continue
+                if max_evalue is not None and m.expect > max_evalue:
+                    continue
+                kept.append((record.query_name, hit.subject_name, m.score,
+                             float('%.10g' % m.expect)))
+        if best_hits_only and kept:
+            best = max([ row[2] for row in kept ])
+            kept = [ row for row in kept if row[2] >= best ]
+        result.extend(kept)
+    return result
+
+@pytest.fixture(scope='module')
+def unfiltered(tmpdir_factory):
+    filename = str(tmpdir_factory.mktemp('filters').join('report.blast'))
+    write_report(filename, queries=40, hits=4, hsps=3, length=90, seed=7)
+    return filename, list(blastparser.parse_file(filename))
+
+@pytest.mark.parametrize('options', OPTIONS)
+@pytest.mark.parametrize('compact', [False, True])
+def test_filters(unfiltered, options, compact):
+    filename, records = unfiltered
+    expected = filtered(records, **options)
+    got = list(blastparser.parse_file(filename, compact=compact, **options))
+    assert rows(got) == expected
+    # queries left with no HSPs are dropped
+    assert [ len(r) for r in got if not len(r) ] == []
+
+@pytest.mark.parametrize('options', OPTIONS[::3])
+@pytest.mark.parametrize('kw', [dict(engine='mmap'), dict(jobs=2)])
+def test_filters_other_engines(unfiltered, options, kw):
+    filename, records = unfiltered
+    got = blastparser.parse_file(filename, compact=True, **dict(options, **kw))
+    assert rows(got) == filtered(records, **options)
+
+@pytest.mark.parametrize('name', ['search.txt', 'search.tab', 'search.tab7',
+                                  'search.xml'])
+@pytest.mark.parametrize('options', [dict(min_score=37),
+                                     dict(max_evalue=1e-5),
+                                     dict(max_hits_per_query=1),
+                                     dict(best_hits_only=True)])
+def test_filters_on_each_format(name, options):
+    filename = os.path.join(DATA, name)
+    records = list(blastparser.parse_file(filename))
+    for compact in (False, True):
+        got = blastparser.parse_file(filename, compact=compact, **options)
+        assert rows(got) == filtered(records, **options)
+
+def test_bad_option():
+    with pytest.raises(ValueError):
+        blastparser.BlastParser(max_hits_per_query=0)
@@ -0,0 +1,128 @@
+"""
+follow_file on a report that grows as it is read: each query must come out
+once, whole, and the same as from parsing the finished report.
+"""
+
+import os
+
+import pytest
+
+import blastparser
+
+def summary(record):
+    "(query, one (subject, score, expect, starts and ends) row per HSP)."
+    hsps = []
+    for hit in record.hits:
+        for m in hit.matches:
+            hsps.append((hit.subject_name, m.score, m.expect, m.query_start,
+                         m.query_end, m.subject_start, m.subject_end))
+    return record.query_name, hsps
+
+def parse(filename):
+    return [ summary(r) for r in blastparser.parse_file(filename) ]
+
+def read(filename):
+    fp = open(filename, 'rb')
+    try:
+        return fp.read()
+    finally:
+        fp.close()
+
+class Writer(object):
+    """
+    A 'done' callable for follow_file that appends the next piece of 'data'
+    to 'filename' each time it is asked, and says BLAST is finished once
+    all of it is written.
+    """
+    def __init__(self, filename, data, step):
+        self.filename = filename
+        self.pieces = [ data[i:i + step] for i in range(0, len(data), step) ]
+        self.pieces.reverse()
+
+    def __call__(self):
+        if self.pieces:
+            fp = open(self.filename, 'ab')
+            try:
+                fp.write(self.pieces.pop())
+            finally:
+                fp.close()
+        return not self.pieces
+
+def test_finished_report(report):
+    records = blastparser.follow_file(report, interval=0, done=lambda: True)
+    assert [ summary(r) for r in records ] == parse(report)
+
+@pytest.mark.parametrize('step', [1000, 4096, 100000])
+@pytest.mark.parametrize('window', [500, blastparser.PARALLEL_CHUNK_SIZE])
+def test_growing_report(report, tmpdir, step, window):
+    filename = str(tmpdir.join('growing.blast'))
+    done = Writer(filename, read(report), step)
+    records = blastparser.follow_file(filename, interval=0, done=done,
+                                      window=window)
+    assert [ summary(r) for r in records ] == parse(report)
+
+def test_compact_records(report, tmpdir):
+    filename = str(tmpdir.join('growing.blast'))
+    done = Writer(filename, read(report), 3000)
+    records = blastparser.follow_file(filename, interval=0, done=done,
+                                      compact=True)
+    assert [ summary(r) for r in records ] == parse(report)
+
+def test_incomplete_query_is_held_back(report, tmpdir):
+    data = read(report)
+    starts = blastparser._query_starts(report, 0, len(data))
+    filename = str(tmpdir.join('growing.blast'))
+    fp = open(filename, 'wb')
+    fp.write(data[:starts[3] + 200])    # three queries, and part of one
+    fp.close()
+
+    checkpoint = str(tmpdir.join('checkpoint'))
+    records = blastparser.follow_file(filename, checkpoint, interval=0.01,
+                                      idle_timeout=0)
+    expected = parse(report)
+    assert [ summary(r) for r in records ] == expected[:3]
+    state = blastparser.load_checkpoint(checkpoint)
+    assert state['offset'] == starts[3]
+    assert state['records'] == 3
+    assert state['query'] == expected[2][0]
+
+    # the rest is read from where the last call stopped
+    fp = open(filename, 'ab')
+    fp.write(data[starts[3] + 200:])
+    fp.close()
+    records = blastparser.follow_file(filename, checkpoint, interval=0,
+                                      done=lambda: True)
+    assert [ summary(r) for r in records ] == expected[3:]
+
+def test_missing_file_is_waited_on(tmpdir):
+    filename = str(tmpdir.join('missing.blast'))
+    assert list(blastparser.follow_file(filename, interval=0.01,
+                                        idle_timeout=0.05)) == []
+    assert list(blastparser.follow_file(filename, interval=0,
+                                        done=lambda: True)) == []
+
+def test_interrupted_record_is_emitted_again(report, tmpdir):
+    expected = parse(report)
+    checkpoint = str(tmpdir.join('checkpoint'))
+    records = blastparser.follow_file(report, checkpoint, interval=0,
+                                      done=lambda: True)
+    got = [ summary(records.next()) for i in range(5) ]
+    records.close()             # the fifth record was not finished with
+    assert got == expected[:5]
+    assert blastparser.load_checkpoint(checkpoint)['records'] == 4
+
+    records = blastparser.follow_file(report, checkpoint, interval=0,
+                                      done=lambda: True)
+    assert [ summary(r) for r in records ] == expected[4:]
+    assert blastparser.load_checkpoint(checkpoint)['records'] == \
+           len(expected)
+    assert not os.path.exists(checkpoint + '.tmp')
+
+def test_truncated_file(report, tmpdir):
+    checkpoint = str(tmpdir.join('checkpoint'))
+    blastparser.save_checkpoint(checkpoint,
+                                dict(offset=os.path.getsize(report) + 1,
+                                     records=0, query=None))
+    records = blastparser.follow_file(report, checkpoint, interval=0,
+                                      done=lambda: True)
+    pytest.raises(IOError, list, records)
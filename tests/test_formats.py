@@ -0,0 +1,101 @@
+"""
+The text, tabular (-outfmt 6 and 7) and XML forms of one small search,
+in tests/data, must parse to the same HSPs.
+"""
+
+import os
+import gzip
+from StringIO import StringIO
+
+import pytest
+
+import blastparser
+import parse_blast
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# (query, subject, score, expect, query start, query end, subject start,
+# subject end), with starts 0-based on the plus strand.
+EXPECTED = [('q1', 's2', 40.1, 5e-06, 4, 24, 0, 20),
+            ('q1', 's1', 38.2, 2e-05, 0, 20, 100, 120),
+            ('q1', 's1', 24.3, 0.15, 20, 32, 212, 201),
+            ('q2', 's3', 36.2, 8e-05, 2, 24, 50, 73)]
+
+FILES = [('search.txt', 'text'), ('search.tab', 'tabular'),
+         ('search.tab7', 'tabular'), ('search.xml', 'xml')]
+
+def rows(records):
+    "EXPECTED-style rows; expects are kept as -log10, so are rounded."
+    result = []
+    for record in records:
+        for hit in record.hits:
+            for m in hit.matches:
+                result.append((record.query_name, hit.subject_name, m.score,
+                               float('%.10g' % m.expect), m.query_start,
+                               m.query_end, m.subject_start, m.subject_end))
+    return result
+
+def data(name):
+    return os.path.join(DATA, name)
+
+@pytest.mark.parametrize('name,format', FILES)
+@pytest.mark.parametrize('compact', [False, True])
+def test_parse(name, format, compact):
+    assert blastparser.detect_file_format(data(name)) == format
+    records = list(blastparser.parse_file(data(name), compact=compact))
+    assert [ r.query_name for r in records ] == ['q1', 'q2']
+    assert rows(records) == EXPECTED
+
+    # the format given, rather than detected
+    assert rows(blastparser.parse_file(data(name), format=format)) == \
+           EXPECTED
+
+@pytest.mark.parametrize('name,format', FILES)
+def test_parse_stream(name, format):
+    fp = StringIO(open(data(name)).read())
+    assert rows(blastparser.parse_fp(fp)) == EXPECTED
+
+@pytest.mark.parametrize('name,format', FILES)
+def test_parse_gzipped(name, format, tmpdir):
+    filename = str(tmpdir.join(name + '.gz'))
+    fp = gzip.open(filename, 'wb')
+    fp.write(open(data(name)).read())
+    fp.close()
+    assert blastparser.detect_file_format(filename) == format
+    assert rows(blastparser.parse_file(filename)) == EXPECTED
+
+def test_xml_alignments_match_text():
+    def alignments(name):
+        return [ (m.query_sequence, m.subject_sequence)
+                 for r in blastparser.parse_file(data(name))
+                 for hit in r.hits for m in hit.matches ]
+    text = alignments('search.txt')
+    assert text[3] == ('CATGCAT-GACCTTAGGCATCAA', 'CATGCATTGACCTAAGGCATCAA')
+    assert alignments('search.xml') == text
+
+def test_tabular_fields_in_any_order(tmpdir):
+    # -outfmt '7 sseqid qseqid evalue bitscore ...': columns by '# Fields:'
+    fields = ['subject id', 'query id', 'evalue', 'bit score', 'q. start',
+              'q. end', 's. start', 's. end', '% identity',
+              'alignment length']
+    order = [1, 0, 10, 11, 6, 7, 8, 9, 2, 3]
+    lines = ['# BLASTN 2.2.28+\n', '# Fields: %s\n' % ', '.join(fields)]
+    for line in open(data('search.tab')):
+        columns = line.rstrip('\n').split('\t')
+        lines.append('\t'.join([ columns[i] for i in order ]) + '\n')
+    lines.append('# BLAST processed 2 queries\n')
+    filename = str(tmpdir.join('reordered.tab7'))
+    open(filename, 'w').write(''.join(lines))
+    assert rows(blastparser.parse_file(filename)) == EXPECTED
+
+@pytest.mark.parametrize('line,format', [
+    ('BLASTN 2.2.18 [Mar-02-2008]\n', 'text'),
+    ('Query= q1 test query\n', 'text'),
+    ('<?xml version="1.0"?>\n', 'xml'),
+    ('\xef\xbb\xbf<?xml version="1.0"?>\n', 'xml'),
+    ('<BlastOutput>\n', 'xml'),
+    ('# BLASTN 2.2.28+\n', 'tabular'),
+    ('q1\ts2\t100.00\t20\t0\t0\t5\t24\t1\t20\t5e-06\t40.1\n', 'tabular'),
+])
+def test_sniff_format(line, format):
+    assert parse_blast.sniff_format(line) == format
@@ -0,0 +1,176 @@
+"""
+Pipeline consumers in every mode: results, and errors passed back
+instead of hanging the run.  The built-in consumers must give what the
+scripts they stand in for give.
+"""
+
+import csv
+import threading
+
+import pytest
+
+import blast_report
+import blastparser
+import pipeline
+import rbh
+import writers
+
+class Names(pipeline.Consumer):
+    "the query names, in the order they came."
+    def __init__(self):
+        self.names = []
+
+    def consume(self, record):
+        self.names.append(record.query_name)
+
+    def finish(self):
+        return self.names
+
+class Failing(pipeline.Consumer):
+    "raises ValueError in consume() or in finish()."
+    def __init__(self, where):
+        self.where = where
+
+    def consume(self, record):
+        if self.where == 'consume':
+            raise ValueError('consume failed')
+
+    def finish(self):
+        if self.where == 'finish':
+            raise ValueError('finish failed')
+        return 'done'
+
+def run(p, report, timeout=60):
+    "p.run_file(report) in a thread; fail rather than hang."
+    outcome = []
+    def target():
+        try:
+            outcome.append((True, p.run_file(report)))
+        except Exception, e:
+            outcome.append((False, e))
+    t = threading.Thread(target=target)
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+    assert outcome, 'the pipeline hung'
+    return outcome[0]
+
+@pytest.mark.parametrize('mode', pipeline.MODES)
+def test_results(report, mode):
+    p = pipeline.Pipeline(batch_size=7)
+    p.add('names', Names(), mode)
+    p.add('summary', pipeline.SummaryConsumer(), mode)
+    ok, results = run(p, report)
+    assert ok, results
+
+    records = list(blastparser.parse_file(report, compact=True))
+    assert results['names'] == [ r.query_name for r in records ]
+    summary = results['summary']
+    assert summary['queries'] == len(records)
+    assert summary['hits'] == sum([ len(r) for r in records ])
+    scores = [ s for r in records for s in r.scores ]
+    assert summary['hsps'] == len(scores)
+    assert summary['max_score'] == max(scores)
+    assert summary['min_score'] == min(scores)
+
+@pytest.mark.parametrize('mode', pipeline.MODES)
+@pytest.mark.parametrize('where', ['consume', 'finish'])
+def test_failing_consumer(report, mode, where):
+    p = pipeline.Pipeline(batch_size=7)
+    p.add('names', Names(), mode)
+    p.add('failing', Failing(where), mode)
+    ok, error = run(p, report)
+    assert not ok
+    if mode == 'process':
+        assert isinstance(error, RuntimeError)
+        assert ('%s failed' % where) in str(error)
+    else:
+        assert isinstance(error, ValueError)
+        assert str(error) == '%s failed' % where
+
+def test_add_and_fields():
+    p = pipeline.Pipeline()
+    p.add('summary', pipeline.SummaryConsumer())
+    p.add('cover', pipeline.CoverageConsumer('genome.fa'), 'thread')
+    p.add('best', pipeline.BestHitsConsumer(), 'process')
+    assert p.fields() == ('score', 'expect', 'subject_start', 'subject_end')
+    pytest.raises(ValueError, p.add, 'summary', pipeline.SummaryConsumer())
+    pytest.raises(ValueError, p.add, 'other', pipeline.SummaryConsumer(),
+                  'fork')
+
+@pytest.mark.parametrize('mode', pipeline.MODES)
+@pytest.mark.parametrize('format', ['csv', 'tsv'])
+def test_csv_consumer(report, tmpdir, mode, format):
+    filename = str(tmpdir.join('hits.' + format))
+    p = pipeline.Pipeline(batch_size=7)
+    p.add('csv', pipeline.CSVConsumer(filename, format), mode)
+    ok, results = run(p, report)
+    assert ok, results
+
+    expected = []
+    for record in blastparser.parse_file(report, compact=True):
+        expected.extend(writers.hsp_rows(record, 'score', 'expect'))
+    assert results['csv'] == len(expected)
+
+    delimiter = dict(csv=',', tsv='\t')[format]
+    fp = open(filename, 'rb')
+    try:
+        got = [ (query, subject, float(score), float(expect))
+                for query, subject, score, expect
+                in csv.reader(fp, delimiter=delimiter) ]
+    finally:
+        fp.close()
+    assert got == expected
+
+@pytest.mark.parametrize('mode', pipeline.MODES)
+@pytest.mark.parametrize('min_score', [None, 400])
+def test_coverage_consumer(report, tmpdir, mode, min_score):
+    length = blast_report.subject_length(90)
+    reference = str(tmpdir.join('subjects.fa'))
+    fp = open(reference, 'w')
+    blast_report.write_fasta(fp, 50, length, 's')   # ten with no hits
+    fp.close()
+
+    records = list(blastparser.parse_file(report))
+    queries = set([ r.query_name for r in records[::2] ])
+    p = pipeline.Pipeline(batch_size=7)
+    p.add('all', pipeline.CoverageConsumer(reference, min_score=min_score),
+          mode)
+    p.add('some', pipeline.CoverageConsumer(reference, queries, min_score),
+          mode)
+    ok, results = run(p, report)
+    assert ok, results
+
+    def covered(records):
+        bases = set()
+        for record in records:
+            for hit in record.hits:
+                for m in hit.matches:
+                    if min_score is not None and m.score < min_score:
+                        continue
+                    start, end = sorted([m.subject_start, m.subject_end])
+                    for i in range(start - 1, end):
+                        bases.add((hit.subject_name, i))
+        return len(bases)
+
+    some = [ r for r in records if r.query_name in queries ]
+    assert results['all'] == dict(covered=covered(records), total=50 * length)
+    assert results['some'] == dict(covered=covered(some), total=50 * length)
+    assert 0 < results['some']['covered'] < results['all']['covered']
+
+@pytest.mark.parametrize('mode', pipeline.MODES)
+def test_best_hits_consumer(report, tmpdir, mode):
+    p = pipeline.Pipeline(batch_size=7)
+    p.add('best', pipeline.BestHitsConsumer(str(tmpdir)), mode)
+    ok, results = run(p, report)
+    assert ok, results
+
+    def pairs(best):
+        try:
+            return [ (best.names[a], best.names[b]) for a, b in best.pairs() ]
+        finally:
+            best.remove()
+
+    expected = pairs(rbh.collect_best_hits(report, str(tmpdir)))
+    assert expected
+    assert pairs(results['best']) == expected
@@ -0,0 +1,197 @@
+"""
+Reciprocal best hits and ortholog groups against a direct reading of
+their definitions, on reports with tied best scores.
+"""
+
+import random
+
+import pytest
+
+import blastparser
+import rbh
+
+def write_scores_report(filename, hits):
+    """
+    Write a text report of 'hits', a list of (query, [(subject, score)])
+    with the hits of each query best first, one 12-column HSP per hit.
+    """
+    fp = open(filename, 'w')
+    fp.write('BLASTN 2.2.18 [Mar-02-2008]\n\n\n')
+    for query, subjects in hits:
+        fp.write('Query= %s test query\n         (100 letters)\n\n' % query)
+        fp.write('Database: test.fa\n           10 sequences; 1000 total'
+                 ' letters\n\n')
+        fp.write('Searching..................................done\n\n\n')
+        if not subjects:
+            fp.write(' ***** No hits found ******\n\n')
+        else:
+            fp.write('%66s Score    E\n' % '')
+            fp.write('%-66s(bits) Value\n\n'
+                     % 'Sequences producing significant alignments:')
+            for subject, score in subjects:
+                fp.write('%-66s %5d   1e-10\n' % (subject + ' test subject',
+                                                  score))
+            fp.write('\n')
+        for subject, score in subjects:
+            fp.write('>%s test subject\n          Length = 100\n\n' % subject)
+            fp.write(' Score = %.1f bits (%d), Expect = 1e-10\n'
+                     % (score, score))
+            fp.write(' Identities = 12/12 (100%)\n Strand = Plus / Plus\n\n')
+            fp.write('Query: 1    ACGTACGTACGT 12\n')
+            fp.write('           ||||||||||||\n')
+            fp.write('Sbjct: 1    ACGTACGTACGT 12\n\n\n')
+        fp.write('  Database: test.fa\n'
+                 '    Posted date:  Jan 1, 2010  1:00 PM\n\n')
+        fp.write('Lambda     K      H\n   1.37    0.711     1.31 \n\n')
+    fp.close()
+    return filename
+
+def random_hits(rnd, queries, subjects):
+    """
+    Hits of each query, best first, with ties among the best scores.  The
+    i'th query mostly hits the i'th subject well, so that some hits are
+    reciprocal.
+    """
+    hits = []
+    for i, query in enumerate(queries):
+        chosen = rnd.sample(subjects, rnd.randint(0, min(4, len(subjects))))
+        scored = [ (s, rnd.choice([40, 50, 60, 60])) for s in chosen ]
+        if i < len(subjects) and rnd.random() < 0.7:
+            scored = [ x for x in scored if x[0] != subjects[i] ]
+            scored.append((subjects[i], 60))
+        rnd.shuffle(scored)
+        scored.sort(key=lambda x: -x[1])    # stable: ties stay shuffled
+        hits.append((query, scored))
+    return hits
+
+def best_subjects(hits):
+    "query -> its best-scoring subjects, in report order."
+    best = {}
+    for query, subjects in hits:
+        if subjects:
+            top = subjects[0][1]
+            best[query] = [ s for s, score in subjects if score == top ]
+    return best
+
+def naive_rbh(ab_hits, ba_hits):
+    ab, ba = best_subjects(ab_hits), best_subjects(ba_hits)
+    pairs = []
+    for a, _ in ab_hits:
+        matches = [ b for b in ab.get(a, []) if a in ba.get(b, []) ]
+        if matches:
+            pairs.append((a, matches[-1]))
+    return pairs
+
+def genome(rnd, prefix, n):
+    return [ '%s%d' % (prefix, i) for i in range(n) ]
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('kw', [dict(), dict(concurrent=False),
+                                dict(memory=1)])
+def test_reciprocal_best_hits(tmpdir, seed, kw):
+    rnd = random.Random(seed)
+    a_names, b_names = genome(rnd, 'a', 30), genome(rnd, 'b', 25)
+    ab_hits = random_hits(rnd, a_names, b_names)
+    ba_hits = random_hits(rnd, b_names, a_names)
+    ab = write_scores_report(str(tmpdir.join('a.x.b')), ab_hits)
+    ba = write_scores_report(str(tmpdir.join('b.x.a')), ba_hits)
+
+    pairs = list(rbh.reciprocal_best_hits(ab, ba, tmpdir=str(tmpdir), **kw))
+    assert pairs == naive_rbh(ab_hits, ba_hits)
+    assert pairs                        # the seeds do give some
+    assert tmpdir.listdir(lambda p: p.basename.startswith('rbh-')) == []
+
+def test_gi_query_names(tmpdir):
+    ab = write_scores_report(str(tmpdir.join('a.x.b')),
+                             [('gi|11|ref|A1|', [('ref|B1|', 50)])])
+    ba = write_scores_report(str(tmpdir.join('b.x.a')),
+                             [('gi|22|ref|B1|', [('ref|A1|', 50)])])
+    assert list(rbh.reciprocal_best_hits(ab, ba)) == [('ref|A1|', 'ref|B1|')]
+
+def test_best_hit_collector_on_any_records(tmpdir):
+    rnd = random.Random(7)
+    hits = random_hits(rnd, genome(rnd, 'a', 20), genome(rnd, 'b', 10))
+    report = write_scores_report(str(tmpdir.join('a.x.b')), hits)
+    expected = sorted([ (a, b) for a, subjects in best_subjects(hits).items()
+                        for b in subjects ])
+
+    for compact in (False, True):
+        collector = rbh.BestHitCollector(report, str(tmpdir))
+        for record in blastparser.parse_file(report, compact=compact):
+            collector.add(record)
+        best = collector.finish()
+        names = best.names
+        try:
+            assert sorted([ (names[a], names[b]) for a, b in best.pairs() ]) \
+                   == expected
+        finally:
+            best.remove()
+
+def test_all_reciprocal_best_hits(tmpdir):
+    rnd = random.Random(11)
+    genomes = dict(x=genome(rnd, 'x', 15), y=genome(rnd, 'y', 15),
+                   z=genome(rnd, 'z', 15))
+    reports = {}
+    hits = {}
+    for a in genomes:
+        for b in genomes:
+            if a == b or (a, b) == ('z', 'x'):  # x-z has one report only
+                continue
+            hits[(a, b)] = random_hits(rnd, genomes[a], genomes[b])
+            reports[(a, b)] = write_scores_report(
+                str(tmpdir.join('%s.x.%s' % (a, b))), hits[(a, b)])
+
+    names = rbh.NameTable()
+    rows = list(rbh.all_reciprocal_best_hits(reports, names=names, jobs=2,
+                                             tmpdir=str(tmpdir)))
+    got = {}
+    for a, b, x, y in rows:
+        got.setdefault((a, b), []).append((x, y))
+    assert sorted(got) == [ pair for pair in [('x', 'y'), ('y', 'z')]
+                            if naive_rbh(hits[pair], hits[pair[::-1]]) ]
+    for (a, b), pairs in got.items():
+        # names are interned as the reports come in, so pairs are in ID
+        # order rather than report order
+        assert sorted(pairs) == sorted(naive_rbh(hits[(a, b)],
+                                                 hits[(b, a)]))
+        ids = [ names[x] for x, y in pairs ]
+        assert ids == sorted(ids)
+
+    # the rows of each pair come together
+    keys = [ row[:2] for row in rows ]
+    assert keys == sorted(keys, key=keys.index)
+
+def test_ortholog_groups():
+    rnd = random.Random(3)
+    nodes = [ (g, '%s%d' % (g, i)) for g in 'xyz' for i in range(10) ]
+    edges = [ tuple(rnd.sample(nodes, 2)) for _ in range(15) ]
+
+    groups = rbh.OrthologGroups()
+    for (ga, a), (gb, b) in edges:
+        groups.add(ga, a, gb, b)
+
+    # connected components, the slow way
+    components = []
+    for a, b in edges:
+        joined = [ c for c in components if a in c or b in c ]
+        merged = set([a, b])
+        for c in joined:
+            merged |= c
+            components.remove(c)
+        components.append(merged)
+
+    got = [ set([ (g, name) for g, names in group.items()
+                  for name in names ]) for group in groups.groups() ]
+    assert sorted(map(sorted, got)) == sorted(map(sorted, components))
+
+    # groups, and names within them, in the order first added
+    seen = []
+    for a, b in edges:
+        for node in (a, b):
+            if node not in seen:
+                seen.append(node)
+    firsts = [ min([ seen.index(n) for n in group ]) for group in got ]
+    assert firsts == sorted(firsts)
+    for group in groups.groups():
+        for g, names in group.items():
+            assert names == sorted(names, key=lambda n: seen.index((g, n)))
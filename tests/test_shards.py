@@ -0,0 +1,152 @@
+"""
+check_shard on complete and truncated reports of each format, and how
+parse_shards keeps the rest of a run going around a bad shard.
+"""
+
+import shards
+import blastparser
+
+from conftest import write_report
+
+XML_HSP = """\
+<Hsp>
+  <Hsp_bit-score>%(score)s</Hsp_bit-score>
+  <Hsp_evalue>1e-30</Hsp_evalue>
+  <Hsp_query-from>1</Hsp_query-from>
+  <Hsp_query-to>10</Hsp_query-to>
+  <Hsp_hit-from>101</Hsp_hit-from>
+  <Hsp_hit-to>110</Hsp_hit-to>
+  <Hsp_identity>10</Hsp_identity>
+  <Hsp_align-len>10</Hsp_align-len>
+  <Hsp_qseq>ACGTACGTAC</Hsp_qseq>
+  <Hsp_hseq>ACGTACGTAC</Hsp_hseq>
+</Hsp>
+"""
+
+XML_ITERATION = """\
+<Iteration>
+  <Iteration_iter-num>%(n)d</Iteration_iter-num>
+  <Iteration_query-ID>Query_%(n)d</Iteration_query-ID>
+  <Iteration_query-def>%(query)s query</Iteration_query-def>
+  <Iteration_hits>
+<Hit>
+  <Hit_num>1</Hit_num>
+  <Hit_id>gnl|BL_ORD_ID|0</Hit_id>
+  <Hit_def>s0 subject</Hit_def>
+  <Hit_hsps>
+%(hsps)s  </Hit_hsps>
+</Hit>
+  </Iteration_hits>
+</Iteration>
+"""
+
+def xml_report(queries):
+    iterations = []
+    for n, query in enumerate(queries):
+        hsps = XML_HSP % dict(score=50 + n)
+        iterations.append(XML_ITERATION % dict(n=n + 1, query=query,
+                                               hsps=hsps))
+    return ('<?xml version="1.0"?>\n<BlastOutput>\n'
+            '  <BlastOutput_program>blastn</BlastOutput_program>\n'
+            '  <BlastOutput_iterations>\n' + ''.join(iterations) +
+            '  </BlastOutput_iterations>\n</BlastOutput>\n')
+
+def tabular_lines(queries):
+    return [ '%s\ts0\t100.00\t10\t0\t0\t1\t10\t101\t110\t1e-30\t%d.0\n'
+             % (query, 50 + n) for n, query in enumerate(queries) ]
+
+def write(tmpdir, name, data):
+    filename = str(tmpdir.join(name))
+    fp = open(filename, 'wb')
+    fp.write(data)
+    fp.close()
+    return filename
+
+def cut_last_alignment(filename):
+    "cut the text report 'filename' short in its last alignment."
+    data = open(filename, 'rb').read()
+    fp = open(filename, 'wb')
+    fp.write(data[:data.rindex('\nSbjct') + 20])
+    fp.close()
+    return filename
+
+def test_text_report(report, tmpdir):
+    assert shards.check_shard(report) is None
+
+    truncated = write(tmpdir, 'cut.blast', open(report, 'rb').read())
+    cut_last_alignment(truncated)
+    assert shards.check_shard(truncated) == \
+           'truncated: no statistics after the last alignment'
+
+    assert shards.check_shard(write(tmpdir, 'empty.blast', '')) == \
+           'empty report'
+    assert shards.check_shard(write(tmpdir, 'junk.blast', 'junk\n' * 10)) \
+           == 'not a BLAST report'
+
+def test_xml_report(tmpdir):
+    data = xml_report(['q0', 'q1', 'q2'])
+    complete = write(tmpdir, 'report.xml', data)
+    assert shards.check_shard(complete) is None
+    assert [ r.query_name for r in blastparser.parse_file(complete) ] == \
+           ['q0', 'q1', 'q2']
+
+    truncated = write(tmpdir, 'cut.xml', data[:data.rindex('<Hsp_evalue>')])
+    assert shards.check_shard(truncated) == \
+           'truncated: no closing </BlastOutput>'
+
+def test_tabular_report(tmpdir):
+    lines = tabular_lines(['q0', 'q1', 'q2'])
+    complete = write(tmpdir, 'report.tab', ''.join(lines))
+    assert shards.check_shard(complete) is None
+
+    for data in [''.join(lines)[:-1],             # no final newline
+                 ''.join(lines[:2]) + lines[2][:15] + '\n']:
+        truncated = write(tmpdir, 'cut.tab', data)
+        assert shards.check_shard(truncated) == \
+               'truncated: last line is incomplete'
+
+    header = '# BLASTN 2.2.18\n# Query: q0\n'
+    commented = write(tmpdir, 'report.tab7', header + ''.join(lines) +
+                      '# BLAST processed 3 queries\n')
+    assert shards.check_shard(commented) is None
+    truncated = write(tmpdir, 'cut.tab7', header + ''.join(lines))
+    assert shards.check_shard(truncated) == \
+           "truncated: no '# BLAST processed' line"
+
+def test_parse_shards_keeps_going(tmpdir):
+    for i in range(4):
+        write_report(str(tmpdir.join('chunk%d.blast' % i)), queries=10,
+                     hits=2, hsps=1, length=60, seed=i,
+                     query_prefix='c%dq' % i)
+    bad = cut_last_alignment(str(tmpdir.join('chunk2.blast')))
+
+    pattern = str(tmpdir.join('chunk*.blast'))
+    for order in shards.ORDERS:
+        problems = []
+        names = [ r.query_name for r in
+                  shards.parse_shards([pattern], jobs=2, order=order,
+                                      problems=problems, compact=True) ]
+        assert len(problems) == 1
+        assert problems[0].filename == bad
+        assert problems[0].index == 2
+        assert problems[0].records == 9
+
+        expected = [ 'c%dq%d' % (i, n) for i in range(4) for n in range(10)
+                     if (i, n) != (2, 9) ]
+        if order == 'query':
+            expected.sort()
+        assert names == expected
+
+def test_query_order_reports_problems_before_merging(tmpdir):
+    for i in range(3):
+        write_report(str(tmpdir.join('chunk%d.blast' % i)), queries=5,
+                     hits=2, hsps=1, length=60, seed=i,
+                     query_prefix='c%dq' % i)
+    bad = cut_last_alignment(str(tmpdir.join('chunk1.blast')))
+
+    problems = []
+    records = shards.parse_shards([str(tmpdir.join('chunk*.blast'))],
+                                  jobs=2, order='query', problems=problems)
+    assert next(records).query_name == 'c0q0'
+    assert [ p.filename for p in problems ] == [bad]
+    records.close()
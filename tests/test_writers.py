@@ -0,0 +1,53 @@
+"""
+The 'columns' output format reads back what was written.
+"""
+
+import struct
+
+import writers
+
+COLUMNS = [('query', 'str'), ('subject', 'str'), ('start', 'int'),
+           ('score', 'float')]
+
+def write_columns(filename, rows, batch_size=10):
+    fp = open(filename, 'wb')
+    w = writers.open_writer('columns', fp, COLUMNS, batch_size)
+    w.write_rows(rows)
+    w.close()
+    fp.close()
+
+def read_rows(filename):
+    rows = []
+    fp = open(filename, 'rb')
+    try:
+        for batch in writers.read_columns(fp):
+            rows.extend(zip(*[ batch[name] for name, _ in COLUMNS ]))
+    finally:
+        fp.close()
+    return rows
+
+def test_columns_round_trip(tmpdir):
+    rows = [ ('q%d' % i, i % 3 and 's%d' % i or '', 100000 * i, i / 7.)
+             for i in range(25) ]
+    filename = str(tmpdir.join('hsps.columns'))
+    write_columns(filename, rows)
+    assert read_rows(filename) == rows
+
+def test_columns_header(tmpdir):
+    filename = str(tmpdir.join('hsps.columns'))
+    write_columns(filename, [])
+    data = open(filename, 'rb').read()
+    assert data.startswith(writers.MAGIC)
+    assert not data.startswith('BLASTCOL')    # blastcache's magic
+    assert read_rows(filename) == []
+
+    # integers of a size no array typecode has
+    fp = open(filename, 'wb')
+    fp.write(data[:12] + struct.pack('<B', 3) + data[13:])
+    fp.close()
+    try:
+        read_rows(filename)
+    except ValueError:
+        pass
+    else:
+        assert 0, 'no ValueError'